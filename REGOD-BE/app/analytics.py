@@ -0,0 +1,254 @@
+from sqlalchemy import select, update, func, or_, values, column, literal_column, Integer, Float
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.models import (
+    Course, Module, StudentTeacherAccess, UserCourseProgress,
+    UserModuleProgress, CourseAnalytics, ModuleAnalytics
+)
+from app.stats import COMPLETED_PERCENTAGE
+
+COURSE_FIELDS = ("enrolled", "started", "completed", "progress_sum")
+MODULE_FIELDS = ("started", "completed")
+
+STARTED_MODULE_STATUSES = ("in_progress", "completed")
+
+
+def _course_flags(percentage: Optional[float]) -> Tuple[int, int, float]:
+    """(started, completed, progress) contribution of one progress row"""
+    if percentage is None:
+        return 0, 0, 0.0
+    return int(percentage > 0), int(percentage >= COMPLETED_PERCENTAGE), percentage
+
+
+def _module_flags(status: Optional[str]) -> Tuple[int, int]:
+    """(started, completed) contribution of one module progress row"""
+    return int(status in STARTED_MODULE_STATUSES), int(status == "completed")
+
+
+def record_course_progress(db: Session, changes: Dict[int, Tuple[Optional[float], float]]):
+    """Fold course progress transitions into the rollups.
+
+    ``changes`` maps course IDs to ``(old_percentage, new_percentage)``, with
+    ``None`` for a row that did not exist. Runs in the caller's transaction;
+    courses without a rollup row yet are skipped, since that row is computed
+    from scratch the first time it is read.
+    """
+    rows = []
+    for course_id, (old, new) in changes.items():
+        old_started, old_completed, old_progress = _course_flags(old)
+        new_started, new_completed, new_progress = _course_flags(new)
+        delta = (new_started - old_started, new_completed - old_completed, new_progress - old_progress)
+        if any(delta):
+            rows.append((course_id, *delta))
+    if not rows:
+        return
+
+    delta = values(
+        column("course_id", Integer), column("started", Integer),
+        column("completed", Integer), column("progress", Float),
+        name="course_delta"
+    ).data(rows)
+    db.execute(
+        update(CourseAnalytics)
+        .where(CourseAnalytics.course_id == delta.c.course_id)
+        .values(
+            started=func.greatest(CourseAnalytics.started + delta.c.started, 0),
+            completed=func.greatest(CourseAnalytics.completed + delta.c.completed, 0),
+            progress_sum=func.greatest(CourseAnalytics.progress_sum + delta.c.progress, 0)
+        ),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def record_module_progress(db: Session, changes: Dict[int, Tuple[Optional[str], str]]):
+    """Fold module status transitions ``(old_status, new_status)`` into the rollups"""
+    rows = []
+    for module_id, (old, new) in changes.items():
+        old_started, old_completed = _module_flags(old)
+        new_started, new_completed = _module_flags(new)
+        if (old_started, old_completed) != (new_started, new_completed):
+            rows.append((module_id, new_started - old_started, new_completed - old_completed))
+    if not rows:
+        return
+
+    delta = values(
+        column("module_id", Integer), column("started", Integer), column("completed", Integer),
+        name="module_delta"
+    ).data(rows)
+    db.execute(
+        update(ModuleAnalytics)
+        .where(ModuleAnalytics.module_id == delta.c.module_id)
+        .values(
+            started=func.greatest(ModuleAnalytics.started + delta.c.started, 0),
+            completed=func.greatest(ModuleAnalytics.completed + delta.c.completed, 0)
+        ),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def record_enrollment(db: Session, teacher_id, delta: int):
+    """Adjust the enrolled count of every course owned by a teacher"""
+    db.execute(
+        update(CourseAnalytics)
+        .where(CourseAnalytics.course_id.in_(
+            select(Course.id).where(Course.created_by == teacher_id)
+        ))
+        .values(enrolled=func.greatest(CourseAnalytics.enrolled + delta, 0)),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def _computed_course_analytics(course_ids: List[int]):
+    """SELECT the true course rollups for a set of courses"""
+    enrolled = (
+        select(func.count())
+        .select_from(StudentTeacherAccess)
+        .where(
+            StudentTeacherAccess.teacher_id == Course.created_by,
+            StudentTeacherAccess.is_active == True
+        )
+        .scalar_subquery()
+    )
+    progress = (
+        select(
+            UserCourseProgress.course_id,
+            func.count().filter(UserCourseProgress.progress_percentage > 0).label("started"),
+            func.count().filter(
+                UserCourseProgress.progress_percentage >= COMPLETED_PERCENTAGE
+            ).label("completed"),
+            func.sum(UserCourseProgress.progress_percentage).label("progress_sum")
+        )
+        .where(UserCourseProgress.course_id.in_(course_ids))
+        .group_by(UserCourseProgress.course_id)
+        .subquery()
+    )
+    return (
+        select(
+            Course.id.label("course_id"),
+            enrolled.label("enrolled"),
+            func.coalesce(progress.c.started, 0).label("started"),
+            func.coalesce(progress.c.completed, 0).label("completed"),
+            func.coalesce(progress.c.progress_sum, 0).label("progress_sum")
+        )
+        .outerjoin(progress, progress.c.course_id == Course.id)
+        .where(Course.id.in_(course_ids))
+    )
+
+
+def _computed_module_analytics(course_ids: List[int]):
+    """SELECT the true module rollups for every module of a set of courses"""
+    progress = (
+        select(
+            UserModuleProgress.module_id,
+            func.count().filter(
+                UserModuleProgress.status.in_(STARTED_MODULE_STATUSES)
+            ).label("started"),
+            func.count().filter(UserModuleProgress.status == "completed").label("completed")
+        )
+        .where(UserModuleProgress.course_id.in_(course_ids))
+        .group_by(UserModuleProgress.module_id)
+        .subquery()
+    )
+    return (
+        select(
+            Module.id.label("module_id"),
+            Module.course_id,
+            func.coalesce(progress.c.started, 0).label("started"),
+            func.coalesce(progress.c.completed, 0).label("completed")
+        )
+        .outerjoin(progress, progress.c.module_id == Module.id)
+        .where(Module.course_id.in_(course_ids))
+    )
+
+
+def _upsert_rollups(db: Session, model, key, fields, computed, only_drifted: bool) -> int:
+    """Write recomputed rollup rows and return how many were written"""
+    stmt = insert(model).from_select(computed.selected_columns.keys(), computed)
+    if only_drifted:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={field: getattr(stmt.excluded, field) for field in fields} | {"updated_at": func.now()},
+            where=or_(*[getattr(model, field) != getattr(stmt.excluded, field) for field in fields])
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+    return len(db.execute(stmt.returning(literal_column("1"))).all())
+
+
+def refresh_course_analytics(db: Session, course_ids: List[int], only_drifted: bool = True) -> int:
+    """Recompute the course and module rollups for the given courses"""
+    written = _upsert_rollups(
+        db, CourseAnalytics, CourseAnalytics.course_id, COURSE_FIELDS,
+        _computed_course_analytics(course_ids), only_drifted
+    )
+    written += _upsert_rollups(
+        db, ModuleAnalytics, ModuleAnalytics.module_id, MODULE_FIELDS,
+        _computed_module_analytics(course_ids), only_drifted
+    )
+    return written
+
+
+def get_course_analytics(db: Session, course_ids: Iterable[int]):
+    """Load rollups for a set of courses, initializing any that are missing.
+
+    Returns ``(course_rollups, module_rollups)`` keyed by course ID, where
+    module rollups are a list per course.
+    """
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}, {}
+
+    have_course = set(db.scalars(
+        select(CourseAnalytics.course_id).where(CourseAnalytics.course_id.in_(course_ids))
+    ).all())
+    missing_modules = set(db.scalars(
+        select(Module.course_id).distinct()
+        .outerjoin(ModuleAnalytics, ModuleAnalytics.module_id == Module.id)
+        .where(Module.course_id.in_(course_ids), ModuleAnalytics.module_id.is_(None))
+    ).all())
+    missing = (set(course_ids) - have_course) | missing_modules
+    if missing:
+        refresh_course_analytics(db, list(missing), only_drifted=False)
+        db.commit()
+
+    courses = {
+        row.course_id: row
+        for row in db.scalars(
+            select(CourseAnalytics).where(CourseAnalytics.course_id.in_(course_ids))
+        ).all()
+    }
+    modules: Dict[int, list] = {}
+    for row in db.execute(
+        select(ModuleAnalytics, Module.title, Module.order)
+        .join(Module, Module.id == ModuleAnalytics.module_id)
+        .where(ModuleAnalytics.course_id.in_(course_ids), Module.is_active == True)
+        .order_by(ModuleAnalytics.course_id, Module.order, Module.id)
+    ).all():
+        modules.setdefault(row.ModuleAnalytics.course_id, []).append(row)
+    return courses, modules
+
+
+def refresh_analytics(db: Session, batch_size: int = 100) -> int:
+    """Recompute every course's rollups in batches, fixing any that drifted.
+
+    Intended to run on a schedule (see scripts/refresh_analytics.py). Commits
+    after each batch of courses and returns the number of rows corrected or
+    created.
+    """
+    refreshed = 0
+    last_id = None
+    while True:
+        query = select(Course.id).order_by(Course.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(Course.id > last_id)
+        course_ids = db.scalars(query).all()
+        if not course_ids:
+            break
+
+        refreshed += refresh_course_analytics(db, course_ids, only_drifted=True)
+        db.commit()
+        last_id = course_ids[-1]
+
+    return refreshed
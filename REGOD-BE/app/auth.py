@@ -5,6 +5,7 @@ import requests
 from app.database import get_db
 from app.models import User
 from app.clerk import clerk_client
+from app.stats import create_user_stats
 import os
 import hmac
 import hashlib
@@ -65,6 +66,10 @@ async def get_current_user(
         )
 
     token = authorization.split(" ")[1]
+    return get_user_from_token(token, db)
+
+def get_user_from_token(token: str, db: Session) -> User:
+    """Verify a Clerk JWT and return the local DB user (create if not exists)."""
     decoded = verify_clerk_token(token)
     clerk_user_id = decoded.get("sub")
 
@@ -91,6 +96,8 @@ async def get_current_user(
             is_verified=True,
         )
         db.add(user)
+        db.flush()
+        create_user_stats(db, user.id)
         db.commit()
         db.refresh(user)
 
@@ -144,6 +151,8 @@ async def clerk_webhook(request: Request, db: Session = Depends(get_db)):
                     is_verified=True,
                 )
                 db.add(user)
+                db.flush()
+                create_user_stats(db, user.id)
                 db.commit()
                 db.refresh(user)
 
@@ -0,0 +1,95 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Request, Response
+
+from app.compression import brotli, negotiate_encoding
+
+
+class CachedPayload:
+    """A serialized JSON payload stored together with its compressed encodings"""
+    __slots__ = ("version", "etag", "body", "gzip_body", "br_body")
+
+    def __init__(self, key: str, version: int, body: bytes):
+        self.version = version
+        self.etag = f'"{key}-v{version}"'
+        self.body = body
+        # Compressed once per version, so spend the extra CPU on the best ratio
+        self.gzip_body = gzip.compress(body, compresslevel=9)
+        self.br_body = brotli.compress(body, quality=11) if brotli is not None else None
+
+    def encoded(self, encoding: Optional[str]) -> Optional[bytes]:
+        """The stored body for a content coding, or None if not stored"""
+        if encoding == "br":
+            return self.br_body
+        if encoding == "gzip":
+            return self.gzip_body
+        return None
+
+
+class PayloadCache:
+    """In-process LRU of serialized payloads keyed by name and version.
+
+    Entries are never invalidated explicitly: callers look up the current
+    version from the database and a version mismatch is treated as a miss.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedPayload]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: int) -> Optional[CachedPayload]:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None or payload.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key: str, version: int, body: bytes) -> CachedPayload:
+        payload = CachedPayload(key, version, body)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+course_catalog_cache = PayloadCache(int(os.getenv("COURSE_CATALOG_CACHE_SIZE", "256")))
+
+
+def cached_payload_response(
+    request: Request,
+    payload: CachedPayload,
+    cache_control: str = "private, no-cache"
+) -> Response:
+    """Serve a cached payload as stored bytes, honouring ETags and content codings.
+
+    The stored encodings are sent with Content-Encoding already set, so the
+    compression middleware passes them through without spending CPU.
+    """
+    headers = {
+        "ETag": payload.etag,
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+
+    if request.headers.get("if-none-match") == payload.etag:
+        return Response(status_code=304, headers=headers)
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    encoded = payload.encoded(encoding)
+    if encoded is not None:
+        headers["Content-Encoding"] = encoding
+        return Response(content=encoded, media_type="application/json", headers=headers)
+
+    return Response(content=payload.body, media_type="application/json", headers=headers)
@@ -0,0 +1,15 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from typing import Iterable
+
+from app.models import SyncTombstone
+
+
+def record_tombstones(db: Session, entity: str, user_id, entity_ids: Iterable[int]):
+    """Record hard-deleted rows in the same transaction as the delete"""
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "user_id": user_id}
+        for entity_id in entity_ids
+    ]
+    if rows:
+        db.execute(insert(SyncTombstone), rows)
@@ -0,0 +1,204 @@
+import os
+import time
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Share of one core the process may spend compressing responses (0 disables the limit)
+COMPRESSION_CPU_BUDGET = float(os.getenv("COMPRESSION_CPU_BUDGET", "0.5"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[name] = quality
+    return codings
+
+
+def negotiate_encoding(header: str) -> Optional[str]:
+    """Pick "br" or "gzip" for a request, preferring brotli on equal q-values"""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    options = []
+    if brotli is not None:
+        options.append((codings.get("br", wildcard), 1, "br"))
+    options.append((codings.get("gzip", wildcard), 0, "gzip"))
+    quality, _, encoding = max(options)
+    return encoding if quality > 0 else None
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or content_type.split(";")[0].endswith("+json")
+
+
+class CompressionBudget:
+    """Token bucket of compression CPU time.
+
+    Refills at ``cpu_share`` seconds per wall-clock second, up to one
+    second's worth. While the bucket is empty responses go out uncompressed,
+    so a burst of large responses cannot starve request handling.
+    """
+
+    def __init__(self, cpu_share: float):
+        self.cpu_share = cpu_share
+        self.tokens = cpu_share
+        self.updated = time.monotonic()
+
+    def available(self) -> bool:
+        if self.cpu_share <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.cpu_share, self.tokens + (now - self.updated) * self.cpu_share)
+        self.updated = now
+        return self.tokens > 0
+
+    def charge(self, seconds: float):
+        if self.cpu_share > 0:
+            self.tokens -= seconds
+
+
+class _Compressor:
+    """Incremental gzip or brotli encoder that tracks the CPU it spends"""
+
+    def __init__(self, encoding: str, budget: CompressionBudget, gzip_level: int, brotli_quality: int):
+        self.budget = budget
+        if encoding == "br":
+            self._encoder = brotli.Compressor(quality=brotli_quality)
+            self._compress = self._encoder.process
+            self._flush = self._encoder.finish
+        else:
+            self._encoder = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._compress = self._encoder.compress
+            self._flush = self._encoder.flush
+
+    def __call__(self, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        chunk = self._compress(data) if data else b""
+        chunk += self._flush() if final else b""
+        self.budget.charge(time.thread_time() - started)
+        return chunk
+
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli response compression.
+
+    Skips responses that are small, not text-like, already encoded (such
+    as precompressed cache entries) or produced while the CPU budget is
+    exhausted. Streaming responses are compressed chunk by chunk. Strong
+    ETags on compressed responses are made weak.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MIN_SIZE,
+        gzip_level: int = COMPRESSION_GZIP_LEVEL,
+        brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+        cpu_budget: float = COMPRESSION_CPU_BUDGET
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.budget = CompressionBudget(cpu_budget)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows what we are sending
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if (
+                    start_message["status"] < 200
+                    or start_message["status"] in (204, 304)
+                    or "content-encoding" in headers
+                    or not is_compressible(headers.get("content-type", ""))
+                    or (not more_body and len(body) < self.minimum_size)
+                    or not self.budget.available()
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding, self.budget, self.gzip_level, self.brotli_quality)
+                body = compressor(body, final=not more_body)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # A strong ETag promises these exact bytes, which are no longer the ones sent
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            await send({
+                "type": "http.response.body",
+                "body": compressor(body, final=not more_body),
+                "more_body": more_body
+            })
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Frames a socket may have waiting before it counts as a slow consumer
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# How long closing a slow or broken socket may take before it is abandoned
+CLOSE_TIMEOUT = 1.0
+
+# A connection that has sent nothing for WS_PING_INTERVAL is pinged; one that
+# stays silent for WS_IDLE_TIMEOUT is closed. Clients answer pings with any frame.
+PING_INTERVAL = int(os.getenv("WS_PING_INTERVAL", "25"))
+IDLE_TIMEOUT = int(os.getenv("WS_IDLE_TIMEOUT", "75"))
+REAP_INTERVAL = int(os.getenv("WS_REAP_INTERVAL", "5"))
+
+# Connection records are spread over this many dicts
+REGISTRY_SHARDS = int(os.getenv("WS_REGISTRY_SHARDS", "64"))
+
+# Policy violation is the closest standard code; clients should reconnect and resync
+SLOW_CONSUMER_CLOSE_CODE = 1008
+IDLE_CLOSE_CODE = 1001
+
+
+class SendMetrics:
+    """Outbound queue counters for one worker"""
+
+    __slots__ = ("queued", "sent", "send_errors", "slow_disconnects", "dropped", "max_queue_depth")
+
+    def __init__(self):
+        self.queued = 0  # frames accepted into a socket's queue
+        self.sent = 0  # frames written to a socket
+        self.send_errors = 0  # writes that failed; the socket is dropped
+        self.slow_disconnects = 0  # sockets closed because their queue filled up
+        self.dropped = 0  # frames discarded with a closed or overflowing socket
+        self.max_queue_depth = 0
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Connection:
+    """One accepted socket with a bounded outbound queue drained by its own writer.
+
+    ``send`` never waits: it queues the frame and returns, so a slow client
+    only delays itself. A socket whose queue fills up is a slow consumer and
+    is closed rather than allowed to hold frames (and memory) indefinitely.
+    ``on_close`` runs once when the writer gives up on the socket.
+
+    The queue and the writer task only exist while frames are waiting, so an
+    idle connection is just this record. ``last_seen`` is moved by ``touch``
+    whenever the client sends a frame and is what the idle reaper goes by.
+    ``threads`` maps the user's thread ids to the other participant, so
+    messages can be routed without looking the thread up.
+    """
+
+    __slots__ = (
+        "user_id", "websocket", "metrics", "role", "threads", "closed", "last_seen", "pinged_at",
+        "_queue_size", "_pending", "_on_close", "_writer", "_closer"
+    )
+
+    def __init__(self, user_id: str, websocket, metrics: SendMetrics, queue_size: int = SEND_QUEUE_SIZE,
+                 on_close: Optional[Callable[["Connection"], Awaitable[None]]] = None,
+                 role: Optional[str] = None, threads: Optional[Dict[str, str]] = None):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.metrics = metrics
+        self.role = role
+        self.threads = threads or {}
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.pinged_at = 0.0
+        self._queue_size = queue_size
+        self._pending: Optional[deque] = None
+        self._on_close = on_close
+        self._writer: Optional[asyncio.Task] = None
+        self._closer: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) if self._pending else 0
+
+    def touch(self):
+        """Record that the client is alive (any inbound frame)"""
+        self.last_seen = time.monotonic()
+
+    def counterpart(self, thread_id) -> Optional[str]:
+        """The other participant of one of the user's threads, or None if it is not theirs"""
+        return self.threads.get(str(thread_id))
+
+    def send(self, text: str) -> bool:
+        """Queue a frame; False if the socket is closed or was just closed for being slow"""
+        if self.closed:
+            self.metrics.dropped += 1
+            return False
+        if self._pending is None:
+            self._pending = deque()
+        elif len(self._pending) >= self._queue_size:
+            self.metrics.slow_disconnects += 1
+            self.metrics.dropped += len(self._pending) + 1
+            logger.warning(f"Closing slow WebSocket consumer for user {self.user_id}")
+            self._closer = asyncio.create_task(self._abort(SLOW_CONSUMER_CLOSE_CODE))
+            self.closed = True
+            return False
+
+        self._pending.append(text)
+        self.metrics.queued += 1
+        if len(self._pending) > self.metrics.max_queue_depth:
+            self.metrics.max_queue_depth = len(self._pending)
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+        return True
+
+    async def stop(self):
+        """Stop the writer once the socket has gone away; queued frames are dropped"""
+        self.closed = True
+        self._pending = None
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    async def close(self, code: int):
+        """Stop writing and close the socket, giving up on a peer that does not answer"""
+        await self.stop()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _write(self):
+        try:
+            while self._pending:
+                text = self._pending.popleft()
+                try:
+                    await self.websocket.send_text(text)
+                except Exception:
+                    self.metrics.send_errors += 1
+                    self.metrics.dropped += len(self._pending)
+                    self.closed = True
+                    await self._notify_closed()
+                    return
+                self.metrics.sent += 1
+        finally:
+            # Idle again: drop the buffer, the next send starts a new writer
+            self._writer = None
+            if not self._pending:
+                self._pending = None
+
+    async def _abort(self, code: int):
+        await self.close(code)
+        await self._notify_closed()
+
+    async def _notify_closed(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            await on_close(self)
+
+
+def _index_add(index: dict, key, connection: Connection):
+    # A key with one connection maps to it directly; a set only once there are more
+    current = index.get(key)
+    if current is None:
+        index[key] = connection
+    elif isinstance(current, set):
+        current.add(connection)
+    else:
+        index[key] = {current, connection}
+
+
+def _index_remove(index: dict, key, connection: Connection):
+    current = index.get(key)
+    if current is connection:
+        del index[key]
+    elif isinstance(current, set):
+        current.discard(connection)
+        if len(current) == 1:
+            index[key] = current.pop()
+
+
+def _index_get(index: dict, key) -> Tuple[Connection, ...]:
+    current = index.get(key)
+    if current is None:
+        return ()
+    if isinstance(current, set):
+        return tuple(current)
+    return (current,)
+
+
+class ConnectionRegistry:
+    """This worker's connections, indexed by socket, user, thread and role.
+
+    Records are spread over REGISTRY_SHARDS dicts keyed by socket. No single
+    dict has to be rehashed in one go as the worker grows past 100k sockets,
+    and a full scan (the reaper) can yield to the event loop between shards.
+    Every registration, removal and lookup is O(1) in the number of sockets.
+    """
+
+    def __init__(self, shards: int = REGISTRY_SHARDS):
+        self._shards: List[Dict[object, Connection]] = [{} for _ in range(shards)]
+        self._by_user: Dict[str, object] = {}
+        self._by_thread: Dict[str, object] = {}
+        self._by_role: Dict[str, object] = {}
+        self._role_counts: Dict[str, int] = {}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _shard(self, websocket) -> Dict[object, Connection]:
+        return self._shards[hash(websocket) % len(self._shards)]
+
+    def add(self, connection: Connection):
+        self._shard(connection.websocket)[connection.websocket] = connection
+        self._count += 1
+        _index_add(self._by_user, connection.user_id, connection)
+        for thread_id in connection.threads:
+            _index_add(self._by_thread, thread_id, connection)
+        if connection.role is not None:
+            _index_add(self._by_role, connection.role, connection)
+            self._role_counts[connection.role] = self._role_counts.get(connection.role, 0) + 1
+
+    def remove(self, websocket) -> Optional[Connection]:
+        connection = self._shard(websocket).pop(websocket, None)
+        if connection is None:
+            return None
+        self._count -= 1
+        _index_remove(self._by_user, connection.user_id, connection)
+        for thread_id in connection.threads:
+            _index_remove(self._by_thread, thread_id, connection)
+        if connection.role is not None:
+            _index_remove(self._by_role, connection.role, connection)
+            self._role_counts[connection.role] -= 1
+        return connection
+
+    def join_thread(self, connection: Connection, thread_id, other_id):
+        """Add a thread created after the socket connected"""
+        thread_id = str(thread_id)
+        if thread_id not in connection.threads:
+            connection.threads[thread_id] = str(other_id)
+            _index_add(self._by_thread, thread_id, connection)
+
+    def get(self, websocket) -> Optional[Connection]:
+        return self._shard(websocket).get(websocket)
+
+    def for_user(self, user_id) -> Tuple[Connection, ...]:
+        return _index_get(self._by_user, str(user_id))
+
+    def for_thread(self, thread_id) -> Tuple[Connection, ...]:
+        return _index_get(self._by_thread, str(thread_id))
+
+    def for_role(self, role: str) -> Tuple[Connection, ...]:
+        return _index_get(self._by_role, role)
+
+    def has_user(self, user_id) -> bool:
+        return str(user_id) in self._by_user
+
+    @property
+    def user_count(self) -> int:
+        return len(self._by_user)
+
+    @property
+    def thread_count(self) -> int:
+        return len(self._by_thread)
+
+    def role_counts(self) -> Dict[str, int]:
+        return {role: count for role, count in self._role_counts.items() if count}
+
+    def shards(self) -> Iterable[List[Connection]]:
+        """A snapshot of each shard in turn, for scans that yield in between"""
+        for shard in self._shards:
+            yield list(shard.values())
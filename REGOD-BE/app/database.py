@@ -38,6 +38,14 @@ def get_db():
     finally:
         db.close()
 
+def pool_stats() -> dict:
+    """Connections the pool holds, and how many are checked out right now"""
+    return {
+        "size": engine.pool.size(),
+        "checked_out": engine.pool.checkedout(),
+        "overflow": engine.pool.overflow(),
+    }
+
 def test_connection():
     """Test database connection"""
     try:
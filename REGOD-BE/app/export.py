@@ -0,0 +1,193 @@
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Course, Module, UserCourseProgress, UserModuleProgress, UserFavorite, UserNote
+from app.utils.helpers import encode_cursor
+
+# Rows fetched per query; each batch checks out its own short-lived session
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Exported in this order; a resume cursor names the entity and the last id sent
+EXPORT_ENTITIES = ("progress", "module_progress", "favorites", "notes")
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _export_query(entity: str):
+    """Projection for one entity; rows are filtered by user and ordered by id"""
+    if entity == "progress":
+        return select(
+            UserCourseProgress.id,
+            UserCourseProgress.course_id,
+            Course.title.label("course_title"),
+            UserCourseProgress.progress_percentage,
+            UserCourseProgress.last_visited_module_id,
+            UserCourseProgress.started_at,
+            UserCourseProgress.completed_at,
+            UserCourseProgress.last_visited_at
+        ).outerjoin(Course, Course.id == UserCourseProgress.course_id), UserCourseProgress
+    if entity == "module_progress":
+        return select(
+            UserModuleProgress.id,
+            UserModuleProgress.course_id,
+            UserModuleProgress.module_id,
+            Module.title.label("lesson_title"),
+            UserModuleProgress.status,
+            UserModuleProgress.completed_at
+        ).outerjoin(Module, Module.id == UserModuleProgress.module_id), UserModuleProgress
+    if entity == "favorites":
+        return select(
+            UserFavorite.id,
+            UserFavorite.lesson_id,
+            Module.title.label("lesson_title"),
+            Module.course_id,
+            Course.title.label("course_title"),
+            UserFavorite.created_at
+        ).outerjoin(Module, Module.id == UserFavorite.lesson_id).outerjoin(
+            Course, Course.id == Module.course_id
+        ), UserFavorite
+    return select(
+        UserNote.id,
+        UserNote.course_id,
+        Course.title.label("course_title"),
+        UserNote.lesson_id,
+        Module.title.label("lesson_title"),
+        UserNote.note_content,
+        UserNote.version,
+        UserNote.created_at,
+        UserNote.updated_at
+    ).outerjoin(Course, Course.id == UserNote.course_id).outerjoin(
+        Module, Module.id == UserNote.lesson_id
+    ), UserNote
+
+
+def export_plan(entities: Sequence[str], cursor: Optional[list]) -> List[Tuple[str, int]]:
+    """(entity, id to start after) for each entity still to export, or [] for a bad cursor.
+
+    A cursor of None starts at the beginning.
+    """
+    entities = [entity for entity in EXPORT_ENTITIES if entity in entities]
+    if cursor is None:
+        return [(entity, 0) for entity in entities]
+    if len(cursor) != 2 or cursor[0] not in entities or not isinstance(cursor[1], int):
+        return []
+    start = entities.index(cursor[0])
+    return [(cursor[0], cursor[1])] + [(entity, 0) for entity in entities[start + 1:]]
+
+
+def _export_batches(user_id, entity: str, after_id: int) -> Iterator[list]:
+    """Stream one entity's rows in keyset batches.
+
+    Each batch is read on its own session, which goes back to the pool
+    before the batch is yielded, so a slow client never holds a database
+    connection while the body is being sent.
+    """
+    query, model = _export_query(entity)
+    query = query.where(model.user_id == user_id).order_by(model.id).limit(EXPORT_BATCH_SIZE)
+
+    while True:
+        db = SessionLocal()
+        try:
+            batch = db.execute(query.where(model.id > after_id)).mappings().all()
+        finally:
+            db.close()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < EXPORT_BATCH_SIZE:
+            return
+        after_id = batch[-1]["id"]
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode_ndjson(entity: str, batches: Iterator[list]) -> Iterator[bytes]:
+    for batch in batches:
+        yield b"".join(
+            orjson.dumps({"entity": entity, "cursor": encode_cursor(entity, row["id"]), **row}) + b"\n"
+            for row in batch
+        )
+
+
+def _encode_csv(entity: str, batches: Iterator[list]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    query, _ = _export_query(entity)
+    writer.writerow(["cursor"] + [column.name for column in query.selected_columns])
+    for batch in batches:
+        for row in batch:
+            writer.writerow([encode_cursor(entity, row["id"])] + [_csv_value(value) for value in row.values()])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+_ENCODERS = {
+    "ndjson": _encode_ndjson,
+    "csv": _encode_csv,
+}
+
+
+def stream_export(user_id, plan: List[Tuple[str, int]], export_format: str) -> Iterator[bytes]:
+    """All planned entities as one NDJSON or CSV stream"""
+    encode = _ENCODERS[export_format]
+    for entity, after_id in plan:
+        yield from encode(entity, _export_batches(user_id, entity, after_id))
+
+
+class _ZipSink:
+    """Write-only file object zipfile streams into; the generator drains it as it goes"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_export_zip(user_id, plan: List[Tuple[str, int]], export_format: str) -> Iterator[bytes]:
+    """A zip with one member per entity, built and sent incrementally.
+
+    The sink is not seekable, so zipfile writes each member with a trailing
+    data descriptor instead of going back to patch its header.
+    """
+    encode = _ENCODERS[export_format]
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for entity, after_id in plan:
+            with archive.open(f"{entity}.{export_format}", mode="w", force_zip64=True) as member:
+                for chunk in encode(entity, _export_batches(user_id, entity, after_id)):
+                    member.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    # Remaining member data, descriptors and the central directory
+    yield sink.drain()
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Iterable, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import UserFavorite
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+FAVORITE_CACHE_SIZE = int(os.getenv("FAVORITE_CACHE_SIZE", "10000"))
+FAVORITE_CACHE_TTL = int(os.getenv("FAVORITE_CACHE_TTL", "300"))
+# Without Redis each worker has its own copy and only sees its own writes,
+# so entries live just long enough to serve a burst of listings
+FAVORITE_CACHE_LOCAL_TTL = int(os.getenv("FAVORITE_CACHE_LOCAL_TTL", "5"))
+# How long a write to a user who is not cached keeps a load from caching stale IDs
+FAVORITE_CACHE_LOAD_GUARD = 30
+
+
+def _load_favorite_ids(db: Session, user_id) -> List[int]:
+    return db.scalars(
+        select(UserFavorite.lesson_id)
+        .where(UserFavorite.user_id == user_id)
+        .order_by(UserFavorite.lesson_id)
+    ).all()
+
+
+def _contains(ids: array, lesson_id: int) -> bool:
+    index = bisect_left(ids, lesson_id)
+    return index < len(ids) and ids[index] == lesson_id
+
+
+class LocalFavoriteCache:
+    """Per-worker LRU of each user's favourite lesson IDs as a sorted ``array('i')``.
+
+    Writes made through this worker update the array in place; writes made
+    by other workers show up once the entry's TTL runs out, which is why it
+    defaults to a few seconds. Set REDIS_URL to share one cache between
+    workers in multi-worker deployments.
+    """
+
+    def __init__(self, max_users: int, ttl: int):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def flags(self, db: Session, user_id, lesson_ids: Iterable[int]) -> List[bool]:
+        """Whether each lesson is one of the user's favourites"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return [_contains(entry[1], lesson_id) for lesson_id in lesson_ids]
+
+        ids = array("i", _load_favorite_ids(db, user_id))
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, ids)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+            return [_contains(ids, lesson_id) for lesson_id in lesson_ids]
+
+    def add(self, user_id, lesson_ids: Iterable[int]):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                for lesson_id in lesson_ids:
+                    if not _contains(entry[1], lesson_id):
+                        insort(entry[1], lesson_id)
+
+    def remove(self, user_id, lesson_ids: Iterable[int]):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                for lesson_id in lesson_ids:
+                    index = bisect_left(entry[1], lesson_id)
+                    if index < len(entry[1]) and entry[1][index] == lesson_id:
+                        del entry[1][index]
+
+
+class RedisFavoriteCache:
+    """Each user's favourite lesson IDs as a Redis set shared by all workers.
+
+    A loaded set always holds the sentinel member 0 (lesson IDs start at 1),
+    so a user with no favourites is still told apart from a cache miss.
+    Redis errors fall back to reading the database.
+
+    Updates only touch sets that are already loaded. A load is only stored
+    if no set was loaded in the meantime and no update arrived while the
+    user was not cached; either could mean the IDs read are already stale.
+    """
+
+    # KEYS: set, load guard; ARGV: guard seconds, lesson IDs...
+    _ADD_IF_LOADED = """
+        if redis.call('exists', KEYS[1]) == 1 then return redis.call('sadd', KEYS[1], unpack(ARGV, 2)) end
+        redis.call('set', KEYS[2], 1, 'EX', ARGV[1])
+        return 0
+    """
+    _REMOVE_IF_LOADED = """
+        if redis.call('exists', KEYS[1]) == 1 then return redis.call('srem', KEYS[1], unpack(ARGV, 2)) end
+        redis.call('set', KEYS[2], 1, 'EX', ARGV[1])
+        return 0
+    """
+    # KEYS: set, load guard; ARGV: ttl, 0, lesson IDs...
+    _LOAD_IF_ABSENT = """
+        if redis.call('exists', KEYS[1]) == 1 or redis.call('exists', KEYS[2]) == 1 then return 0 end
+        redis.call('sadd', KEYS[1], unpack(ARGV, 2))
+        redis.call('expire', KEYS[1], ARGV[1])
+        return 1
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url)
+        self._add = self.client.register_script(self._ADD_IF_LOADED)
+        self._remove = self.client.register_script(self._REMOVE_IF_LOADED)
+        self._load = self.client.register_script(self._LOAD_IF_ABSENT)
+
+    @staticmethod
+    def _key(user_id) -> str:
+        return f"favorites:{user_id}"
+
+    @staticmethod
+    def _guard_key(user_id) -> str:
+        return f"favorites:{user_id}:written"
+
+    def flags(self, db: Session, user_id, lesson_ids: Iterable[int]) -> List[bool]:
+        """Whether each lesson is one of the user's favourites"""
+        lesson_ids = list(lesson_ids)
+        if not lesson_ids:
+            return []
+        key = self._key(user_id)
+        try:
+            loaded, members = self.client.pipeline().exists(key).smismember(key, lesson_ids).execute()
+            if loaded:
+                return [bool(member) for member in members]
+        except redis.RedisError:
+            ids = set(_load_favorite_ids(db, user_id))
+            return [lesson_id in ids for lesson_id in lesson_ids]
+
+        ids = _load_favorite_ids(db, user_id)
+        try:
+            self._load(keys=[key, self._guard_key(user_id)], args=[self.ttl, 0, *ids])
+        except redis.RedisError:
+            pass
+        ids = set(ids)
+        return [lesson_id in ids for lesson_id in lesson_ids]
+
+    def add(self, user_id, lesson_ids: Iterable[int]):
+        lesson_ids = list(lesson_ids)
+        if lesson_ids:
+            try:
+                self._add(keys=[self._key(user_id), self._guard_key(user_id)],
+                          args=[FAVORITE_CACHE_LOAD_GUARD, *lesson_ids])
+            except redis.RedisError:
+                pass
+
+    def remove(self, user_id, lesson_ids: Iterable[int]):
+        lesson_ids = list(lesson_ids)
+        if lesson_ids:
+            try:
+                self._remove(keys=[self._key(user_id), self._guard_key(user_id)],
+                             args=[FAVORITE_CACHE_LOAD_GUARD, *lesson_ids])
+            except redis.RedisError:
+                pass
+
+
+def _create_favorite_cache():
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        if redis is None:
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+        return RedisFavoriteCache(redis_url, FAVORITE_CACHE_TTL)
+    return LocalFavoriteCache(FAVORITE_CACHE_SIZE, FAVORITE_CACHE_LOCAL_TTL)
+
+
+favorite_cache = _create_favorite_cache()
@@ -1,16 +1,22 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 import time
 
 from app.database import engine, get_db, test_connection
 from app import models
-from app.routes import auth, courses, favorites, chat, profile, admin, teacher_codes, clerk_webhooks
+from app.routes import auth, courses, favorites, chat, profile, admin, teacher_codes, clerk_webhooks, sync, analytics, export
 from app.rbac import initialize_rbac
+from app.migrations import run_migrations
+from app.compression import CompressionMiddleware
+from app.pubsub import fanout
+from app.presence import presence, typing_throttle
 
-# Create database tables
+# Create database tables, then bring existing ones up to date
 try:
     models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     print("Database tables created successfully")
 except Exception as e:
     print(f"Error creating database tables: {e}")
@@ -18,6 +24,7 @@ except Exception as e:
     time.sleep(2)
     try:
         models.Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
         print("Database tables created on retry")
     except Exception as e2:
         print(f"Failed to create database tables after retry: {e2}")
@@ -27,7 +34,8 @@ app = FastAPI(
     version="1.0.0",
     description="A comprehensive learning platform backend with Clerk authentication",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -39,6 +47,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated gzip/brotli for large responses
+app.add_middleware(CompressionMiddleware)
+
 # Initialize RBAC system on startup
 @app.on_event("startup")
 async def startup_event():
@@ -57,6 +68,16 @@ async def startup_event():
         print(f"Error initializing RBAC: {e}")
     finally:
         db.close()
+    
+    # Route WebSocket messages between workers
+    await fanout.start()
+    await presence.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await typing_throttle.stop()
+    await presence.stop()
+    await fanout.stop()
 
 # Health check endpoint
 @app.get("/health")
@@ -78,7 +99,10 @@ app.include_router(chat.router, prefix="/api/connect", tags=["Connect"])
 app.include_router(profile.router, prefix="/api/user", tags=["Profile"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 app.include_router(teacher_codes.router, prefix="/api", tags=["Teacher Codes"])
+app.include_router(analytics.router, prefix="/api/teacher", tags=["Teacher Analytics"])
 app.include_router(clerk_webhooks.router, prefix="/api", tags=["Clerk Webhooks"])
+app.include_router(sync.router, prefix="/api/sync", tags=["Sync"])
+app.include_router(export.router, prefix="/api/user", tags=["Export"])
 
 @app.get("/")
 async def root():
@@ -0,0 +1,173 @@
+from sqlalchemy.engine import Engine
+
+from app.stats import backfill_user_stats
+
+# Base.metadata.create_all only creates missing tables. Columns, constraints
+# and indexes added to tables that already exist are brought in here. Every
+# step is idempotent and they all run in order on startup, after create_all.
+MIGRATIONS = [
+    # Unique keys for the sync upserts (ON CONFLICT ON CONSTRAINT). The old
+    # find-or-create could race and insert duplicates, which would stop the
+    # constraint from being added, so those are removed first.
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_user_course_progress_user_course') THEN
+            -- Keep the most advanced row per user and course
+            DELETE FROM user_course_progress p
+            USING (
+                SELECT id, row_number() OVER (
+                    PARTITION BY user_id, course_id
+                    ORDER BY completed_at IS NULL, progress_percentage DESC NULLS LAST,
+                        last_visited_at DESC NULLS LAST, id
+                ) AS rank
+                FROM user_course_progress
+                WHERE user_id IS NOT NULL AND course_id IS NOT NULL
+            ) ranked
+            WHERE p.id = ranked.id AND ranked.rank > 1;
+            ALTER TABLE user_course_progress
+                ADD CONSTRAINT uq_user_course_progress_user_course UNIQUE (user_id, course_id);
+        END IF;
+
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_user_module_progress_user_module') THEN
+            DELETE FROM user_module_progress p
+            USING (
+                SELECT id, row_number() OVER (
+                    PARTITION BY user_id, module_id
+                    ORDER BY CASE status WHEN 'completed' THEN 0 WHEN 'in_progress' THEN 1 ELSE 2 END,
+                        completed_at DESC NULLS LAST, id
+                ) AS rank
+                FROM user_module_progress
+                WHERE user_id IS NOT NULL AND module_id IS NOT NULL
+            ) ranked
+            WHERE p.id = ranked.id AND ranked.rank > 1;
+            ALTER TABLE user_module_progress
+                ADD CONSTRAINT uq_user_module_progress_user_module UNIQUE (user_id, module_id);
+        END IF;
+
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_user_favorites_user_lesson') THEN
+            -- Keep the first favourite of each lesson
+            DELETE FROM user_favorites f
+            USING (
+                SELECT id, row_number() OVER (PARTITION BY user_id, lesson_id ORDER BY id) AS rank
+                FROM user_favorites
+                WHERE user_id IS NOT NULL AND lesson_id IS NOT NULL
+            ) ranked
+            WHERE f.id = ranked.id AND ranked.rank > 1;
+            ALTER TABLE user_favorites
+                ADD CONSTRAINT uq_user_favorites_user_lesson UNIQUE (user_id, lesson_id);
+        END IF;
+    END $$;
+    CREATE INDEX IF NOT EXISTS ix_user_course_progress_course ON user_course_progress (course_id);
+    CREATE INDEX IF NOT EXISTS ix_user_module_progress_course ON user_module_progress (course_id);
+    """,
+    # Catalog version, bumped on edits; keys the precompressed course bundle
+    """
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+    """,
+    # Change sequences for delta sync. Adding the column with its default
+    # gives every existing row its own value from the sequence. Existing rows
+    # were committed long ago, so their transaction id is recorded as 0.
+    """
+    CREATE SEQUENCE IF NOT EXISTS sync_change_seq;
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('sync_change_seq');
+    ALTER TABLE modules ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('sync_change_seq');
+    ALTER TABLE user_favorites ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('sync_change_seq');
+    ALTER TABLE user_notes ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('sync_change_seq');
+    ALTER TABLE student_teacher_access
+        ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('sync_change_seq');
+
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE modules ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE user_favorites ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE user_notes ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE student_teacher_access ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE sync_tombstones ADD COLUMN IF NOT EXISTS change_xid bigint NOT NULL DEFAULT 0;
+    ALTER TABLE courses ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+    ALTER TABLE modules ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+    ALTER TABLE user_favorites ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+    ALTER TABLE user_notes ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+    ALTER TABLE student_teacher_access ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+    ALTER TABLE sync_tombstones ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id()::text::bigint;
+
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS updated_at timestamptz;
+    UPDATE courses SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL;
+    ALTER TABLE courses ALTER COLUMN updated_at SET DEFAULT now();
+    ALTER TABLE modules ADD COLUMN IF NOT EXISTS updated_at timestamptz DEFAULT now();
+    UPDATE user_notes SET updated_at = created_at WHERE updated_at IS NULL;
+    ALTER TABLE user_notes ALTER COLUMN updated_at SET DEFAULT now();
+
+    CREATE INDEX IF NOT EXISTS ix_courses_created_by_sync ON courses (created_by, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS ix_modules_course_sync ON modules (course_id, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS ix_user_favorites_user_sync ON user_favorites (user_id, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS ix_user_notes_user_sync ON user_notes (user_id, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS ix_student_teacher_access_student_sync
+        ON student_teacher_access (student_id, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS ix_sync_tombstones_user_sync ON sync_tombstones (user_id, change_xid, change_seq);
+    """,
+    # Keyset index for the favourites listing
+    """
+    CREATE INDEX IF NOT EXISTS ix_user_favorites_user_created ON user_favorites (user_id, created_at DESC, id DESC);
+    """,
+    # Notes listing and full-text search
+    """
+    CREATE INDEX IF NOT EXISTS ix_user_notes_user_id ON user_notes (user_id, id);
+    CREATE INDEX IF NOT EXISTS ix_user_notes_user_course_id ON user_notes (user_id, course_id, id);
+    CREATE INDEX IF NOT EXISTS ix_user_notes_user_lesson_id ON user_notes (user_id, lesson_id, id);
+    CREATE INDEX IF NOT EXISTS ix_user_notes_content_fts
+        ON user_notes USING gin (to_tsvector('english'::regconfig, note_content));
+    """,
+    # Note versions for autosave patches
+    """
+    ALTER TABLE user_notes ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+    """,
+    # Keyset index for chat history
+    """
+    CREATE INDEX IF NOT EXISTS ix_chat_messages_thread_timestamp_id
+        ON chat_messages (thread_id, timestamp DESC, id DESC);
+    """,
+    # Unread counters per thread participant. Threads without rows are
+    # counted from their messages on first read (app.unread).
+    """
+    CREATE TABLE IF NOT EXISTS chat_thread_participants (
+        thread_id integer REFERENCES chat_threads(id) ON DELETE CASCADE,
+        user_id uuid REFERENCES users(id) ON DELETE CASCADE,
+        unread_count integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (thread_id, user_id)
+    );
+    CREATE INDEX IF NOT EXISTS ix_chat_thread_participants_user ON chat_thread_participants (user_id);
+    CREATE INDEX IF NOT EXISTS ix_chat_threads_user ON chat_threads (user_id);
+    """,
+    # Read watermarks
+    """
+    ALTER TABLE chat_thread_participants ADD COLUMN IF NOT EXISTS last_read_message_id integer;
+    ALTER TABLE chat_thread_participants ADD COLUMN IF NOT EXISTS last_read_at timestamptz;
+    CREATE INDEX IF NOT EXISTS ix_chat_messages_thread_id ON chat_messages (thread_id, id);
+    """,
+    # Last activity per thread for the teacher inbox
+    """
+    ALTER TABLE chat_threads ADD COLUMN IF NOT EXISTS last_message_at timestamptz;
+    UPDATE chat_threads t SET last_message_at = COALESCE(
+        (SELECT MAX(m.timestamp) FROM chat_messages m WHERE m.thread_id = t.id), t.created_at, now()
+    )
+    WHERE t.last_message_at IS NULL;
+    ALTER TABLE chat_threads ALTER COLUMN last_message_at SET DEFAULT now();
+    ALTER TABLE chat_threads ALTER COLUMN last_message_at SET NOT NULL;
+    CREATE INDEX IF NOT EXISTS ix_chat_threads_teacher_activity
+        ON chat_threads (assigned_teacher_id, last_message_at DESC, id DESC);
+    """,
+]
+
+# Any fixed key; makes workers starting together run the migrations one at a time
+MIGRATION_LOCK_ID = 7205310
+
+
+def run_migrations(engine: Engine):
+    """Apply MIGRATIONS in one transaction"""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})")
+        for statement in MIGRATIONS:
+            conn.exec_driver_sql(statement)
+        # Counter rows for users created before every user got one; needs the
+        # read watermark columns above. A no-op once all users have a row.
+        backfill_user_stats(conn)
@@ -1,6 +1,7 @@
 from sqlalchemy import (
     Boolean, Column, ForeignKey, String, DateTime,
-    Float, Text, Table, Integer
+    Float, Text, Table, Integer, BigInteger, Sequence, UniqueConstraint, Index, desc,
+    literal_column, text
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -9,6 +10,36 @@ import uuid
 from app.database import Base
 
 
+# =========================
+# Change Tracking
+# =========================
+# Every tracked row takes a fresh value from this sequence when it is
+# inserted or updated, so "changes since N" is a range scan on change_seq.
+sync_change_seq = Sequence("sync_change_seq", metadata=Base.metadata)
+
+# Sequence values are drawn at write time but become visible at commit, so
+# rows also record the writing transaction's id; see app.routes.sync.get_changes.
+current_xact_id = literal_column("pg_current_xact_id()::text::bigint")
+
+
+def change_seq_column():
+    return Column(
+        BigInteger,
+        nullable=False,
+        server_default=sync_change_seq.next_value(),
+        onupdate=sync_change_seq.next_value()
+    )
+
+
+def change_xid_column():
+    return Column(
+        BigInteger,
+        nullable=False,
+        server_default=current_xact_id,
+        onupdate=current_xact_id
+    )
+
+
 # =========================
 # Association Tables
 # =========================
@@ -184,6 +215,9 @@ class TeacherCodeUse(Base):
 
 class StudentTeacherAccess(Base):
     __tablename__ = "student_teacher_access"
+    __table_args__ = (
+        Index("ix_student_teacher_access_student_sync", "student_id", "change_xid", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -191,6 +225,8 @@ class StudentTeacherAccess(Base):
     granted_at = Column(DateTime(timezone=True), server_default=func.now())
     granted_via_code = Column(Boolean, default=True)
     is_active = Column(Boolean, default=True)
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
 
     student = relationship("User", foreign_keys=[student_id])
     teacher = relationship("User", foreign_keys=[teacher_id])
@@ -201,6 +237,9 @@ class StudentTeacherAccess(Base):
 # =========================
 class Course(Base):
     __tablename__ = "courses"
+    __table_args__ = (
+        Index("ix_courses_created_by_sync", "created_by", "change_xid", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True, nullable=False)
@@ -211,13 +250,20 @@ class Course(Base):
     total_modules = Column(Integer, default=0)
     created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     is_active = Column(Boolean, default=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # bumped on catalog edits
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
 
     creator = relationship("User", foreign_keys=[created_by])
 
 
 class Module(Base):
     __tablename__ = "modules"
+    __table_args__ = (
+        Index("ix_modules_course_sync", "course_id", "change_xid", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     course_id = Column(Integer, ForeignKey("courses.id"))
@@ -225,12 +271,19 @@ class Module(Base):
     description = Column(Text, nullable=True)
     order = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
 
     course = relationship("Course")
 
 
 class UserCourseProgress(Base):
     __tablename__ = "user_course_progress"
+    __table_args__ = (
+        UniqueConstraint("user_id", "course_id", name="uq_user_course_progress_user_course"),
+        Index("ix_user_course_progress_course", "course_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
@@ -249,6 +302,10 @@ class UserCourseProgress(Base):
 
 class UserModuleProgress(Base):
     __tablename__ = "user_module_progress"
+    __table_args__ = (
+        UniqueConstraint("user_id", "module_id", name="uq_user_module_progress_user_module"),
+        Index("ix_user_module_progress_course", "course_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
@@ -260,11 +317,18 @@ class UserModuleProgress(Base):
 
 class UserFavorite(Base):
     __tablename__ = "user_favorites"
+    __table_args__ = (
+        UniqueConstraint("user_id", "lesson_id", name="uq_user_favorites_user_lesson"),
+        Index("ix_user_favorites_user_sync", "user_id", "change_xid", "change_seq"),
+        Index("ix_user_favorites_user_created", "user_id", desc("created_at"), desc("id")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     lesson_id = Column(Integer, ForeignKey("modules.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
 
     user = relationship("User", back_populates="favorites")
     lesson = relationship("Module")
@@ -272,28 +336,116 @@ class UserFavorite(Base):
 
 class UserNote(Base):
     __tablename__ = "user_notes"
+    __table_args__ = (
+        Index("ix_user_notes_user_id", "user_id", "id"),
+        Index("ix_user_notes_user_course_id", "user_id", "course_id", "id"),
+        Index("ix_user_notes_user_lesson_id", "user_id", "lesson_id", "id"),
+        Index("ix_user_notes_user_sync", "user_id", "change_xid", "change_seq"),
+        Index(
+            "ix_user_notes_content_fts",
+            text("to_tsvector('english'::regconfig, note_content)"),
+            postgresql_using="gin"
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     course_id = Column(Integer, ForeignKey("courses.id"))
     lesson_id = Column(Integer, ForeignKey("modules.id"))
     note_content = Column(Text, nullable=False)
+    # Bumped on every write; autosave patches must name the version they were made against
+    version = Column(
+        Integer,
+        nullable=False,
+        default=1,
+        server_default="1",
+        onupdate=literal_column("user_notes.version + 1")
+    )
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
 
     user = relationship("User", back_populates="notes")
 
 
+# Full-text search over note content. Queries must use this exact expression
+# (the one ix_user_notes_content_fts indexes) for the planner to pick the GIN index.
+note_search_vector = func.to_tsvector(literal_column("'english'::regconfig"), UserNote.note_content)
+
+
+# Hard deletes leave a tombstone behind so delta sync can report them.
+# Favourite tombstones are keyed by lesson_id, note tombstones by note id.
+class SyncTombstone(Base):
+    __tablename__ = "sync_tombstones"
+    __table_args__ = (
+        Index("ix_sync_tombstones_user_sync", "user_id", "change_xid", "change_seq"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)  # favorite, note
+    entity_id = Column(Integer, nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+    change_xid = change_xid_column()
+    change_seq = change_seq_column()
+
+
+# Denormalized per-user counters, maintained by the write paths in app.stats
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    completed_courses = Column(Integer, nullable=False, default=0, server_default="0")
+    favorites = Column(Integer, nullable=False, default=0, server_default="0")
+    notes = Column(Integer, nullable=False, default=0, server_default="0")
+    unread_messages = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# =========================
+# Analytics Rollups
+# =========================
+# Maintained incrementally by the progress write paths in app.analytics and
+# recomputed by the scheduled refresh job.
+class CourseAnalytics(Base):
+    __tablename__ = "course_analytics"
+
+    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"), primary_key=True)
+    enrolled = Column(Integer, nullable=False, default=0, server_default="0")
+    started = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+    progress_sum = Column(Float, nullable=False, default=0.0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ModuleAnalytics(Base):
+    __tablename__ = "module_analytics"
+
+    module_id = Column(Integer, ForeignKey("modules.id", ondelete="CASCADE"), primary_key=True)
+    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"), nullable=False, index=True)
+    started = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 # =========================
 # Chat Models
 # =========================
 class ChatThread(Base):
     __tablename__ = "chat_threads"
+    __table_args__ = (
+        Index("ix_chat_threads_user", "user_id"),
+        # Teacher inbox, most recent activity first
+        Index("ix_chat_threads_teacher_activity", "assigned_teacher_id", desc("last_message_at"), desc("id")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     assigned_teacher_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Creation time until the first message, maintained by app.unread.touch_thread
+    last_message_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
     user = relationship("User", back_populates="chat_threads", foreign_keys=[user_id])
     teacher = relationship("User", foreign_keys=[assigned_teacher_id])
@@ -302,6 +454,11 @@ class ChatThread(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_thread_timestamp_id", "thread_id", desc("timestamp"), desc("id")),
+        # Messages between two read watermarks (app.unread.advance_watermark)
+        Index("ix_chat_messages_thread_id", "thread_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     thread_id = Column(Integer, ForeignKey("chat_threads.id"))
@@ -310,7 +467,23 @@ class ChatMessage(Base):
     content = Column(Text, nullable=False)
     message_type = Column(String, default="text")  # text, image, file
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Legacy per-row flag; read state now lives in ChatThreadParticipant watermarks
     read_status = Column(Boolean, default=False)
 
     thread = relationship("ChatThread", back_populates="messages")
     sender = relationship("User")
+
+
+# Per-participant read watermarks and unread counters, maintained by app.unread
+class ChatThreadParticipant(Base):
+    __tablename__ = "chat_thread_participants"
+    __table_args__ = (
+        Index("ix_chat_thread_participants_user", "user_id"),
+    )
+
+    thread_id = Column(Integer, ForeignKey("chat_threads.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Every message up to this id counts as read by this participant
+    last_read_message_id = Column(Integer, nullable=True)
+    last_read_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # only needed when REDIS_URL is set
+    aioredis = None
+    RedisError = OSError
+
+from app.pubsub import WebSocketFanout, fanout
+
+logger = logging.getLogger(__name__)
+
+# A connection counts as online for this long after its last heartbeat.
+# Clients should heartbeat every PRESENCE_TTL / 3 seconds.
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", "60"))
+PRESENCE_SWEEP_INTERVAL = int(os.getenv("PRESENCE_SWEEP_INTERVAL", "15"))
+PRESENCE_SWEEP_BATCH = 1000
+
+# At most one typing relay per user, thread and window
+TYPING_THROTTLE_MS = int(os.getenv("TYPING_THROTTLE_MS", "1000"))
+
+PRESENCE_CHANNEL = "ws:presence"
+ONLINE_KEY = "presence:online"
+CONNECTIONS_KEY_PREFIX = "presence:conns:"
+
+# Record a connection's heartbeat; returns 1 if its user was offline until now
+_HEARTBEAT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local previous = redis.call('ZSCORE', KEYS[2], ARGV[5])
+redis.call('ZADD', KEYS[2], 'GT', ARGV[3], ARGV[5])
+if previous and tonumber(previous) > tonumber(ARGV[2]) then
+    return 0
+end
+return 1
+"""
+
+# Drop a connection; returns 1 if it was the user's last live one
+_LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local latest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+if #latest == 0 then
+    return redis.call('ZREM', KEYS[2], ARGV[3])
+end
+redis.call('ZADD', KEYS[2], latest[2], ARGV[3])
+return 0
+"""
+
+# Claim users whose every connection stopped heartbeating; each is claimed by one worker
+_SWEEP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+return expired
+"""
+
+
+class LocalPresenceStore:
+    """Presence kept in this worker's memory.
+
+    Only sees this worker's connections, which is all a single-worker
+    deployment needs. Set REDIS_URL to share presence between workers.
+    """
+
+    def __init__(self):
+        self._connections: Dict[str, Dict[str, float]] = {}  # user -> connection -> expiry
+        self._online: Dict[str, float] = {}  # user -> latest connection expiry
+
+    async def heartbeat(self, user_id: str, conn_id: str, now: float, ttl: int) -> bool:
+        connections = self._connections.setdefault(user_id, {})
+        connections[conn_id] = now + ttl
+        was_online = self._online.get(user_id, 0) > now
+        self._online[user_id] = max(self._online.get(user_id, 0), now + ttl)
+        return not was_online
+
+    async def leave(self, user_id: str, conn_id: str, now: float) -> bool:
+        connections = self._connections.get(user_id)
+        if connections is None:
+            return False
+        connections.pop(conn_id, None)
+        for expired in [conn for conn, expires_at in connections.items() if expires_at <= now]:
+            del connections[expired]
+        if connections:
+            self._online[user_id] = max(connections.values())
+            return False
+        del self._connections[user_id]
+        return self._online.pop(user_id, None) is not None
+
+    async def sweep(self, now: float, limit: int) -> List[str]:
+        expired = [user_id for user_id, expires_at in self._online.items() if expires_at <= now][:limit]
+        for user_id in expired:
+            del self._online[user_id]
+            self._connections.pop(user_id, None)
+        return expired
+
+    async def online(self, user_ids: List[str], now: float) -> Set[str]:
+        return {user_id for user_id in user_ids if self._online.get(user_id, 0) > now}
+
+
+class RedisPresenceStore:
+    """Presence shared by all workers through Redis.
+
+    Each user has a sorted set of their connections scored by expiry, and one
+    sorted set scores every online user by their latest connection's expiry.
+    Looking up any number of users is a single ZMSCORE, and expired users are
+    found with a range query rather than a scan.
+    """
+
+    def __init__(self, url: str):
+        self.client = aioredis.from_url(url)
+        self._heartbeat = self.client.register_script(_HEARTBEAT_SCRIPT)
+        self._leave = self.client.register_script(_LEAVE_SCRIPT)
+        self._sweep = self.client.register_script(_SWEEP_SCRIPT)
+
+    @staticmethod
+    def _connections_key(user_id: str) -> str:
+        return f"{CONNECTIONS_KEY_PREFIX}{user_id}"
+
+    async def heartbeat(self, user_id: str, conn_id: str, now: float, ttl: int) -> bool:
+        came_online = await self._heartbeat(
+            keys=[self._connections_key(user_id), ONLINE_KEY],
+            args=[conn_id, now, now + ttl, ttl, user_id]
+        )
+        return bool(came_online)
+
+    async def leave(self, user_id: str, conn_id: str, now: float) -> bool:
+        went_offline = await self._leave(
+            keys=[self._connections_key(user_id), ONLINE_KEY],
+            args=[conn_id, now, user_id]
+        )
+        return bool(went_offline)
+
+    async def sweep(self, now: float, limit: int) -> List[str]:
+        expired = await self._sweep(keys=[ONLINE_KEY], args=[now, limit])
+        return [user_id.decode() if isinstance(user_id, bytes) else user_id for user_id in expired]
+
+    async def online(self, user_ids: List[str], now: float) -> Set[str]:
+        if not user_ids:
+            return set()
+        scores = await self.client.zmscore(ONLINE_KEY, user_ids)
+        return {user_id for user_id, score in zip(user_ids, scores) if score is not None and score > now}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def presence_event(user_id: str, is_online: bool, at: float) -> dict:
+    return {
+        "type": "presence",
+        "user_id": user_id,
+        "is_online": is_online,
+        "at": datetime.utcfromtimestamp(at).isoformat()
+    }
+
+
+class _Connection:
+    __slots__ = ("user_id", "conn_id", "refreshed_at", "watching")
+
+    def __init__(self, user_id: str, watching: Set[str]):
+        self.user_id = user_id
+        self.conn_id = uuid.uuid4().hex
+        self.refreshed_at = 0.0  # last time the store was written
+        self.watching = watching
+
+
+class PresenceService:
+    """Who is online, kept alive by client heartbeats.
+
+    Every frame a client sends counts as a heartbeat. The store is written at
+    most every third of the TTL per connection, so chatty clients cost no
+    more than idle ones. A periodic sweep reports users whose connections all
+    expired, including those left behind by a worker that died. Closing
+    sockets that went quiet is the fanout reaper's job.
+
+    Changes are broadcast to all workers on one channel and forwarded to the
+    local sockets of users watching the user who changed (their chat
+    counterparts).
+    """
+
+    def __init__(self, store, fanout: WebSocketFanout, ttl: int = PRESENCE_TTL,
+                 sweep_interval: int = PRESENCE_SWEEP_INTERVAL,
+                 event: Callable[[str, bool, float], dict] = presence_event):
+        self.store = store
+        self.fanout = fanout
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.event = event
+        self._connections: Dict[object, _Connection] = {}  # websocket -> connection
+        self._watchers: Dict[str, Dict[str, int]] = {}  # watched user -> watcher -> socket count
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "store_writes": 0,
+            "came_online": 0,
+            "went_offline": 0,
+            "events_delivered": 0,
+            "store_errors": 0,
+        }
+
+    async def start(self):
+        await self.fanout.listen(PRESENCE_CHANNEL, self._on_change)
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for websocket in list(self._connections):
+            await self.disconnect(websocket)
+        if hasattr(self.store, "close"):
+            await self.store.close()
+
+    async def connect(self, user_id, websocket, watch: Iterable = ()):
+        """Mark an accepted socket online and subscribe it to the watched users' changes"""
+        connection = _Connection(str(user_id), {str(watched) for watched in watch if watched is not None})
+        self._connections[websocket] = connection
+        for watched in connection.watching:
+            watchers = self._watchers.setdefault(watched, {})
+            watchers[connection.user_id] = watchers.get(connection.user_id, 0) + 1
+        await self.heartbeat(websocket)
+
+    def watch(self, websocket, watched):
+        """Also forward a user's changes to this socket, e.g. the other side of a thread created since it connected"""
+        connection = self._connections.get(websocket)
+        if connection is None or watched is None or str(watched) in connection.watching:
+            return
+        watched = str(watched)
+        connection.watching.add(watched)
+        watchers = self._watchers.setdefault(watched, {})
+        watchers[connection.user_id] = watchers.get(connection.user_id, 0) + 1
+
+    async def heartbeat(self, websocket):
+        connection = self._connections.get(websocket)
+        if connection is None:
+            return
+        now = time.time()
+        if now - connection.refreshed_at < self.ttl / 3:
+            return
+        connection.refreshed_at = now
+        try:
+            came_online = await self.store.heartbeat(connection.user_id, connection.conn_id, now, self.ttl)
+        except (RedisError, OSError) as e:
+            self.metrics["store_errors"] += 1
+            logger.warning(f"Presence heartbeat failed: {e}")
+            return
+        self.metrics["store_writes"] += 1
+        if came_online:
+            self.metrics["came_online"] += 1
+            await self._publish(connection.user_id, True, now)
+
+    async def disconnect(self, websocket):
+        connection = self._connections.pop(websocket, None)
+        if connection is None:
+            return
+        for watched in connection.watching:
+            watchers = self._watchers.get(watched)
+            if watchers is None:
+                continue
+            watchers[connection.user_id] -= 1
+            if watchers[connection.user_id] <= 0:
+                del watchers[connection.user_id]
+            if not watchers:
+                del self._watchers[watched]
+
+        now = time.time()
+        try:
+            went_offline = await self.store.leave(connection.user_id, connection.conn_id, now)
+        except (RedisError, OSError) as e:
+            # The connection expires from the store on its own
+            self.metrics["store_errors"] += 1
+            logger.warning(f"Presence leave failed: {e}")
+            return
+        if went_offline:
+            self.metrics["went_offline"] += 1
+            await self._publish(connection.user_id, False, now)
+
+    async def online_users(self, user_ids: Iterable) -> Set[str]:
+        """The subset of users that are online, looked up in one round trip"""
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids if user_id is not None))
+        try:
+            return await self.store.online(user_ids, time.time())
+        except (RedisError, OSError) as e:
+            self.metrics["store_errors"] += 1
+            logger.warning(f"Presence lookup failed: {e}")
+            return {user_id for user_id in user_ids if self.fanout.is_connected_locally(user_id)}
+
+    async def is_online(self, user_id) -> bool:
+        if user_id is None:
+            return False
+        return str(user_id) in await self.online_users([user_id])
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "local_connections": len(self._connections),
+            "watched_users": len(self._watchers),
+        }
+
+    async def _publish(self, user_id: str, is_online: bool, at: float):
+        try:
+            await self.fanout.broker.publish(
+                PRESENCE_CHANNEL, orjson.dumps({"user_id": user_id, "is_online": is_online, "at": at})
+            )
+        except (RedisError, OSError) as e:
+            logger.warning(f"Presence publish failed: {e}")
+
+    async def _on_change(self, channel: str, payload: bytes):
+        change = orjson.loads(payload)
+        watchers = list(self._watchers.get(change["user_id"], ()))
+        if not watchers:
+            return
+        text = orjson.dumps(self.event(change["user_id"], change["is_online"], change["at"])).decode()
+        delivered = await asyncio.gather(*(self.fanout.deliver_local(watcher, text) for watcher in watchers))
+        self.metrics["events_delivered"] += sum(delivered)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self._sweep()
+            except Exception as e:
+                logger.error(f"Presence sweep failed: {e}")
+
+    async def _sweep(self):
+        now = time.time()
+
+        while True:
+            try:
+                expired = await self.store.sweep(now, PRESENCE_SWEEP_BATCH)
+            except (RedisError, OSError) as e:
+                self.metrics["store_errors"] += 1
+                logger.warning(f"Presence sweep failed: {e}")
+                return
+            for user_id in expired:
+                self.metrics["went_offline"] += 1
+                await self._publish(user_id, False, now)
+            if len(expired) < PRESENCE_SWEEP_BATCH:
+                return
+
+
+def typing_event(user_id: str, thread_id: str, is_typing: bool) -> dict:
+    return {"type": "typing", "thread_id": thread_id, "user_id": user_id, "is_typing": is_typing}
+
+
+class TypingThrottle:
+    """Relays typing indicators to the other participant, throttled per user and thread.
+
+    The first event in a window is sent straight away. Later events in the
+    same window only record the latest state, which is sent once when the
+    window ends if it differs from what was last sent. A client can send as
+    many events as it likes; the recipient gets at most one per window.
+    Relays go out through the fan-out and never touch the database.
+    """
+
+    def __init__(self, fanout: WebSocketFanout, interval_ms: int = TYPING_THROTTLE_MS,
+                 event: Callable[[str, str, bool], dict] = typing_event):
+        self.fanout = fanout
+        self.interval = interval_ms / 1000
+        self.event = event
+        self._sent: Dict[Tuple[str, str], Tuple[float, bool]] = {}  # (user, thread) -> (sent at, state)
+        self._pending: Dict[Tuple[str, str], Tuple[str, bool]] = {}  # (user, thread) -> (recipient, state)
+        self._timers: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.metrics = {"received": 0, "relayed": 0, "coalesced": 0}
+
+    async def relay(self, user_id, thread_id, recipient_id, is_typing: bool = True):
+        self.metrics["received"] += 1
+        key = (str(user_id), str(thread_id))
+        now = time.monotonic()
+        sent = self._sent.get(key)
+        if sent is None or now - sent[0] >= self.interval:
+            self._pending.pop(key, None)
+            await self._send(key, str(recipient_id), is_typing, now)
+            return
+
+        # Inside the window: keep only the latest state for the trailing send
+        self.metrics["coalesced"] += 1
+        self._pending[key] = (str(recipient_id), is_typing)
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._trailing(key, sent[0] + self.interval - now))
+
+    async def stop(self):
+        for task in self._timers.values():
+            task.cancel()
+        self._timers.clear()
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {**self.metrics, "pending": len(self._pending)}
+
+    async def _trailing(self, key: Tuple[str, str], delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._timers.pop(key, None)
+        pending = self._pending.pop(key, None)
+        if pending is not None and pending[1] != self._sent.get(key, (0, None))[1]:
+            await self._send(key, pending[0], pending[1], time.monotonic())
+
+    async def _send(self, key: Tuple[str, str], recipient_id: str, is_typing: bool, now: float):
+        self._sent[key] = (now, is_typing)
+        self.metrics["relayed"] += 1
+        try:
+            await self.fanout.send_to_user(recipient_id, self.event(key[0], key[1], is_typing))
+        except (RedisError, OSError) as e:
+            logger.warning(f"Typing relay failed: {e}")
+
+        # Drop finished windows once the table grows, so it stays bounded by active typers
+        if len(self._sent) > 10000:
+            self._sent = {k: v for k, v in self._sent.items() if now - v[0] < self.interval or k in self._pending}
+
+
+def create_presence(redis_url: Optional[str], fanout: WebSocketFanout, **kwargs) -> PresenceService:
+    if redis_url:
+        if aioredis is None:
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+        return PresenceService(RedisPresenceStore(redis_url), fanout, **kwargs)
+    return PresenceService(LocalPresenceStore(), fanout, **kwargs)
+
+
+presence = create_presence(os.getenv("REDIS_URL"), fanout)
+typing_throttle = TypingThrottle(fanout)
@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+import orjson
+
+from app.connections import (
+    Connection, ConnectionRegistry, SendMetrics, PING_INTERVAL, IDLE_TIMEOUT, REAP_INTERVAL, IDLE_CLOSE_CODE
+)
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # only needed when REDIS_URL is set
+    aioredis = None
+    RedisError = OSError
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, bytes], Awaitable[None]]
+
+USER_CHANNEL_PREFIX = "ws:user:"
+
+
+class InMemoryBroker:
+    """Process-local stand-in for Redis pub/sub.
+
+    Brokers created with the same ``hub`` dict see each other's messages, so
+    a test can run several "workers" in one process. Without a hub the broker
+    only talks to itself, which is all a single-worker deployment needs.
+    """
+
+    def __init__(self, hub: Optional[Dict[str, Set["InMemoryBroker"]]] = None):
+        self.hub = hub if hub is not None else {}
+        self._handler: Optional[MessageHandler] = None
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+
+    async def stop(self):
+        for subscribers in self.hub.values():
+            subscribers.discard(self)
+        self._handler = None
+
+    async def subscribe(self, channel: str):
+        self.hub.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, channel: str):
+        subscribers = self.hub.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub[channel]
+
+    async def publish(self, channel: str, payload: bytes) -> int:
+        subscribers = list(self.hub.get(channel, ()))
+        for broker in subscribers:
+            if broker._handler is not None:
+                await broker._handler(channel, payload)
+        return len(subscribers)
+
+
+class RedisBroker:
+    """Redis pub/sub with one subscriber connection per worker.
+
+    Subscriptions are multiplexed over that connection and a single task reads
+    it. The connection also stays subscribed to a per-worker control channel,
+    so it remains open (and is resubscribed on reconnect) even while no users
+    are connected here.
+    """
+
+    def __init__(self, url: str):
+        self.client = aioredis.from_url(url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.control_channel = f"ws:worker:{uuid.uuid4().hex}"
+        self._handler: Optional[MessageHandler] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: MessageHandler):
+        self._handler = handler
+        await self.pubsub.subscribe(self.control_channel)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def subscribe(self, channel: str):
+        await self.pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        await self.pubsub.unsubscribe(channel)
+
+    async def publish(self, channel: str, payload: bytes) -> int:
+        return await self.client.publish(channel, payload)
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except (RedisError, OSError) as e:
+                # redis-py reconnects and resubscribes on the next read
+                logger.warning(f"Pub/sub connection error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            try:
+                await self._handler(channel, message["data"])
+            except Exception as e:
+                logger.error(f"Pub/sub handler error on {channel}: {e}")
+
+
+class FanoutMetrics:
+    """Delivery counters for one worker"""
+
+    __slots__ = ("published", "received", "delivered", "undelivered", "connects", "disconnects", "pings", "reaped")
+
+    def __init__(self):
+        self.published = 0  # messages this worker published
+        self.received = 0  # messages that reached this worker from the broker
+        self.delivered = 0  # frames queued to a local socket
+        self.undelivered = 0  # received for a user with no local socket left
+        self.connects = 0  # sockets registered; with disconnects, the churn
+        self.disconnects = 0
+        self.pings = 0  # pings queued to quiet sockets
+        self.reaped = 0  # sockets closed for staying silent past the idle timeout
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class WebSocketFanout:
+    """Routes messages for a user to their sockets on whichever worker holds them.
+
+    Every message goes through the broker on the user's channel, including
+    when the recipient is connected to this worker, so each socket gets it
+    exactly once. A worker subscribes to a user's channel while it holds at
+    least one socket for that user.
+
+    Delivery only queues the frame on each socket's Connection, so a slow
+    socket never holds up the broker reader or the user's other devices.
+
+    A reaper pings sockets that have gone quiet and closes and unregisters
+    those that stay silent past the idle timeout, so half-open connections
+    do not hold memory and file descriptors.
+    """
+
+    def __init__(self, broker, ping_frame: str = '{"type":"ping"}', ping_interval: int = PING_INTERVAL,
+                 idle_timeout: int = IDLE_TIMEOUT, reap_interval: int = REAP_INTERVAL):
+        self.broker = broker
+        self.ping_frame = ping_frame
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._reaper: Optional[asyncio.Task] = None
+        self.metrics = FanoutMetrics()
+        self.send_metrics = SendMetrics()
+        self.registry = ConnectionRegistry()
+        self._subscribed: Set[str] = set()
+        self._subscription_lock = asyncio.Lock()
+        self._handlers: Dict[str, MessageHandler] = {}
+
+    @staticmethod
+    def channel(user_id) -> str:
+        return f"{USER_CHANNEL_PREFIX}{user_id}"
+
+    async def start(self):
+        await self.broker.start(self._dispatch)
+        self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        await self.broker.stop()
+        self._subscribed.clear()
+        self._handlers.clear()
+
+    async def listen(self, channel: str, handler: MessageHandler):
+        """Route a non-user channel (e.g. presence changes) to a handler on this worker"""
+        self._handlers[channel] = handler
+        await self.broker.subscribe(channel)
+
+    async def connect(self, user_id, websocket, role: Optional[str] = None,
+                      threads: Optional[Dict] = None) -> Connection:
+        """Register an accepted socket; returns once messages for the user will reach it.
+
+        ``threads`` maps each of the user's thread ids to the other participant.
+        Handlers should send their own replies through the returned
+        connection too, so frames to the socket never interleave.
+        """
+        user_id = str(user_id)
+        connection = Connection(
+            user_id, websocket, self.send_metrics, on_close=self._connection_closed, role=role,
+            threads={
+                str(thread_id): str(other_id)
+                for thread_id, other_id in (threads or {}).items()
+                if other_id is not None
+            }
+        )
+        self.registry.add(connection)
+        self.metrics.connects += 1
+        await self._sync_subscription(user_id)
+        return connection
+
+    async def disconnect(self, user_id, websocket):
+        user_id = str(user_id)
+        connection = self.registry.remove(websocket)
+        if connection is not None:
+            self.metrics.disconnects += 1
+            await connection.stop()
+        await self._sync_subscription(user_id)
+
+    def connection(self, websocket) -> Optional[Connection]:
+        return self.registry.get(websocket)
+
+    def is_connected_locally(self, user_id) -> bool:
+        return self.registry.has_user(user_id)
+
+    @property
+    def local_connections(self) -> int:
+        return len(self.registry)
+
+    async def send_to_user(self, user_id, message: dict):
+        """Publish a message to all of a user's sockets, on any worker"""
+        await self.broker.publish(self.channel(user_id), orjson.dumps(message))
+        self.metrics.published += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics.snapshot(),
+            **self.send_metrics.snapshot(),
+            "queue_depth": sum(connection.depth for shard in self.registry.shards() for connection in shard),
+            "local_users": self.registry.user_count,
+            "local_connections": self.local_connections,
+            "local_threads": self.registry.thread_count,
+            "roles": self.registry.role_counts(),
+            "subscriptions": len(self._subscribed),
+        }
+
+    async def _sync_subscription(self, user_id: str):
+        # Decide under the lock from the current state, so a disconnect racing
+        # a reconnect can never leave a connected user unsubscribed
+        async with self._subscription_lock:
+            wanted = self.registry.has_user(user_id)
+            if wanted and user_id not in self._subscribed:
+                await self.broker.subscribe(self.channel(user_id))
+                self._subscribed.add(user_id)
+            elif not wanted and user_id in self._subscribed:
+                await self.broker.unsubscribe(self.channel(user_id))
+                self._subscribed.discard(user_id)
+
+    async def _dispatch(self, channel: str, payload: bytes):
+        handler = self._handlers.get(channel)
+        if handler is not None:
+            await handler(channel, payload)
+            return
+        self.metrics.received += 1
+        await self.deliver_local(channel[len(USER_CHANNEL_PREFIX):], payload.decode())
+
+    async def deliver_local(self, user_id, text: str) -> int:
+        """Queue a frame for the user's sockets on this worker only; returns how many took it"""
+        connections = self.registry.for_user(user_id)
+        if not connections:
+            self.metrics.undelivered += 1
+            return 0
+
+        # A snapshot, so a slow consumer being dropped does not disturb the loop
+        queued = sum(1 for connection in connections if connection.send(text))
+        self.metrics.delivered += queued
+        return queued
+
+    async def reap(self) -> int:
+        """Ping quiet sockets and close those past the idle timeout; returns how many were closed"""
+        now = time.monotonic()
+        idle = []
+        for shard in self.registry.shards():
+            for connection in shard:
+                silent_for = now - connection.last_seen
+                if silent_for >= self.idle_timeout:
+                    idle.append(connection)
+                elif silent_for >= self.ping_interval and connection.pinged_at <= connection.last_seen:
+                    connection.pinged_at = now
+                    if connection.send(self.ping_frame):
+                        self.metrics.pings += 1
+            # Let other tasks run between shards of a large registry
+            await asyncio.sleep(0)
+        if not idle:
+            return 0
+
+        # Unregister first; a half-open peer never answers the close, so close them all at once
+        self.metrics.reaped += len(idle)
+        for connection in idle:
+            await self.disconnect(connection.user_id, connection.websocket)
+        await asyncio.gather(*(connection.close(IDLE_CLOSE_CODE) for connection in idle))
+        logger.info(f"Reaped {len(idle)} idle WebSocket connections")
+        return len(idle)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"WebSocket reaper failed: {e}")
+
+    async def _connection_closed(self, connection: Connection):
+        # The writer gave up on the socket (send error or slow consumer)
+        await self.disconnect(connection.user_id, connection.websocket)
+
+
+def create_fanout(redis_url: Optional[str], **kwargs) -> WebSocketFanout:
+    if redis_url:
+        if aioredis is None:
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+        return WebSocketFanout(RedisBroker(redis_url), **kwargs)
+    return WebSocketFanout(InMemoryBroker(), **kwargs)
+
+
+fanout = create_fanout(os.getenv("REDIS_URL"))
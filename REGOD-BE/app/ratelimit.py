@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
+
+
+class LocalRateLimiter:
+    """Fixed-window hit counter per key, kept in this worker's memory.
+
+    Each worker counts on its own, so the effective limit is multiplied by
+    the number of workers. Set REDIS_URL to share one counter between them.
+    """
+
+    def __init__(self, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key) -> Optional[int]:
+        """Count a hit; None if allowed, otherwise seconds until the window resets"""
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(key, (now, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.limit:
+                return max(1, int(started + self.window - now))
+            self._windows[key] = (started, count + 1)
+
+            # Drop finished windows once the table grows, so it stays bounded by active keys
+            if len(self._windows) > 10000:
+                self._windows = {
+                    k: v for k, v in self._windows.items() if now - v[0] < self.window
+                }
+        return None
+
+
+class RedisRateLimiter:
+    """Fixed-window hit counter per key shared by all workers through Redis.
+
+    Redis errors let the request through rather than failing it.
+    """
+
+    def __init__(self, url: str, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.client = redis.Redis.from_url(url)
+
+    def hit(self, key) -> Optional[int]:
+        """Count a hit; None if allowed, otherwise seconds until the window resets"""
+        redis_key = f"ratelimit:{self.name}:{key}"
+        try:
+            # One MULTI: the window starts with its expiry set, so no key is left without one
+            _, count, ttl = (
+                self.client.pipeline()
+                .set(redis_key, 0, ex=self.window, nx=True)
+                .incr(redis_key)
+                .ttl(redis_key)
+                .execute()
+            )
+        except redis.RedisError:
+            return None
+        return max(1, ttl) if count > self.limit else None
+
+
+def create_rate_limiter(name: str, limit: int, window: int):
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        if redis is None:
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+        return RedisRateLimiter(redis_url, name, limit, window)
+    return LocalRateLimiter(name, limit, window)
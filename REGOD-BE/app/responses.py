@@ -0,0 +1,67 @@
+from fastapi import Response
+from functools import lru_cache
+from pydantic import BaseModel
+from typing import Any, Iterable, Mapping, Optional, Tuple, Type
+import orjson
+
+
+def _encode_default(obj: Any):
+    """orjson fallback for nested Pydantic models"""
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError
+
+
+@lru_cache(maxsize=None)
+def _field_plan(model: Type[BaseModel]) -> Tuple[Tuple[str, bool, Any], ...]:
+    """(name, required, default) for each field of a response schema"""
+    return tuple(
+        (name, field.is_required(), None if field.is_required() else field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items()
+    )
+
+
+def dump_trusted(model: Type[BaseModel], rows: Iterable[Mapping[str, Any]]) -> bytes:
+    """Serialize trusted rows shaped like ``model`` straight to JSON bytes.
+
+    Each row is shaped the way ``model.model_construct`` would shape it (only
+    the schema's fields, defaults filled in, no validation) but as a plain
+    dict, which is several times cheaper per row. orjson then encodes
+    datetimes, UUIDs and nested models natively, so there is no
+    jsonable_encoder pass. UTC datetimes end in "Z", as pydantic writes
+    them. Values are not coerced either, so the schema's field types must
+    match the columns. Only use this for rows read from our own database.
+    """
+    plan = _field_plan(model)
+    return orjson.dumps(
+        [
+            {name: row[name] if required else row.get(name, default) for name, required, default in plan}
+            for row in rows
+        ],
+        default=_encode_default,
+        option=orjson.OPT_UTC_Z
+    )
+
+
+def trusted_response(model: Type[BaseModel], rows: Iterable[Mapping[str, Any]]) -> Response:
+    """Return a list response from trusted rows without response_model validation.
+
+    Returning a Response makes FastAPI skip its own validate-then-encode pass;
+    the route's ``response_model`` still documents the shape in OpenAPI.
+    """
+    return Response(content=dump_trusted(model, rows), media_type="application/json")
+
+
+def trusted_page_response(
+    model: Type[BaseModel],
+    rows: Iterable[Mapping[str, Any]],
+    next_cursor: Optional[str]
+) -> Response:
+    """Like trusted_response, wrapped in the ``items``/``next_cursor``/``has_more`` page envelope"""
+    body = b"".join([
+        b'{"items":', dump_trusted(model, rows),
+        b',"next_cursor":', orjson.dumps(next_cursor),
+        b',"has_more":', b"true" if next_cursor else b"false",
+        b"}"
+    ])
+    return Response(content=body, media_type="application/json")
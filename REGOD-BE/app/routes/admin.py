@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
 
-from app.database import get_db
+from app.database import get_db, pool_stats
 from app.models import User, Role, Permission, TeacherAssignment, TeacherCode, StudentTeacherAccess
 from app.schemas import RoleResponse, PermissionResponse, TeacherAssignmentResponse, UserResponse, TeacherCodeResponse
 from app.auth import get_current_user
 from app.rbac import require_permission, require_role
+from app.pubsub import fanout
+from app.presence import presence, typing_throttle
 
 router = APIRouter()
 
@@ -190,4 +192,18 @@ async def get_all_teacher_codes(
             is_active=code.is_active
         ))
     
-    return response
\ No newline at end of file
+    return response
+
+@router.get("/realtime/metrics")
+@require_permission("admin:system:manage")
+async def get_realtime_metrics(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """WebSocket fan-out, presence, typing and DB pool counters for the worker serving this request"""
+    return {
+        **fanout.stats(),
+        "presence": presence.stats(),
+        "typing": typing_throttle.stats(),
+        "db_pool": pool_stats()
+    }
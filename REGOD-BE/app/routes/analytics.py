@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from app.database import get_db
+from app.models import User, Course
+from app.schemas import TeacherAnalyticsResponse, CourseAnalyticsResponse, ModuleAnalyticsResponse
+from app.auth import get_current_user
+from app.rbac import require_permission
+from app.analytics import get_course_analytics
+
+router = APIRouter()
+
+@router.get("/analytics", response_model=TeacherAnalyticsResponse)
+@require_permission("teacher:students:view")
+async def get_teacher_analytics(
+    course_id: Optional[int] = None,
+    include_modules: bool = True,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get student progress rollups for the current teacher's courses"""
+    query = select(Course.id, Course.title).where(Course.is_active == True).order_by(Course.id)
+
+    # Admins can see every course; teachers only the ones they created
+    if not current_user.has_role("admin"):
+        query = query.where(Course.created_by == current_user.id)
+    if course_id is not None:
+        query = query.where(Course.id == course_id)
+
+    courses = db.execute(query).all()
+    if course_id is not None and not courses:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+
+    rollups, module_rollups = get_course_analytics(db, [course.id for course in courses])
+
+    response = []
+    for course in courses:
+        rollup = rollups.get(course.id)
+        if rollup is None:
+            continue
+
+        # Learners who started without being enrolled (e.g. admins) still count
+        learners = max(rollup.enrolled, rollup.started)
+        response.append(CourseAnalyticsResponse(
+            course_id=course.id,
+            title=course.title,
+            enrolled=rollup.enrolled,
+            started=rollup.started,
+            completed=rollup.completed,
+            average_progress=round(rollup.progress_sum / learners, 2) if learners else 0.0,
+            completion_rate=round(rollup.completed / learners, 4) if learners else 0.0,
+            modules=[
+                ModuleAnalyticsResponse(
+                    module_id=row.ModuleAnalytics.module_id,
+                    title=row.title,
+                    order=row.order,
+                    started=row.ModuleAnalytics.started,
+                    completed=row.ModuleAnalytics.completed
+                )
+                for row in module_rollups.get(course.id, [])
+            ] if include_modules else [],
+            updated_at=rollup.updated_at
+        ))
+
+    return TeacherAnalyticsResponse(courses=response)
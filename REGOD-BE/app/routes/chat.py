@@ -1,19 +1,98 @@
 from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from sqlalchemy import select, func, tuple_, or_, and_, true
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Optional
 import json
-from datetime import datetime
 
-from app.database import get_db
-from app.models import User, ChatThread, ChatMessage, StudentTeacherAccess
-from app.schemas import ThreadResponse, MessageResponse, MessageBase
-from app.auth import get_current_user
+from app.database import get_db, SessionLocal
+from app.models import User, ChatThread, ChatMessage, ChatThreadParticipant, StudentTeacherAccess
+from app.schemas import (
+    ThreadResponse, MessageResponse, MessagesPageResponse, MessageBase,
+    UnreadCountsResponse, ThreadUnreadResponse, ThreadReadRequest, ThreadReadResponse,
+    PresenceResponse, ThreadPresenceResponse, InboxThreadResponse, InboxPageResponse
+)
+from app.auth import get_current_user, get_user_from_token
 from app.rbac import require_permission
+from app.stats import bump_user_stats
+from app.unread import (
+    add_participants, increment_unread, touch_thread, advance_watermark, read_watermarks, get_unread_counts
+)
+from app.responses import trusted_page_response
+from app.utils.helpers import encode_cursor, decode_cursor, parse_timestamp
+from app.pubsub import fanout
+from app.presence import presence, typing_throttle
 
 router = APIRouter()
 
-# Store active WebSocket connections
-active_connections = {}
+MAX_MESSAGES_PAGE = 100
+MAX_INBOX_PAGE = 100
+
+def _thread_counterparts(db: Session, user_id) -> list:
+    """(thread id, other participant id) for each of the user's threads that has both sides"""
+    rows = db.execute(
+        select(ChatThread.id, ChatThread.user_id, ChatThread.assigned_teacher_id).where(
+            or_(ChatThread.user_id == user_id, ChatThread.assigned_teacher_id == user_id)
+        )
+    ).all()
+    return [
+        (row.id, row.assigned_teacher_id if row.user_id == user_id else row.user_id)
+        for row in rows
+        if row.user_id is not None and row.assigned_teacher_id is not None
+    ]
+
+async def _socket_counterpart(connection, websocket, user_id, thread_id) -> Optional[str]:
+    """The other participant of one of the socket user's threads, or None if it is not theirs.
+
+    Threads the user had when the socket connected are answered from memory.
+    One created or assigned since is looked up once, then joined to the
+    socket's routes and presence watches.
+    """
+    recipient_id = connection.counterpart(thread_id)
+    if recipient_id is not None:
+        return recipient_id
+    try:
+        thread_id = int(thread_id)
+    except (TypeError, ValueError):
+        return None
+    
+    db = SessionLocal()
+    try:
+        thread = db.get(ChatThread, thread_id)
+    finally:
+        db.close()
+    if thread is None or thread.user_id is None or thread.assigned_teacher_id is None:
+        return None
+    if thread.user_id == user_id:
+        other_id = thread.assigned_teacher_id
+    elif thread.assigned_teacher_id == user_id:
+        other_id = thread.user_id
+    else:
+        return None
+    
+    fanout.registry.join_thread(connection, thread.id, other_id)
+    presence.watch(websocket, other_id)
+    return str(other_id)
+
+async def _mark_thread_read(db: Session, thread: ChatThread, user: User, message_id: int) -> int:
+    """Advance the user's read watermark, commit, and send a read receipt to the other side"""
+    advanced = advance_watermark(db, thread.id, user.id, message_id)
+    if advanced is None:
+        return 0
+    
+    newly_read, read_at = advanced
+    bump_user_stats(db, user.id, unread_messages=-newly_read)
+    db.commit()
+    
+    for participant_id in (thread.user_id, thread.assigned_teacher_id):
+        if participant_id is not None and participant_id != user.id:
+            await fanout.send_to_user(participant_id, {
+                "type": "read_receipt",
+                "thread_id": thread.id,
+                "reader_id": str(user.id),
+                "last_read_message_id": message_id,
+                "read_at": read_at.isoformat()
+            })
+    return newly_read
 
 @router.get("/thread", response_model=ThreadResponse)
 async def get_or_create_thread(
@@ -44,6 +123,8 @@ async def get_or_create_thread(
             assigned_teacher_id=teacher_id
         )
         db.add(thread)
+        db.flush()
+        add_participants(db, thread.id, [current_user.id, teacher_id])
         db.commit()
         db.refresh(thread)
     
@@ -57,14 +138,10 @@ async def get_or_create_thread(
         if teacher:
             teacher_name = teacher.name
             teacher_avatar = teacher.avatar_url
-            is_online = thread.assigned_teacher_id in active_connections
+            is_online = await presence.is_online(thread.assigned_teacher_id)
     
-    # Get unread message count
-    unread_count = db.query(ChatMessage).filter(
-        ChatMessage.thread_id == thread.id,
-        ChatMessage.sender_id != current_user.id,
-        ChatMessage.read_status == False
-    ).count()
+    # Stored counter instead of counting unread messages on every poll
+    unread_count = get_unread_counts(db, current_user.id, [thread.id]).get(thread.id, 0)
     
     return ThreadResponse(
         id=thread.id,
@@ -77,59 +154,218 @@ async def get_or_create_thread(
         created_at=thread.created_at
     )
 
-@router.get("/thread/messages", response_model=List[MessageResponse])
+@router.get("/unread", response_model=UnreadCountsResponse)
+async def get_unread_counts_endpoint(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get unread message counts for each of the user's threads and in total"""
+    counts = get_unread_counts(db, current_user.id)
+    
+    return UnreadCountsResponse(
+        total=sum(counts.values()),
+        threads=[
+            ThreadUnreadResponse(thread_id=thread_id, unread_count=count)
+            for thread_id, count in sorted(counts.items())
+        ]
+    )
+
+@router.get("/presence", response_model=PresenceResponse)
+async def get_thread_presence(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Whether the other participant of each of the user's threads is online"""
+    counterparts = _thread_counterparts(db, current_user.id)
+    online = await presence.online_users(user_id for _, user_id in counterparts)
+    
+    return PresenceResponse(threads=[
+        ThreadPresenceResponse(thread_id=thread_id, user_id=str(user_id), is_online=str(user_id) in online)
+        for thread_id, user_id in counterparts
+    ])
+
+@router.get("/inbox", response_model=InboxPageResponse)
+@require_permission("teacher:students:view")
+async def get_teacher_inbox(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = 20
+):
+    """The teacher's student threads with their last message and unread count, most recent first"""
+    limit = max(1, min(limit, MAX_INBOX_PAGE))
+    
+    # Newest message per thread from ix_chat_messages_thread_timestamp_id, one index probe each
+    last_message = (
+        select(ChatMessage.id, ChatMessage.content, ChatMessage.sender_id)
+        .where(ChatMessage.thread_id == ChatThread.id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(1)
+        .lateral("last_message")
+    )
+    query = (
+        select(
+            ChatThread.id.label("thread_id"),
+            ChatThread.user_id.label("student_id"),
+            func.coalesce(User.name, "Unknown").label("student_name"),
+            User.avatar_url.label("student_avatar"),
+            last_message.c.id.label("last_message_id"),
+            last_message.c.content.label("last_message"),
+            last_message.c.sender_id.label("last_message_sender_id"),
+            ChatThread.last_message_at,
+            ChatThreadParticipant.unread_count
+        )
+        .outerjoin(User, User.id == ChatThread.user_id)
+        .outerjoin(
+            ChatThreadParticipant,
+            and_(
+                ChatThreadParticipant.thread_id == ChatThread.id,
+                ChatThreadParticipant.user_id == current_user.id
+            )
+        )
+        .outerjoin(last_message, true())
+        .where(ChatThread.assigned_teacher_id == current_user.id)
+        .order_by(ChatThread.last_message_at.desc(), ChatThread.id.desc())
+        .limit(limit + 1)
+    )
+    
+    # Seek past the last thread of the previous page (ix_chat_threads_teacher_activity)
+    if cursor:
+        position = decode_cursor(cursor)
+        last_message_at = parse_timestamp(position[0]) if position and len(position) == 2 else None
+        if last_message_at is None or not isinstance(position[1], int):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            tuple_(ChatThread.last_message_at, ChatThread.id) < tuple_(last_message_at, position[1])
+        )
+    
+    rows = [dict(row) for row in db.execute(query).mappings()]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["last_message_at"].isoformat(), rows[-1]["thread_id"])
+    
+    # Threads that predate the counters get theirs computed once
+    missing = [row["thread_id"] for row in rows if row["unread_count"] is None]
+    counts = get_unread_counts(db, current_user.id, missing) if missing else {}
+    online = await presence.online_users(row["student_id"] for row in rows)
+    
+    for row in rows:
+        if row["unread_count"] is None:
+            row["unread_count"] = counts.get(row["thread_id"], 0)
+        row["is_online"] = str(row["student_id"]) in online
+    
+    return trusted_page_response(InboxThreadResponse, rows, next_cursor)
+
+@router.get("/thread/messages", response_model=MessagesPageResponse)
 async def get_message_history(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
-    before: str = None  # timestamp for pagination
+    cursor: Optional[str] = None,
+    limit: int = 50
 ):
-    """Get message history for the user's chat thread"""
+    """Get message history for the user's chat thread, newest page first"""
+    limit = max(1, min(limit, MAX_MESSAGES_PAGE))
+    
     # Get user's thread
     thread = db.query(ChatThread).filter(
         ChatThread.user_id == current_user.id
     ).first()
     
     if not thread:
-        return []
+        return trusted_page_response(MessageResponse, [], None)
     
-    # Build query
-    query = db.query(ChatMessage).filter(
-        ChatMessage.thread_id == thread.id
-    ).order_by(ChatMessage.timestamp.desc())
+    # Sender names come from the same query instead of one lookup per message
+    query = (
+        select(
+            ChatMessage.id,
+            ChatMessage.thread_id,
+            ChatMessage.sender_id,
+            func.coalesce(User.name, "Unknown").label("sender_name"),
+            ChatMessage.sender_type,
+            ChatMessage.content,
+            ChatMessage.message_type,
+            ChatMessage.timestamp,
+            ChatMessage.read_status
+        )
+        .outerjoin(User, User.id == ChatMessage.sender_id)
+        .where(ChatMessage.thread_id == thread.id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
     
-    # Apply pagination if before timestamp provided
-    if before:
-        try:
-            before_date = datetime.fromisoformat(before.replace('Z', '+00:00'))
-            query = query.filter(ChatMessage.timestamp < before_date)
-        except ValueError:
-            pass
+    # Seek past the oldest message of the previous page (ix_chat_messages_thread_timestamp_id)
+    if cursor:
+        position = decode_cursor(cursor)
+        timestamp = parse_timestamp(position[0]) if position and len(position) == 2 else None
+        if timestamp is None or not isinstance(position[1], int):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(timestamp, position[1])
+        )
     
-    messages = query.limit(50).all()
+    rows = db.execute(query).mappings().all()
     
-    # Mark messages as read
-    for message in messages:
-        if message.sender_id != current_user.id and not message.read_status:
-            message.read_status = True
-    db.commit()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["timestamp"].isoformat(), rows[-1]["id"])
+    
+    # Everything up to the newest message shown is now read: one watermark write
+    if rows:
+        await _mark_thread_read(db, thread, current_user, max(row["id"] for row in rows))
+    
+    # The user's own messages count as read once another participant's watermark passes them
+    watermarks = read_watermarks(db, thread.id)
+    read_up_to = max(
+        (message_id or 0 for user_id, message_id in watermarks.items() if user_id != current_user.id),
+        default=0
+    )
+    
+    # Return in chronological order
+    response = [
+        {
+            **row,
+            "read_status": row["read_status"] or row["sender_id"] != current_user.id or row["id"] <= read_up_to
+        }
+        for row in reversed(rows)
+    ]
+    
+    return trusted_page_response(MessageResponse, response, next_cursor)
+
+@router.post("/thread/read", response_model=ThreadReadResponse)
+async def mark_thread_read(
+    read_data: ThreadReadRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mark the user's thread as read up to a message"""
+    thread = db.query(ChatThread).filter(
+        ChatThread.user_id == current_user.id
+    ).first()
+    
+    if not thread or not db.scalar(
+        select(ChatMessage.id).where(
+            ChatMessage.id == read_data.message_id,
+            ChatMessage.thread_id == thread.id
+        )
+    ):
+        raise HTTPException(status_code=404, detail="Message not found")
     
-    # Prepare response
-    response = []
-    for msg in reversed(messages):  # Return in chronological order
-        sender = db.query(User).filter(User.id == msg.sender_id).first()
-        response.append(MessageResponse(
-            id=msg.id,
-            thread_id=msg.thread_id,
-            sender_id=msg.sender_id,
-            sender_name=sender.name if sender else "Unknown",
-            sender_type=msg.sender_type,
-            content=msg.content,
-            message_type=msg.message_type,
-            timestamp=msg.timestamp,
-            read_status=msg.read_status
-        ))
-    
-    return response
+    newly_read = await _mark_thread_read(db, thread, current_user, read_data.message_id)
+    
+    return ThreadReadResponse(
+        thread_id=thread.id,
+        last_read_message_id=read_watermarks(db, thread.id).get(current_user.id),
+        newly_read=newly_read
+    )
 
 @router.post("/thread/messages", response_model=MessageResponse)
 async def send_message(
@@ -147,6 +383,8 @@ async def send_message(
         # Create a thread if it doesn't exist
         thread = ChatThread(user_id=current_user.id)
         db.add(thread)
+        db.flush()
+        add_participants(db, thread.id, [current_user.id])
         db.commit()
         db.refresh(thread)
     
@@ -160,13 +398,16 @@ async def send_message(
     )
     
     db.add(new_message)
+    increment_unread(db, thread.id, current_user.id)
+    touch_thread(db, thread.id)
+    if thread.assigned_teacher_id:
+        bump_user_stats(db, thread.assigned_teacher_id, unread_messages=1)
     db.commit()
     db.refresh(new_message)
     
-    # Notify teacher if connected via WebSocket
-    if thread.assigned_teacher_id and thread.assigned_teacher_id in active_connections:
-        teacher_ws = active_connections[thread.assigned_teacher_id]
-        await teacher_ws.send_text(json.dumps({
+    # Notify the teacher on whichever worker holds their socket
+    if thread.assigned_teacher_id:
+        await fanout.send_to_user(thread.assigned_teacher_id, {
             "type": "new_message",
             "thread_id": thread.id,
             "message": {
@@ -176,7 +417,7 @@ async def send_message(
                 "sender_name": current_user.name,
                 "timestamp": new_message.timestamp.isoformat()
             }
-        }))
+        })
     
     return MessageResponse(
         id=new_message.id,
@@ -193,43 +434,84 @@ async def send_message(
 @router.websocket("/socket")
 async def websocket_endpoint(
     websocket: WebSocket,
-    token: str,
-    db: Session = Depends(get_db)
+    token: str
 ):
     """WebSocket endpoint for real-time chat"""
+    # No session is held for the life of the socket: each step that needs the
+    # database checks one out and returns it to the pool straight away
+    db = SessionLocal()
     try:
-        # Authenticate user
-        from app.auth import get_current_user_from_token
-        user = await get_current_user_from_token(token, db)
+        user = get_user_from_token(token, db)
+    except Exception as e:
+        # Bad or expired tokens, and Clerk or network errors while checking them.
+        # Closing before accepting would reject the handshake with a plain HTTP
+        # 403, so accept first and send the 1008 close frame clients expect.
+        db.close()
+        await websocket.accept()
+        await websocket.close(code=1008)
+        print(f"WebSocket authentication failed: {getattr(e, 'detail', e)}")
+        return
+    
+    try:
+        try:
+            role = "teacher" if user.has_role("teacher") else "student"
+            threads = dict(_thread_counterparts(db, user.id))
+        finally:
+            db.close()
         
         await websocket.accept()
-        active_connections[user.id] = websocket
+        connection = await fanout.connect(user.id, websocket, role=role, threads=threads)
+        await presence.connect(user.id, websocket, watch=connection.threads.values())
         
         try:
             while True:
                 data = await websocket.receive_text()
+                # Any frame counts as a heartbeat; idle clients send "heartbeat"
+                connection.touch()
+                await presence.heartbeat(websocket)
                 message_data = json.loads(data)
                 
                 # Handle different message types
-                if message_data.get("type") == "typing":
-                    # Broadcast typing indicator
-                    pass
+                if message_data.get("type") == "heartbeat":
+                    connection.send(json.dumps({"type": "heartbeat_ack"}))
+                
+                elif message_data.get("type") == "typing":
+                    # Relay to the other participant
+                    recipient_id = await _socket_counterpart(
+                        connection, websocket, user.id, message_data.get("thread_id")
+                    )
+                    if recipient_id is not None:
+                        await typing_throttle.relay(
+                            user.id, message_data["thread_id"], recipient_id,
+                            bool(message_data.get("is_typing", True))
+                        )
+                
+                elif message_data.get("type") == "read":
+                    # Same as POST /thread/read, for either side of the thread
+                    message_id = message_data.get("message_id")
+                    if not isinstance(message_id, int) or await _socket_counterpart(
+                        connection, websocket, user.id, message_data.get("thread_id")
+                    ) is None:
+                        continue
+                    db = SessionLocal()
+                    try:
+                        thread = db.get(ChatThread, int(message_data["thread_id"]))
+                        if thread and db.scalar(
+                            select(ChatMessage.id).where(
+                                ChatMessage.id == message_id,
+                                ChatMessage.thread_id == thread.id
+                            )
+                        ):
+                            await _mark_thread_read(db, thread, user, message_id)
+                    finally:
+                        db.close()
                     
         except WebSocketDisconnect:
-            del active_connections[user.id]
+            pass
+        finally:
+            await presence.disconnect(websocket)
+            await fanout.disconnect(user.id, websocket)
             
     except Exception as e:
         await websocket.close()
         print(f"WebSocket error: {e}")
-
-async def get_current_user_from_token(token: str, db: Session):
-    """Helper function to get user from token for WebSocket"""
-    from app.auth import get_current_user
-    from fastapi import Header
-    # Simplified implementation - in production, use proper JWT verification
-    try:
-        # This would normally verify the JWT token
-        user = db.query(User).filter(User.id == 1).first()  # Placeholder
-        return user
-    except:
-        raise WebSocketDisconnect(1008, "Authentication failed")
\ No newline at end of file
@@ -7,6 +7,7 @@ from app.database import get_db
 from app.models import User, Role
 from app.schemas import ClerkWebhookEvent, ClerkUserCreated
 from app.clerk import clerk_client
+from app.stats import create_user_stats
 
 router = APIRouter()
 
@@ -84,6 +85,7 @@ async def handle_user_created(user_data: dict, db: Session):
         )
         db.add(user)
         db.flush()  # Flush to get the user ID
+        create_user_stats(db, user.id)
         
         # Assign default student role
         student_role = db.query(Role).filter(Role.name == "student").first()
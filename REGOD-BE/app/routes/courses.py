@@ -1,16 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy import select, update, func, values, column, cast, Integer, String, Text, Boolean
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
+import orjson
 
 from app.database import get_db
-from app.models import User, Course, UserCourseProgress, StudentTeacherAccess, Module
-from app.schemas import DashboardResponse, UserCourseProgressBase, CourseResponse, ModuleResponse
+from app.models import (
+    User, Course, UserCourseProgress, StudentTeacherAccess, Module,
+    UserModuleProgress, UserFavorite, UserNote
+)
+from app.schemas import (
+    DashboardResponse, UserCourseProgressBase, CourseResponse, ModuleResponse, CourseModuleResponse,
+    ModuleReorderRequest, ModuleBulkUpdateRequest, CourseModulesResponse
+)
 from app.auth import get_current_user
 from app.rbac import require_permission
+from app.cache import course_catalog_cache, cached_payload_response
+from app.stats import bump_user_stats, COMPLETED_PERCENTAGE
+from app.analytics import record_course_progress
+from app.favorite_cache import favorite_cache
+from app.responses import trusted_response
 
 router = APIRouter()
 
+# Upper bound on modules touched by one reorder or bulk edit request
+MAX_BULK_MODULES = 1000
+
 @router.get("/user/dashboard", response_model=DashboardResponse)
 async def get_user_dashboard(
     current_user: User = Depends(get_current_user), 
@@ -201,6 +217,8 @@ async def update_course_progress(
         UserCourseProgress.user_id == current_user.id,
         UserCourseProgress.course_id == progress_data.course_id
     ).first()
+    previous_percentage = user_progress.progress_percentage if user_progress else None
+    was_completed = previous_percentage is not None and previous_percentage >= COMPLETED_PERCENTAGE
     
     if not user_progress:
         user_progress = UserCourseProgress(
@@ -215,6 +233,16 @@ async def update_course_progress(
         if progress_data.last_visited_module_id:
             user_progress.last_visited_module_id = progress_data.last_visited_module_id
     
+    # Keep the completed-courses counter in step with completion transitions
+    is_completed = progress_data.progress_percentage >= COMPLETED_PERCENTAGE
+    if is_completed != was_completed:
+        user_progress.completed_at = func.now() if is_completed else None
+        bump_user_stats(db, current_user.id, completed_courses=1 if is_completed else -1)
+    
+    record_course_progress(db, {
+        progress_data.course_id: (previous_percentage, progress_data.progress_percentage)
+    })
+    
     db.commit()
     db.refresh(user_progress)
     
@@ -257,7 +285,7 @@ async def get_courses(
     
     return courses
 
-@router.get("/courses/{course_id}/modules", response_model=List[ModuleResponse])
+@router.get("/courses/{course_id}/modules", response_model=List[CourseModuleResponse])
 async def get_course_modules(
     course_id: int,
     current_user: User = Depends(get_current_user),
@@ -287,9 +315,337 @@ async def get_course_modules(
             )
     
     # Get modules for the course
+    modules = db.execute(
+        select(Module.id, Module.course_id, Module.title, Module.description, Module.order)
+        .where(Module.course_id == course_id, Module.is_active == True)
+        .order_by(Module.order)
+    ).all()
+    
+    # Hearts come from the cached favourite set, not a query per listing
+    favorite_flags = favorite_cache.flags(db, current_user.id, [module.id for module in modules])
+    
+    return trusted_response(CourseModuleResponse, (
+        {**module._mapping, "is_favorite": is_favorite}
+        for module, is_favorite in zip(modules, favorite_flags)
+    ))
+
+def _get_accessible_course(db: Session, current_user: User, course_id: int) -> Course:
+    """Load a course and enforce the student access rule"""
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+    
+    if current_user.has_role("student"):
+        has_access = db.query(StudentTeacherAccess).filter(
+            StudentTeacherAccess.student_id == current_user.id,
+            StudentTeacherAccess.teacher_id == course.created_by,
+            StudentTeacherAccess.is_active == True
+        ).first()
+        
+        if not has_access:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have access to this course"
+            )
+    
+    return course
+
+def _get_course_catalog(db: Session, course: Course):
+    """Return the serialized course + ordered modules for the current course version"""
+    key = f"course-{course.id}"
+    payload = course_catalog_cache.get(key, course.version)
+    if payload:
+        return payload
+    
+    modules = db.execute(
+        select(Module.id, Module.title, Module.description, Module.order)
+        .where(Module.course_id == course.id, Module.is_active == True)
+        .order_by(Module.order, Module.id)
+    ).all()
+    
+    catalog = {
+        "course": {
+            "id": course.id,
+            "title": course.title,
+            "description": course.description,
+            "thumbnail_url": course.thumbnail_url,
+            "category": course.category,
+            "difficulty": course.difficulty,
+            "total_modules": course.total_modules,
+            "created_at": course.created_at.isoformat() if course.created_at else None
+        },
+        "modules": [
+            {
+                "id": module.id,
+                "course_id": course.id,
+                "title": module.title,
+                "description": module.description,
+                "order": module.order
+            }
+            for module in modules
+        ]
+    }
+    
+    body = orjson.dumps(catalog)
+    return course_catalog_cache.put(key, course.version, body)
+
+@router.get("/courses/{course_id}/catalog")
+async def get_course_catalog(
+    course_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the immutable part of a course bundle as precompressed bytes"""
+    course = _get_accessible_course(db, current_user, course_id)
+    payload = _get_course_catalog(db, course)
+    
+    return cached_payload_response(request, payload)
+
+@router.get("/courses/{course_id}/bundle")
+async def get_course_bundle(
+    course_id: int,
+    catalog_version: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get a course, its ordered modules and the user's state for it in one response.
+
+    The course and module part is spliced in from the per-version cache
+    without re-serializing; clients that already hold the current
+    ``catalog_version`` get ``"catalog": null`` and only the user state.
+    """
+    course = _get_accessible_course(db, current_user, course_id)
+    
+    catalog = None
+    if catalog_version != course.version:
+        catalog = _get_course_catalog(db, course)
+    
+    progress = db.execute(
+        select(
+            UserCourseProgress.progress_percentage,
+            UserCourseProgress.last_visited_module_id,
+            UserCourseProgress.last_visited_at,
+            UserCourseProgress.completed_at
+        ).where(
+            UserCourseProgress.user_id == current_user.id,
+            UserCourseProgress.course_id == course_id
+        )
+    ).first()
+    
+    module_status = db.execute(
+        select(UserModuleProgress.module_id, UserModuleProgress.status).where(
+            UserModuleProgress.user_id == current_user.id,
+            UserModuleProgress.course_id == course_id
+        )
+    ).all()
+    
+    favorite_lesson_ids = db.scalars(
+        select(UserFavorite.lesson_id)
+        .join(Module, Module.id == UserFavorite.lesson_id)
+        .where(UserFavorite.user_id == current_user.id, Module.course_id == course_id)
+        .order_by(UserFavorite.lesson_id)
+    ).all()
+    
+    note_counts = db.execute(
+        select(UserNote.lesson_id, func.count(UserNote.id))
+        .where(UserNote.user_id == current_user.id, UserNote.course_id == course_id)
+        .group_by(UserNote.lesson_id)
+    ).all()
+    
+    user_state = {
+        "progress_percentage": progress.progress_percentage if progress else 0,
+        "last_visited_module_id": progress.last_visited_module_id if progress else None,
+        "last_visited_at": progress.last_visited_at.isoformat() if progress and progress.last_visited_at else None,
+        "completed_at": progress.completed_at.isoformat() if progress and progress.completed_at else None,
+        "module_status": {str(module_id): module_state for module_id, module_state in module_status},
+        "favorite_lesson_ids": list(favorite_lesson_ids),
+        "note_counts": {str(lesson_id): count for lesson_id, count in note_counts}
+    }
+    
+    body = b"".join([
+        b'{"catalog_version":', str(course.version).encode(),
+        b',"catalog":', catalog.body if catalog else b"null",
+        b',"user_state":', orjson.dumps(user_state),
+        b"}"
+    ])
+    
+    return Response(content=body, media_type="application/json")
+
+def _get_editable_course(db: Session, current_user: User, course_id: int) -> Course:
+    """Load and row-lock a course the current user may edit"""
+    course = db.query(Course).filter(Course.id == course_id).with_for_update().first()
+    if not course:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Course not found"
+        )
+    
+    if course.created_by != current_user.id and not current_user.has_permission("admin:courses:manage"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You can only edit your own courses"
+        )
+    
+    return course
+
+def _commit_module_changes(db: Session, course: Course) -> CourseModulesResponse:
+    """Bump the catalog version, recount modules, commit and return the new listing"""
+    active_modules = (
+        select(func.count(Module.id))
+        .where(Module.course_id == course.id, Module.is_active == True)
+        .scalar_subquery()
+    )
+    version, total_modules = db.execute(
+        update(Course)
+        .where(Course.id == course.id)
+        .values(version=Course.version + 1, total_modules=active_modules)
+        .returning(Course.version, Course.total_modules),
+        execution_options={"synchronize_session": False}
+    ).one()
+    db.commit()
+    
     modules = db.query(Module).filter(
-        Module.course_id == course_id,
+        Module.course_id == course.id,
         Module.is_active == True
-    ).order_by(Module.order).all()
+    ).order_by(Module.order, Module.id).all()
+    
+    return CourseModulesResponse(
+        course_id=course.id,
+        version=version,
+        total_modules=total_modules,
+        modules=modules
+    )
+
+@router.put("/courses/{course_id}/modules/order", response_model=CourseModulesResponse)
+@require_permission("course:write")
+async def reorder_course_modules(
+    course_id: int,
+    reorder: ModuleReorderRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Reorder a course's modules from a full ordering or a list of moves.
+
+    Positions are 1-based over the course's active modules. Only modules
+    whose position actually changes are written, in a single statement.
+    """
+    if (reorder.module_ids is None) == (reorder.moves is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either module_ids or moves"
+        )
+    
+    course = _get_editable_course(db, current_user, course_id)
+    
+    current = db.execute(
+        select(Module.id, Module.order)
+        .where(Module.course_id == course_id, Module.is_active == True)
+        .order_by(Module.order, Module.id)
+    ).all()
+    ordering = [module_id for module_id, _ in current]
+    
+    if reorder.module_ids is not None:
+        if len(reorder.module_ids) != len(ordering) or set(reorder.module_ids) != set(ordering):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="module_ids must list every active module of the course exactly once"
+            )
+        ordering = list(reorder.module_ids)
+    else:
+        if len(reorder.moves) > MAX_BULK_MODULES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {MAX_BULK_MODULES} moves per request"
+            )
+        for move in reorder.moves:
+            if move.module_id not in ordering or not 1 <= move.position <= len(ordering):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid move for module {move.module_id}"
+                )
+            ordering.remove(move.module_id)
+            ordering.insert(move.position - 1, move.module_id)
+    
+    previous_order = dict(current)
+    changed = [
+        (module_id, position)
+        for position, module_id in enumerate(ordering, start=1)
+        if previous_order[module_id] != position
+    ]
+    
+    if changed:
+        new_order = values(
+            column("id", Integer), column("order", Integer), name="module_order"
+        ).data(changed)
+        db.execute(
+            update(Module)
+            .where(Module.id == new_order.c.id, Module.course_id == course_id)
+            .values(order=new_order.c.order),
+            execution_options={"synchronize_session": False}
+        )
+    
+    return _commit_module_changes(db, course)
+
+@router.patch("/courses/{course_id}/modules", response_model=CourseModulesResponse)
+@require_permission("course:write")
+async def bulk_update_course_modules(
+    course_id: int,
+    bulk_update: ModuleBulkUpdateRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Edit many modules of a course in one statement.
+
+    Fields left out (or null) keep their current value.
+    """
+    if not bulk_update.modules or len(bulk_update.modules) > MAX_BULK_MODULES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Provide between 1 and {MAX_BULK_MODULES} modules"
+        )
+    
+    module_ids = [module.id for module in bulk_update.modules]
+    if len(set(module_ids)) != len(module_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Each module may appear only once"
+        )
+    
+    course = _get_editable_course(db, current_user, course_id)
+    
+    owned = set(db.scalars(
+        select(Module.id).where(Module.course_id == course_id, Module.id.in_(module_ids))
+    ).all())
+    unknown = [module_id for module_id in module_ids if module_id not in owned]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Modules not found in this course: {unknown}"
+        )
+    
+    patch = values(
+        column("id", Integer), column("title", String), column("description", Text),
+        column("order", Integer), column("is_active", Boolean),
+        name="module_patch"
+    ).data([
+        (module.id, module.title, module.description, module.order, module.is_active)
+        for module in bulk_update.modules
+    ])
+    # Casts keep all-NULL columns of the VALUES list typed
+    db.execute(
+        update(Module)
+        .where(Module.id == patch.c.id, Module.course_id == course_id)
+        .values(
+            title=func.coalesce(cast(patch.c.title, String), Module.title),
+            description=func.coalesce(cast(patch.c.description, Text), Module.description),
+            order=func.coalesce(cast(patch.c.order, Integer), Module.order),
+            is_active=func.coalesce(cast(patch.c.is_active, Boolean), Module.is_active)
+        ),
+        execution_options={"synchronize_session": False}
+    )
     
-    return modules
\ No newline at end of file
+    return _commit_module_changes(db, course)
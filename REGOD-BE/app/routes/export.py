@@ -0,0 +1,110 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
+import os
+import uuid
+
+from app.database import get_db
+from app.models import User, StudentTeacherAccess
+from app.auth import get_current_user
+from app.export import EXPORT_ENTITIES, EXPORT_FORMATS, export_plan, stream_export, stream_export_zip
+from app.ratelimit import create_rate_limiter
+from app.utils.helpers import decode_cursor
+
+router = APIRouter()
+
+# Resumed downloads count too, so leave room for a few retries
+export_limiter = create_rate_limiter(
+    "export",
+    int(os.getenv("EXPORT_RATE_LIMIT", "10")),
+    int(os.getenv("EXPORT_RATE_WINDOW", "3600"))
+)
+
+@router.get("/export")
+async def export_user_data(
+    format: str = "ndjson",
+    archive: bool = False,
+    include: Optional[str] = None,
+    student_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream the user's progress, favourites and notes as NDJSON or CSV, optionally zipped"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+
+    entities = include.split(",") if include else list(EXPORT_ENTITIES)
+    unknown = [entity for entity in entities if entity not in EXPORT_ENTITIES]
+    if unknown or not entities:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"include must list some of: {', '.join(EXPORT_ENTITIES)}"
+        )
+    if format == "csv" and not archive and len(entities) > 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="CSV exports of several entities must be zipped (archive=true)"
+        )
+
+    # Teachers may export the data of students who have access to them
+    user_id = current_user.id
+    if student_id is not None:
+        try:
+            user_id = uuid.UUID(student_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid student_id"
+            )
+        if user_id != current_user.id and not current_user.has_role("admin"):
+            has_access = current_user.has_permission("teacher:students:view") and db.query(StudentTeacherAccess).filter(
+                StudentTeacherAccess.student_id == user_id,
+                StudentTeacherAccess.teacher_id == current_user.id,
+                StudentTeacherAccess.is_active == True
+            ).first()
+            if not has_access:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="You don't have access to this student's data"
+                )
+
+    # A cursor that does not decode is invalid, not absent
+    plan = export_plan(entities, (decode_cursor(cursor) or []) if cursor else None)
+    if not plan:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+    retry_after = export_limiter.hit(str(current_user.id))
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many exports, try again later",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    # Rows are read on short per-batch sessions while the body streams; the
+    # request's session would otherwise stay checked out until the last byte
+    db.close()
+    filename = f"regod-export-{datetime.utcnow():%Y%m%d%H%M%S}"
+    if archive:
+        body = stream_export_zip(user_id, plan, format)
+        media_type = "application/zip"
+        filename += ".zip"
+    else:
+        body = stream_export(user_id, plan, format)
+        media_type = EXPORT_FORMATS[format]
+        filename += f".{format}"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,99 +1,154 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, delete, exists, literal, true, tuple_
+from sqlalchemy.dialects.postgresql import insert, UUID
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Optional
 
 from app.database import get_db
-from app.models import User, UserFavorite, Module
-from app.schemas import FavoriteResponse
+from app.models import User, UserFavorite, Module, Course, StudentTeacherAccess
+from app.schemas import FavoriteResponse, FavoritesPageResponse
 from app.auth import get_current_user
 from app.rbac import require_permission
+from app.changes import record_tombstones
+from app.stats import bump_user_stats
+from app.favorite_cache import favorite_cache
+from app.responses import trusted_page_response
+from app.utils.helpers import encode_cursor, decode_cursor, parse_timestamp
 
 router = APIRouter()
 
+MAX_FAVORITES_PAGE = 100
+
 @router.post("/favourites/{lesson_id}", response_model=dict)
 async def toggle_favorite(
     lesson_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Toggle favorite status for a lesson"""
-    # Check if lesson exists
-    lesson = db.query(Module).filter(Module.id == lesson_id).first()
-    if not lesson:
+    """Toggle favorite status for a lesson.
+
+    The lesson lookup, the access check and the delete-or-insert run as one
+    statement: the delete removes an existing favourite, and the insert only
+    runs when nothing was deleted (uq_user_favorites_user_lesson guards
+    against a concurrent toggle).
+    """
+    # Students need access to the teacher who created the course
+    if current_user.has_role("student"):
+        allowed = exists().where(
+            StudentTeacherAccess.student_id == current_user.id,
+            StudentTeacherAccess.teacher_id == Course.created_by,
+            StudentTeacherAccess.is_active == True
+        )
+    else:
+        allowed = true()
+    
+    lesson = (
+        select(Module.id, allowed.label("allowed"))
+        .join(Course, Course.id == Module.course_id)
+        .where(Module.id == lesson_id)
+        .cte("lesson")
+    )
+    allowed_lesson = select(lesson.c.id).where(lesson.c.allowed)
+    removed = (
+        delete(UserFavorite)
+        .where(
+            UserFavorite.user_id == current_user.id,
+            UserFavorite.lesson_id.in_(allowed_lesson)
+        )
+        .returning(UserFavorite.lesson_id)
+        .cte("removed")
+    )
+    added = (
+        insert(UserFavorite)
+        .from_select(
+            ["user_id", "lesson_id"],
+            select(literal(current_user.id, UUID(as_uuid=True)), lesson.c.id)
+            .where(lesson.c.allowed, ~exists(select(removed.c.lesson_id)))
+        )
+        .on_conflict_do_nothing(constraint="uq_user_favorites_user_lesson")
+        .returning(UserFavorite.lesson_id)
+        .cte("added")
+    )
+    result = db.execute(select(
+        select(lesson.c.allowed).scalar_subquery().label("allowed"),
+        exists(select(removed.c.lesson_id)).label("removed"),
+        exists(select(added.c.lesson_id)).label("added")
+    )).one()
+    
+    if result.allowed is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Lesson not found"
         )
+    if not result.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this lesson"
+        )
     
-    # Check if user has access to the course
-    from app.models import StudentTeacherAccess, Course
-    if current_user.has_role("student"):
-        course = db.query(Course).filter(Course.id == lesson.course_id).first()
-        if course:
-            has_access = db.query(StudentTeacherAccess).filter(
-                StudentTeacherAccess.student_id == current_user.id,
-                StudentTeacherAccess.teacher_id == course.created_by,
-                StudentTeacherAccess.is_active == True
-            ).first()
-            
-            if not has_access:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="You don't have access to this lesson"
-                )
-    
-    # Check if already favorited
-    existing_favorite = db.query(UserFavorite).filter(
-        UserFavorite.user_id == current_user.id,
-        UserFavorite.lesson_id == lesson_id
-    ).first()
-    
-    if existing_favorite:
-        # Remove from favorites
-        db.delete(existing_favorite)
+    if result.removed:
+        record_tombstones(db, "favorite", current_user.id, [lesson_id])
+        bump_user_stats(db, current_user.id, favorites=-1)
         db.commit()
+        favorite_cache.remove(current_user.id, [lesson_id])
         return {"action": "removed", "lesson_id": lesson_id}
-    else:
-        # Add to favorites
-        new_favorite = UserFavorite(
-            user_id=current_user.id,
-            lesson_id=lesson_id
-        )
-        db.add(new_favorite)
-        db.commit()
-        db.refresh(new_favorite)
-        return {"action": "added", "lesson_id": lesson_id}
+    
+    if result.added:
+        bump_user_stats(db, current_user.id, favorites=1)
+    db.commit()
+    favorite_cache.add(current_user.id, [lesson_id])
+    return {"action": "added", "lesson_id": lesson_id}
 
-@router.get("/favourites", response_model=List[FavoriteResponse])
+@router.get("/favourites", response_model=FavoritesPageResponse)
 async def get_favorites(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
-    page: int = 1,
+    cursor: Optional[str] = None,
     limit: int = 20
 ):
-    """Get user's favorite lessons"""
-    # Calculate offset
-    offset = (page - 1) * limit
+    """Get user's favorite lessons, newest first, one keyset page at a time"""
+    limit = max(1, min(limit, MAX_FAVORITES_PAGE))
     
-    # Get user's favorites
-    favorites = db.query(UserFavorite).filter(
-        UserFavorite.user_id == current_user.id
-    ).offset(offset).limit(limit).all()
+    # One joined projection instead of lazy-loading lesson and course per row
+    query = (
+        select(
+            UserFavorite.id,
+            UserFavorite.user_id,
+            UserFavorite.lesson_id,
+            UserFavorite.created_at,
+            Module.title.label("lesson_title"),
+            Course.title.label("course_title"),
+            Course.thumbnail_url
+        )
+        .join(Module, Module.id == UserFavorite.lesson_id)
+        .join(Course, Course.id == Module.course_id)
+        .where(UserFavorite.user_id == current_user.id)
+        .order_by(UserFavorite.created_at.desc(), UserFavorite.id.desc())
+        .limit(limit + 1)
+    )
+    
+    # Seek past the last row of the previous page (ix_user_favorites_user_created)
+    if cursor:
+        position = decode_cursor(cursor)
+        created_at = parse_timestamp(position[0]) if position and len(position) == 2 else None
+        if created_at is None or not isinstance(position[1], int):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            tuple_(UserFavorite.created_at, UserFavorite.id) < tuple_(created_at, position[1])
+        )
+    
+    rows = db.execute(query).mappings().all()
     
-    # Prepare response
-    response = []
-    for fav in favorites:
-        response.append(FavoriteResponse(
-            id=fav.id,
-            user_id=fav.user_id,
-            lesson_id=fav.lesson_id,
-            created_at=fav.created_at,
-            lesson_title=fav.lesson.title,
-            course_title=fav.lesson.course.title,
-            thumbnail_url=fav.lesson.course.thumbnail_url
-        ))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"].isoformat(), rows[-1]["id"])
     
-    return response
+    # Trusted DB rows, so skip re-validation
+    return trusted_page_response(FavoriteResponse, rows, next_cursor)
 
 @router.delete("/favourites/{favorite_id}")
 async def delete_favorite(
@@ -114,6 +169,9 @@ async def delete_favorite(
         )
     
     db.delete(favorite)
+    record_tombstones(db, "favorite", current_user.id, [favorite.lesson_id])
+    bump_user_stats(db, current_user.id, favorites=-1)
     db.commit()
+    favorite_cache.remove(current_user.id, [favorite.lesson_id])
     
     return {"message": "Favorite removed successfully"}
\ No newline at end of file
@@ -1,15 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import select, update, func
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from app.database import get_db
-from app.models import User, UserNote, Course, Module, StudentTeacherAccess
-from app.schemas import UserResponse, NoteBase, NoteResponse, ShareCourseResponse
+from app.models import User, UserNote, Course, Module, StudentTeacherAccess, note_search_vector
+from app.schemas import (
+    UserResponse, NoteBase, NoteResponse, NotesPageResponse, NotePatchRequest, NotePatchResponse,
+    ShareCourseResponse, UserStatsResponse
+)
 from app.auth import get_current_user
 from app.rbac import require_permission
+from app.changes import record_tombstones
+from app.stats import bump_user_stats, get_user_stats
+from app.responses import trusted_page_response
+from app.utils.helpers import encode_cursor, decode_cursor
 
 router = APIRouter()
 
+MAX_NOTES_PAGE = 100
+MAX_NOTE_PATCH_OPS = 100
+
+def _note_etag(note_id: int, version: int) -> str:
+    return f'"note-{note_id}-v{version}"'
+
+def _select_notes(notes):
+    """Project note rows together with their course and lesson titles in one query"""
+    return (
+        select(
+            notes.c.id,
+            notes.c.user_id,
+            notes.c.course_id,
+            notes.c.lesson_id,
+            notes.c.note_content,
+            notes.c.version,
+            notes.c.created_at,
+            notes.c.updated_at,
+            func.coalesce(Course.title, "Unknown Course").label("course_title"),
+            func.coalesce(Module.title, "Unknown Lesson").label("lesson_title")
+        )
+        .select_from(notes)
+        .outerjoin(Course, Course.id == notes.c.course_id)
+        .outerjoin(Module, Module.id == notes.c.lesson_id)
+    )
+
 @router.get("/profile", response_model=UserResponse)
 async def get_user_profile(current_user: User = Depends(get_current_user)):
     """Get current user profile"""
@@ -32,34 +66,59 @@ async def update_user_profile(
     db.refresh(current_user)
     return current_user
 
-@router.get("/notes", response_model=List[NoteResponse])
-async def get_user_notes(
+@router.get("/profile/stats", response_model=UserStatsResponse)
+async def get_user_profile_stats(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all notes for the current user"""
-    notes = db.query(UserNote).filter(
-        UserNote.user_id == current_user.id
-    ).all()
+    """Get the current user's completed courses, favourites, notes and unread counts"""
+    return get_user_stats(db, current_user.id)
+
+@router.get("/notes", response_model=NotesPageResponse)
+async def get_user_notes(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    course_id: Optional[int] = None,
+    lesson_id: Optional[int] = None,
+    q: Optional[str] = None
+):
+    """Get the current user's notes, newest first, with optional filters and full-text search"""
+    limit = max(1, min(limit, MAX_NOTES_PAGE))
     
-    response = []
-    for note in notes:
-        course = db.query(Course).filter(Course.id == note.course_id).first()
-        lesson = db.query(Module).filter(Module.id == note.lesson_id).first()
-        
-        response.append(NoteResponse(
-            id=note.id,
-            user_id=note.user_id,
-            course_id=note.course_id,
-            lesson_id=note.lesson_id,
-            note_content=note.note_content,
-            created_at=note.created_at,
-            updated_at=note.updated_at,
-            course_title=course.title if course else "Unknown Course",
-            lesson_title=lesson.title if lesson else "Unknown Lesson"
-        ))
-    
-    return response
+    query = (
+        _select_notes(UserNote.__table__)
+        .where(UserNote.user_id == current_user.id)
+        .order_by(UserNote.id.desc())
+        .limit(limit + 1)
+    )
+    
+    # Each filter combination is backed by a (user_id, ..., id) index
+    if course_id is not None:
+        query = query.where(UserNote.course_id == course_id)
+    if lesson_id is not None:
+        query = query.where(UserNote.lesson_id == lesson_id)
+    if q and q.strip():
+        query = query.where(note_search_vector.op("@@")(func.websearch_to_tsquery("english", q)))
+    
+    if cursor:
+        position = decode_cursor(cursor)
+        if not position or len(position) != 1 or not isinstance(position[0], int):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(UserNote.id < position[0])
+    
+    rows = db.execute(query).mappings().all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["id"])
+    
+    return trusted_page_response(NoteResponse, rows, next_cursor)
 
 @router.post("/notes", response_model=NoteResponse)
 async def create_note(
@@ -100,6 +159,7 @@ async def create_note(
     )
     
     db.add(new_note)
+    bump_user_stats(db, current_user.id, notes=1)
     db.commit()
     db.refresh(new_note)
     
@@ -109,6 +169,7 @@ async def create_note(
         course_id=new_note.course_id,
         lesson_id=new_note.lesson_id,
         note_content=new_note.note_content,
+        version=new_note.version,
         created_at=new_note.created_at,
         updated_at=new_note.updated_at,
         course_title=course.title,
@@ -123,34 +184,92 @@ async def update_note(
     db: Session = Depends(get_db)
 ):
     """Update a note"""
-    note = db.query(UserNote).filter(
-        UserNote.id == note_id,
-        UserNote.user_id == current_user.id
-    ).first()
+    # Update and read back with titles in one statement
+    updated = (
+        update(UserNote)
+        .where(UserNote.id == note_id, UserNote.user_id == current_user.id)
+        .values(note_content=note_data.note_content)
+        .returning(*UserNote.__table__.c)
+        .cte("updated")
+    )
+    note = db.execute(_select_notes(updated)).mappings().first()
     
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    # Update note content
-    note.note_content = note_data.note_content
     db.commit()
-    db.refresh(note)
     
-    # Get course and lesson info
-    course = db.query(Course).filter(Course.id == note.course_id).first()
-    lesson = db.query(Module).filter(Module.id == note.lesson_id).first()
+    return NoteResponse(**note)
+
+@router.patch("/notes/{note_id}", response_model=NotePatchResponse)
+async def patch_note(
+    note_id: int,
+    patch: NotePatchRequest,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Autosave a note by applying text edits against the version the client last saw"""
+    if not patch.ops or len(patch.ops) > MAX_NOTE_PATCH_OPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Provide between 1 and {MAX_NOTE_PATCH_OPS} ops"
+        )
     
-    return NoteResponse(
-        id=note.id,
-        user_id=note.user_id,
-        course_id=note.course_id,
-        lesson_id=note.lesson_id,
-        note_content=note.note_content,
-        created_at=note.created_at,
-        updated_at=note.updated_at,
-        course_title=course.title if course else "Unknown Course",
-        lesson_title=lesson.title if lesson else "Unknown Lesson"
-    )
+    # Fold the ops into nested overlay() calls so Postgres splices the stored
+    # text in place, and work out how long the text must be for every op to fit
+    content = UserNote.note_content
+    min_length = 0
+    shift = 0
+    for op in patch.ops:
+        if op.position < 0 or op.delete < 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="position and delete must not be negative"
+            )
+        min_length = max(min_length, op.position + op.delete - shift)
+        content = func.overlay(content, op.insert, op.position + 1, op.delete)
+        shift += len(op.insert) - op.delete
+    
+    # Only applies if nobody has saved since the client's version
+    saved = db.execute(
+        update(UserNote)
+        .where(
+            UserNote.id == note_id,
+            UserNote.user_id == current_user.id,
+            UserNote.version == patch.version,
+            func.char_length(UserNote.note_content) >= min_length
+        )
+        .values(note_content=content)
+        .returning(UserNote.id, UserNote.version, UserNote.updated_at),
+        execution_options={"synchronize_session": False}
+    ).first()
+    
+    if not saved:
+        current = db.execute(
+            select(UserNote.version).where(
+                UserNote.id == note_id,
+                UserNote.user_id == current_user.id
+            )
+        ).first()
+        db.rollback()
+        if not current:
+            raise HTTPException(status_code=404, detail="Note not found")
+        if current.version != patch.version:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Note has changed since version {patch.version}",
+                headers={"ETag": _note_etag(note_id, current.version)}
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Patch does not fit the note content"
+        )
+    
+    db.commit()
+    
+    response.headers["ETag"] = _note_etag(saved.id, saved.version)
+    return NotePatchResponse(id=saved.id, version=saved.version, updated_at=saved.updated_at)
 
 @router.delete("/notes/{note_id}")
 async def delete_note(
@@ -168,6 +287,8 @@ async def delete_note(
         raise HTTPException(status_code=404, detail="Note not found")
     
     db.delete(note)
+    record_tombstones(db, "note", current_user.id, [note.id])
+    bump_user_stats(db, current_user.id, notes=-1)
     db.commit()
     
     return {"message": "Note deleted successfully"}
@@ -0,0 +1,565 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select, update, delete, func, case, values, column, tuple_, literal_column, Integer, Text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Optional
+from datetime import datetime
+
+from app.database import get_db
+from app.models import (
+    User, Course, Module, StudentTeacherAccess, UserCourseProgress,
+    UserModuleProgress, UserFavorite, UserNote, SyncTombstone
+)
+from app.schemas import (
+    SyncEventsRequest, SyncEventsResponse, SyncEventResult,
+    SyncCourseProgressState, SyncModuleProgressState,
+    SyncChangesResponse, SyncCourseChange, SyncModuleChange,
+    SyncFavoriteChange, SyncNoteChange, SyncDeletion
+)
+from app.auth import get_current_user
+from app.changes import record_tombstones
+from app.stats import bump_user_stats, COMPLETED_PERCENTAGE
+from app.favorite_cache import favorite_cache
+from app.analytics import record_course_progress, record_module_progress
+from app.utils.helpers import encode_cursor, decode_cursor
+
+router = APIRouter()
+
+# Upper bound on a single offline batch; clients split larger queues
+MAX_SYNC_EVENTS = 500
+
+# Upper bound on changed rows returned by one /changes page
+MAX_SYNC_CHANGES = 1000
+
+# Oldest transaction still running; every transaction below it has finished
+SYNC_HORIZON = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+MODULE_STATUSES = ("not_started", "in_progress", "completed")
+
+def get_course_access(db: Session, user: User, course_ids: Iterable[int]) -> Dict[int, bool]:
+    """Map each existing course ID to whether the user may write to it.
+
+    Courses that do not exist are left out of the result. Students need an
+    active StudentTeacherAccess record for the course creator; everyone else
+    keeps the same unrestricted access as the single-item endpoints.
+    """
+    course_ids = set(course_ids)
+    if not course_ids:
+        return {}
+
+    owners = db.execute(
+        select(Course.id, Course.created_by).where(Course.id.in_(course_ids))
+    ).all()
+
+    if not user.has_role("student"):
+        return {course_id: True for course_id, _ in owners}
+
+    teacher_ids = {owner for _, owner in owners}
+    allowed_teachers = set(db.scalars(
+        select(StudentTeacherAccess.teacher_id).where(
+            StudentTeacherAccess.student_id == user.id,
+            StudentTeacherAccess.teacher_id.in_(teacher_ids),
+            StudentTeacherAccess.is_active == True
+        )
+    ).all())
+
+    return {course_id: owner in allowed_teachers for course_id, owner in owners}
+
+@router.post("/events", response_model=SyncEventsResponse)
+async def apply_sync_events(
+    payload: SyncEventsRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply an ordered batch of offline events in a single transaction.
+
+    Events are validated in order and coalesced so that the last event for a
+    course, lesson or note wins; the result is written with one bulk
+    statement per kind. Favourite events carry the desired state rather than
+    a toggle so replaying a batch is idempotent. Note updates and deletes
+    must reference notes that already exist on the server.
+    """
+    events = payload.events
+    if len(events) > MAX_SYNC_EVENTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_SYNC_EVENTS} events can be synced at once"
+        )
+
+    # Resolve every referenced lesson and note with one query each
+    module_ids = set()
+    note_ids = set()
+    for event in events:
+        for module_id in (event.module_id, event.lesson_id, event.last_visited_module_id):
+            if module_id is not None:
+                module_ids.add(module_id)
+        if event.note_id is not None:
+            note_ids.add(event.note_id)
+
+    module_courses = dict(db.execute(
+        select(Module.id, Module.course_id).where(Module.id.in_(module_ids))
+    ).all()) if module_ids else {}
+
+    owned_notes = set(db.scalars(
+        select(UserNote.id).where(
+            UserNote.id.in_(note_ids),
+            UserNote.user_id == current_user.id
+        )
+    ).all()) if note_ids else set()
+
+    # Check access once per course touched by the batch
+    course_ids = {event.course_id for event in events if event.course_id is not None}
+    course_ids.update(module_courses.values())
+    course_access = get_course_access(db, current_user, course_ids)
+
+    def check_course(course_id):
+        if course_id not in course_access:
+            return "Course not found"
+        if not course_access[course_id]:
+            return "You don't have access to this course"
+        return None
+
+    def check_lesson(lesson_id, course_id=None):
+        lesson_course = module_courses.get(lesson_id)
+        if lesson_course is None or (course_id is not None and lesson_course != course_id):
+            return "Lesson not found"
+        return check_course(lesson_course)
+
+    # Stage events in order; later events for the same key replace earlier ones
+    results = []
+    progress_rows = {}
+    module_rows = {}
+    favorite_state = {}
+    note_creates = []
+    note_updates = {}
+    note_deletes = set()
+
+    for event in events:
+        error = None
+
+        if event.type == "progress":
+            if event.course_id is None or event.progress_percentage is None:
+                error = "course_id and progress_percentage are required"
+            elif not 0 <= event.progress_percentage <= 100:
+                error = "progress_percentage must be between 0 and 100"
+            else:
+                error = check_course(event.course_id)
+                if not error and event.last_visited_module_id is not None:
+                    error = check_lesson(event.last_visited_module_id, event.course_id)
+            if not error:
+                previous = progress_rows.get(event.course_id, {})
+                progress_rows[event.course_id] = {
+                    "progress_percentage": event.progress_percentage,
+                    "last_visited_module_id": event.last_visited_module_id or previous.get("last_visited_module_id")
+                }
+
+        elif event.type == "module_progress":
+            if event.module_id is None or event.status not in MODULE_STATUSES:
+                error = "module_id and a valid status are required"
+            else:
+                error = check_lesson(event.module_id)
+            if not error:
+                module_rows[event.module_id] = {
+                    "course_id": module_courses[event.module_id],
+                    "status": event.status
+                }
+
+        elif event.type == "favorite":
+            if event.lesson_id is None or event.is_favorite is None:
+                error = "lesson_id and is_favorite are required"
+            else:
+                error = check_lesson(event.lesson_id)
+            if not error:
+                favorite_state[event.lesson_id] = event.is_favorite
+
+        elif event.type == "note_create":
+            if event.course_id is None or event.lesson_id is None or event.note_content is None:
+                error = "course_id, lesson_id and note_content are required"
+            else:
+                error = check_lesson(event.lesson_id, event.course_id)
+            if not error:
+                note_creates.append((len(results), {
+                    "user_id": current_user.id,
+                    "course_id": event.course_id,
+                    "lesson_id": event.lesson_id,
+                    "note_content": event.note_content
+                }))
+
+        elif event.type == "note_update":
+            if event.note_id not in owned_notes or event.note_id in note_deletes:
+                error = "Note not found"
+            elif event.note_content is None:
+                error = "note_content is required"
+            else:
+                note_updates[event.note_id] = event.note_content
+
+        elif event.type == "note_delete":
+            if event.note_id not in owned_notes or event.note_id in note_deletes:
+                error = "Note not found"
+            else:
+                note_deletes.add(event.note_id)
+                note_updates.pop(event.note_id, None)
+
+        else:
+            error = f"Unknown event type '{event.type}'"
+
+        results.append(SyncEventResult(
+            client_event_id=event.client_event_id,
+            status="rejected" if error else "applied",
+            error=error
+        ))
+
+    # Apply everything with one statement per kind, then commit once
+    stat_deltas = {"completed_courses": 0, "favorites": 0, "notes": 0}
+
+    if progress_rows:
+        previous_percentages = dict(db.execute(
+            select(UserCourseProgress.course_id, UserCourseProgress.progress_percentage).where(
+                UserCourseProgress.user_id == current_user.id,
+                UserCourseProgress.course_id.in_(progress_rows)
+            )
+        ).all())
+        previously_completed = {
+            course_id for course_id, percentage in previous_percentages.items()
+            if percentage is not None and percentage >= COMPLETED_PERCENTAGE
+        }
+        now_completed = {
+            course_id for course_id, row in progress_rows.items()
+            if row["progress_percentage"] >= COMPLETED_PERCENTAGE
+        }
+        stat_deltas["completed_courses"] = len(now_completed - previously_completed) - len(previously_completed - now_completed)
+
+        stmt = insert(UserCourseProgress).values([
+            {
+                "user_id": current_user.id,
+                "course_id": course_id,
+                "completed_at": func.now() if course_id in now_completed else None,
+                **row
+            }
+            for course_id, row in progress_rows.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_user_course_progress_user_course",
+            set_={
+                "progress_percentage": stmt.excluded.progress_percentage,
+                "last_visited_module_id": func.coalesce(
+                    stmt.excluded.last_visited_module_id,
+                    UserCourseProgress.last_visited_module_id
+                ),
+                "last_visited_at": func.now(),
+                "completed_at": case(
+                    (stmt.excluded.progress_percentage >= COMPLETED_PERCENTAGE,
+                     func.coalesce(UserCourseProgress.completed_at, stmt.excluded.completed_at)),
+                    else_=None
+                )
+            }
+        )
+        db.execute(stmt)
+        record_course_progress(db, {
+            course_id: (previous_percentages.get(course_id), row["progress_percentage"])
+            for course_id, row in progress_rows.items()
+        })
+
+    if module_rows:
+        previous_statuses = dict(db.execute(
+            select(UserModuleProgress.module_id, UserModuleProgress.status).where(
+                UserModuleProgress.user_id == current_user.id,
+                UserModuleProgress.module_id.in_(module_rows)
+            )
+        ).all())
+
+        stmt = insert(UserModuleProgress).values([
+            {
+                "user_id": current_user.id,
+                "module_id": module_id,
+                "course_id": row["course_id"],
+                "status": row["status"],
+                "completed_at": func.now() if row["status"] == "completed" else None
+            }
+            for module_id, row in module_rows.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_user_module_progress_user_module",
+            set_={
+                "status": stmt.excluded.status,
+                "completed_at": case(
+                    (stmt.excluded.status == "completed",
+                     func.coalesce(UserModuleProgress.completed_at, stmt.excluded.completed_at)),
+                    else_=None
+                )
+            }
+        )
+        db.execute(stmt)
+        record_module_progress(db, {
+            module_id: (previous_statuses.get(module_id), row["status"])
+            for module_id, row in module_rows.items()
+        })
+
+    favorites_added = [lesson_id for lesson_id, wanted in favorite_state.items() if wanted]
+    favorites_removed = [lesson_id for lesson_id, wanted in favorite_state.items() if not wanted]
+
+    if favorites_added:
+        inserted = db.scalars(
+            insert(UserFavorite).values([
+                {"user_id": current_user.id, "lesson_id": lesson_id}
+                for lesson_id in favorites_added
+            ]).on_conflict_do_nothing(constraint="uq_user_favorites_user_lesson")
+            .returning(UserFavorite.id)
+        ).all()
+        stat_deltas["favorites"] += len(inserted)
+
+    if favorites_removed:
+        removed_lesson_ids = db.scalars(
+            delete(UserFavorite).where(
+                UserFavorite.user_id == current_user.id,
+                UserFavorite.lesson_id.in_(favorites_removed)
+            ).returning(UserFavorite.lesson_id),
+            execution_options={"synchronize_session": False}
+        ).all()
+        record_tombstones(db, "favorite", current_user.id, removed_lesson_ids)
+        stat_deltas["favorites"] -= len(removed_lesson_ids)
+
+    if note_creates:
+        created_ids = db.scalars(
+            insert(UserNote).returning(UserNote.id, sort_by_parameter_order=True),
+            [row for _, row in note_creates]
+        ).all()
+        for (index, _), note_id in zip(note_creates, created_ids):
+            results[index].note_id = note_id
+        stat_deltas["notes"] += len(created_ids)
+
+    if note_updates:
+        patch = values(
+            column("id", Integer), column("note_content", Text), name="note_patch"
+        ).data(list(note_updates.items()))
+        db.execute(
+            update(UserNote)
+            .where(UserNote.id == patch.c.id, UserNote.user_id == current_user.id)
+            .values(note_content=patch.c.note_content),
+            execution_options={"synchronize_session": False}
+        )
+
+    if note_deletes:
+        deleted_note_ids = db.scalars(
+            delete(UserNote).where(
+                UserNote.id.in_(note_deletes),
+                UserNote.user_id == current_user.id
+            ).returning(UserNote.id),
+            execution_options={"synchronize_session": False}
+        ).all()
+        record_tombstones(db, "note", current_user.id, deleted_note_ids)
+        stat_deltas["notes"] -= len(deleted_note_ids)
+
+    bump_user_stats(db, current_user.id, **stat_deltas)
+    db.commit()
+
+    if favorites_added:
+        favorite_cache.add(current_user.id, favorites_added)
+    if favorites_removed:
+        favorite_cache.remove(current_user.id, favorites_removed)
+
+    # Return the resulting server state so the client can reconcile in one trip
+    course_progress = db.execute(
+        select(
+            UserCourseProgress.course_id,
+            UserCourseProgress.progress_percentage,
+            UserCourseProgress.last_visited_module_id,
+            UserCourseProgress.completed_at
+        ).where(
+            UserCourseProgress.user_id == current_user.id,
+            UserCourseProgress.course_id.in_(progress_rows)
+        )
+    ).all() if progress_rows else []
+
+    module_progress = db.execute(
+        select(
+            UserModuleProgress.course_id,
+            UserModuleProgress.module_id,
+            UserModuleProgress.status,
+            UserModuleProgress.completed_at
+        ).where(
+            UserModuleProgress.user_id == current_user.id,
+            UserModuleProgress.module_id.in_(module_rows)
+        )
+    ).all() if module_rows else []
+
+    favorite_lesson_ids = db.scalars(
+        select(UserFavorite.lesson_id)
+        .where(UserFavorite.user_id == current_user.id)
+        .order_by(UserFavorite.lesson_id)
+    ).all()
+
+    return SyncEventsResponse(
+        results=results,
+        course_progress=[SyncCourseProgressState(**row._mapping) for row in course_progress],
+        module_progress=[SyncModuleProgressState(**row._mapping) for row in module_progress],
+        favorite_lesson_ids=favorite_lesson_ids,
+        server_time=datetime.utcnow()
+    )
+
+@router.get("/changes", response_model=SyncChangesResponse)
+async def get_changes(
+    since: Optional[str] = None,
+    limit: int = 200,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get courses, modules, favourites and notes changed since a cursor.
+
+    Every tracked row carries the id of the transaction that last wrote it
+    and a change_seq from one shared sequence, and changes are handed out in
+    (transaction id, change_seq) order. A sequence value is drawn when the
+    row is written, not when it commits, so rows only become eligible once
+    their transaction is older than the oldest one still running. Everything
+    below that horizon has committed or rolled back, and anything committed
+    later has a larger transaction id, so no change can land behind a cursor
+    that was already handed out. A long-running write transaction therefore
+    holds back newer changes until it finishes.
+
+    A page holds up to ``limit`` rows, lowest key first. When a student
+    gains access to a teacher after the cursor, that teacher's courses and
+    modules are sent in full at the access change, and when access is
+    revoked they are reported as deleted courses. These rows count against
+    the page; a teacher's catalog is never split across pages, so a page
+    that starts with one may exceed ``limit``.
+    """
+    limit = max(1, min(limit, MAX_SYNC_CHANGES))
+    # Cursors are (transaction id, change_seq), plus a flag while the first
+    # sync is still being paged: it already includes every visible course
+    since_key = (0, 0)
+    first_sync = True
+    if since:
+        decoded = decode_cursor(since)
+        if (
+            not decoded or len(decoded) not in (2, 3)
+            or not all(isinstance(value, int) for value in decoded)
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid sync cursor"
+            )
+        since_key = tuple(decoded[:2])
+        first_sync = len(decoded) == 3
+
+    horizon = db.scalar(select(SYNC_HORIZON))
+
+    def changed(model, query):
+        # The limit + 1 lowest committed changes of one entity after the cursor
+        return db.scalars(
+            query.where(
+                tuple_(model.change_xid, model.change_seq) > tuple_(*since_key),
+                model.change_xid < horizon
+            )
+            .order_by(model.change_xid, model.change_seq)
+            .limit(limit + 1)
+        ).all()
+
+    # Work out whose courses the caller can see; None means every course
+    changes = []
+    visible_owners = None
+    if current_user.has_role("admin"):
+        pass
+    elif current_user.has_role("teacher"):
+        visible_owners = {current_user.id}
+    else:
+        visible_owners = set(db.scalars(
+            select(StudentTeacherAccess.teacher_id).where(
+                StudentTeacherAccess.student_id == current_user.id,
+                StudentTeacherAccess.is_active == True
+            )
+        ).all())
+        changes += [("access", row) for row in changed(
+            StudentTeacherAccess,
+            select(StudentTeacherAccess).where(StudentTeacherAccess.student_id == current_user.id)
+        )]
+
+    if visible_owners is None or visible_owners:
+        course_query = select(Course)
+        module_query = select(Module)
+        if visible_owners is not None:
+            course_query = course_query.where(Course.created_by.in_(visible_owners))
+            module_query = module_query.join(Course, Course.id == Module.course_id).where(
+                Course.created_by.in_(visible_owners)
+            )
+        changes += [("course", row) for row in changed(Course, course_query)]
+        changes += [("module", row) for row in changed(Module, module_query)]
+
+    for kind, model in (("favorite", UserFavorite), ("note", UserNote), ("deleted", SyncTombstone)):
+        changes += [(kind, row) for row in changed(model, select(model).where(model.user_id == current_user.id))]
+
+    # Each entity returned its limit + 1 lowest keys, so the lowest ``limit``
+    # rows overall are all here; anything left over means there is more
+    changes.sort(key=lambda change: (change[1].change_xid, change[1].change_seq))
+    response = SyncChangesResponse(next_cursor="")
+    cursor = since_key
+    size = 0
+    for kind, row in changes:
+        if size >= limit:
+            response.has_more = True
+            break
+        if kind == "access":
+            courses, modules, revoked = [], [], []
+            if not first_sync:
+                courses, modules, revoked = access_changes(db, row, visible_owners, since_key)
+            rows = max(1, len(courses) + len(modules) + len(revoked))
+            if size and size + rows > limit:
+                response.has_more = True
+                break
+            response.courses += courses
+            response.modules += modules
+            response.deleted += revoked
+            size += rows
+        else:
+            if kind == "course":
+                response.courses.append(SyncCourseChange.model_validate(row, from_attributes=True))
+            elif kind == "module":
+                response.modules.append(SyncModuleChange.model_validate(row, from_attributes=True))
+            elif kind == "favorite":
+                response.favorites.append(SyncFavoriteChange.model_validate(row, from_attributes=True))
+            elif kind == "note":
+                response.notes.append(SyncNoteChange.model_validate(row, from_attributes=True))
+            else:
+                response.deleted.append(SyncDeletion(entity=row.entity, id=row.entity_id))
+            size += 1
+        cursor = (row.change_xid, row.change_seq)
+
+    if first_sync and response.has_more:
+        response.next_cursor = encode_cursor(*cursor, 1)
+    else:
+        response.next_cursor = encode_cursor(*cursor)
+    return response
+
+def access_changes(db: Session, access: StudentTeacherAccess, visible_owners: set, since_key: tuple):
+    """What a change in the student's access to a teacher means for them.
+
+    A newly visible teacher's courses and modules up to the cursor are sent
+    in full (later changes to them follow in the change stream anyway); a
+    revoked teacher's courses are reported as deleted.
+    """
+    if access.teacher_id not in visible_owners:
+        return [], [], [
+            SyncDeletion(entity="course", id=course_id)
+            for course_id in db.scalars(select(Course.id).where(Course.created_by == access.teacher_id)).all()
+        ]
+
+    courses = [
+        SyncCourseChange.model_validate(course, from_attributes=True)
+        for course in db.scalars(
+            select(Course).where(
+                Course.created_by == access.teacher_id,
+                tuple_(Course.change_xid, Course.change_seq) <= tuple_(*since_key)
+            )
+        ).all()
+    ]
+    modules = [
+        SyncModuleChange.model_validate(module, from_attributes=True)
+        for module in db.scalars(
+            select(Module)
+            .join(Course, Course.id == Module.course_id)
+            .where(
+                Course.created_by == access.teacher_id,
+                tuple_(Module.change_xid, Module.change_seq) <= tuple_(*since_key)
+            )
+        ).all()
+    ]
+    return courses, modules, []
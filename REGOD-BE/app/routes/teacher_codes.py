@@ -13,6 +13,8 @@ from app.schemas import (
 )
 from app.auth import get_current_user
 from app.rbac import require_permission, require_role
+from app.analytics import record_enrollment
+from app.responses import trusted_response
 
 router = APIRouter()
 
@@ -84,21 +86,20 @@ async def get_teacher_codes(
         TeacherCode.teacher_id == current_user.id
     ).all()
     
-    response = []
-    for code in teacher_codes:
-        response.append(TeacherCodeResponse(
-            id=code.id,
-            code=code.code,
-            teacher_id=code.teacher_id,
-            teacher_name=current_user.name,
-            created_at=code.created_at,
-            max_uses=code.max_uses,
-            expires_at=code.expires_at,
-            use_count=code.use_count,
-            is_active=code.is_active
-        ))
-    
-    return response
+    return trusted_response(TeacherCodeResponse, (
+        {
+            "id": code.id,
+            "code": code.code,
+            "teacher_id": code.teacher_id,
+            "teacher_name": current_user.name,
+            "created_at": code.created_at,
+            "max_uses": code.max_uses,
+            "expires_at": code.expires_at,
+            "use_count": code.use_count,
+            "is_active": code.is_active
+        }
+        for code in teacher_codes
+    ))
 
 @router.post("/use-teacher-code", response_model=TeacherCodeUseResponse)
 async def use_teacher_code(
@@ -186,6 +187,9 @@ async def use_teacher_code(
     # Update teacher code use count
     teacher_code.use_count += 1
     
+    # New student counts towards every course of this teacher
+    record_enrollment(db, teacher_code.teacher_id, 1)
+    
     db.commit()
     
     # Get teacher name
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from datetime import datetime
+from uuid import UUID
 
 # Auth Schemas
 class UserBase(BaseModel):
@@ -107,12 +108,12 @@ class TeacherCodeBase(BaseModel):
     expires_at: Optional[datetime] = None
 
 class TeacherCodeCreate(TeacherCodeBase):
-    teacher_id: int
+    teacher_id: UUID
 
 class TeacherCodeResponse(TeacherCodeBase):
     id: int
     code: str
-    teacher_id: int
+    teacher_id: UUID
     teacher_name: str
     created_at: datetime
     use_count: int
@@ -169,6 +170,33 @@ class ModuleResponse(ModuleBase):
     class Config:
         from_attributes = True
 
+class CourseModuleResponse(ModuleResponse):
+    is_favorite: bool = False
+
+class ModuleMove(BaseModel):
+    module_id: int
+    position: int  # 1-based position among the course's active modules
+
+class ModuleReorderRequest(BaseModel):
+    module_ids: Optional[List[int]] = None  # full ordering of active modules
+    moves: Optional[List[ModuleMove]] = None  # applied in sequence
+
+class ModuleBulkUpdate(BaseModel):
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    order: Optional[int] = None
+    is_active: Optional[bool] = None
+
+class ModuleBulkUpdateRequest(BaseModel):
+    modules: List[ModuleBulkUpdate]
+
+class CourseModulesResponse(BaseModel):
+    course_id: int
+    version: int
+    total_modules: int
+    modules: List[ModuleResponse]
+
 class UserCourseProgressBase(BaseModel):
     course_id: int
     last_visited_module_id: Optional[int] = None
@@ -198,7 +226,7 @@ class FavoriteBase(BaseModel):
 
 class FavoriteResponse(FavoriteBase):
     id: int
-    user_id: int
+    user_id: UUID
     created_at: datetime
     lesson_title: str
     course_title: str
@@ -207,6 +235,11 @@ class FavoriteResponse(FavoriteBase):
     class Config:
         from_attributes = True
 
+class FavoritesPageResponse(BaseModel):
+    items: List[FavoriteResponse] = []
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
 # Chat Schemas
 class MessageBase(BaseModel):
     content: str
@@ -215,7 +248,7 @@ class MessageBase(BaseModel):
 class MessageResponse(MessageBase):
     id: int
     thread_id: int
-    sender_id: int
+    sender_id: UUID
     sender_name: str
     sender_type: str
     timestamp: datetime
@@ -224,6 +257,52 @@ class MessageResponse(MessageBase):
     class Config:
         from_attributes = True
 
+class ThreadReadRequest(BaseModel):
+    message_id: int  # newest message the client has shown
+
+class ThreadReadResponse(BaseModel):
+    thread_id: int
+    last_read_message_id: Optional[int] = None
+    newly_read: int = 0
+
+class ThreadUnreadResponse(BaseModel):
+    thread_id: int
+    unread_count: int
+
+class UnreadCountsResponse(BaseModel):
+    total: int = 0
+    threads: List[ThreadUnreadResponse] = []
+
+class ThreadPresenceResponse(BaseModel):
+    thread_id: int
+    user_id: str  # the other participant
+    is_online: bool = False
+
+class PresenceResponse(BaseModel):
+    threads: List[ThreadPresenceResponse] = []
+
+class InboxThreadResponse(BaseModel):
+    thread_id: int
+    student_id: str
+    student_name: str
+    student_avatar: Optional[str] = None
+    last_message_id: Optional[int] = None
+    last_message: Optional[str] = None
+    last_message_sender_id: Optional[str] = None
+    last_message_at: datetime  # creation time for threads without messages
+    unread_count: int = 0
+    is_online: bool = False
+
+class InboxPageResponse(BaseModel):
+    items: List[InboxThreadResponse] = []  # most recent activity first
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+class MessagesPageResponse(BaseModel):
+    items: List[MessageResponse] = []  # oldest first
+    next_cursor: Optional[str] = None  # fetches the page of older messages
+    has_more: bool = False
+
 class ThreadResponse(BaseModel):
     id: int
     user_id: int
@@ -245,7 +324,8 @@ class NoteBase(BaseModel):
 
 class NoteResponse(NoteBase):
     id: int
-    user_id: int
+    user_id: UUID
+    version: int = 1
     created_at: datetime
     updated_at: datetime
     course_title: str
@@ -254,6 +334,147 @@ class NoteResponse(NoteBase):
     class Config:
         from_attributes = True
 
+class NotePatchOp(BaseModel):
+    position: int  # 0-based character offset into the text left by the previous ops
+    delete: int = 0  # characters removed at position
+    insert: str = ""  # text inserted at position
+
+class NotePatchRequest(BaseModel):
+    version: int  # note version the ops were made against
+    ops: List[NotePatchOp]  # applied in sequence
+
+class NotePatchResponse(BaseModel):
+    id: int
+    version: int
+    updated_at: datetime
+
+class NotesPageResponse(BaseModel):
+    items: List[NoteResponse] = []
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
 class ShareCourseResponse(BaseModel):
     shareable_link: str
-    message: str = "Course shared successfully."
\ No newline at end of file
+    message: str = "Course shared successfully."
+
+# Sync Schemas
+class SyncEvent(BaseModel):
+    client_event_id: str
+    type: str  # progress, module_progress, favorite, note_create, note_update, note_delete
+    course_id: Optional[int] = None
+    module_id: Optional[int] = None
+    lesson_id: Optional[int] = None
+    note_id: Optional[int] = None
+    progress_percentage: Optional[float] = None
+    last_visited_module_id: Optional[int] = None
+    status: Optional[str] = None  # module status: not_started, in_progress, completed
+    is_favorite: Optional[bool] = None
+    note_content: Optional[str] = None
+
+class SyncEventsRequest(BaseModel):
+    events: List[SyncEvent]
+
+class SyncEventResult(BaseModel):
+    client_event_id: str
+    status: str  # applied or rejected
+    error: Optional[str] = None
+    note_id: Optional[int] = None
+
+class SyncCourseProgressState(BaseModel):
+    course_id: int
+    progress_percentage: float
+    last_visited_module_id: Optional[int] = None
+    completed_at: Optional[datetime] = None
+
+class SyncModuleProgressState(BaseModel):
+    course_id: int
+    module_id: int
+    status: str
+    completed_at: Optional[datetime] = None
+
+class SyncEventsResponse(BaseModel):
+    results: List[SyncEventResult]
+    course_progress: List[SyncCourseProgressState] = []
+    module_progress: List[SyncModuleProgressState] = []
+    favorite_lesson_ids: List[int] = []
+    server_time: datetime
+
+class SyncCourseChange(BaseModel):
+    id: int
+    title: str
+    description: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    category: Optional[str] = None
+    difficulty: Optional[str] = None
+    total_modules: Optional[int] = None
+    is_active: Optional[bool] = None
+    version: int
+    updated_at: Optional[datetime] = None
+
+class SyncModuleChange(BaseModel):
+    id: int
+    course_id: int
+    title: str
+    description: Optional[str] = None
+    order: Optional[int] = None
+    is_active: Optional[bool] = None
+    updated_at: Optional[datetime] = None
+
+class SyncFavoriteChange(BaseModel):
+    id: int
+    lesson_id: int
+    created_at: datetime
+
+class SyncNoteChange(BaseModel):
+    id: int
+    course_id: int
+    lesson_id: int
+    note_content: str
+    version: int = 1
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+class SyncDeletion(BaseModel):
+    entity: str  # course, favorite, note
+    id: int
+
+class SyncChangesResponse(BaseModel):
+    courses: List[SyncCourseChange] = []
+    modules: List[SyncModuleChange] = []
+    favorites: List[SyncFavoriteChange] = []
+    notes: List[SyncNoteChange] = []
+    deleted: List[SyncDeletion] = []
+    next_cursor: str
+    has_more: bool = False
+
+# Stats Schemas
+class UserStatsResponse(BaseModel):
+    completed_courses: int = 0
+    favorites: int = 0
+    notes: int = 0
+    unread_messages: int = 0
+    
+    class Config:
+        from_attributes = True
+
+# Analytics Schemas
+class ModuleAnalyticsResponse(BaseModel):
+    module_id: int
+    title: str
+    order: Optional[int] = None
+    started: int = 0
+    completed: int = 0
+
+class CourseAnalyticsResponse(BaseModel):
+    course_id: int
+    title: str
+    enrolled: int = 0
+    started: int = 0
+    completed: int = 0
+    average_progress: float = 0.0
+    completion_rate: float = 0.0
+    modules: List[ModuleAnalyticsResponse] = []
+    updated_at: Optional[datetime] = None
+
+class TeacherAnalyticsResponse(BaseModel):
+    courses: List[CourseAnalyticsResponse] = []
@@ -0,0 +1,146 @@
+from sqlalchemy import select, update, func, and_, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from typing import Iterable, List, Optional
+
+from app.models import (
+    User, UserStats, UserCourseProgress, UserFavorite, UserNote,
+    ChatThread, ChatMessage, ChatThreadParticipant
+)
+
+# A course counts as completed once progress reaches this percentage
+COMPLETED_PERCENTAGE = 100
+
+STAT_FIELDS = ("completed_courses", "favorites", "notes", "unread_messages")
+
+
+def create_user_stats(db: Session, user_id):
+    """Add a new user's zeroed counters row, in the same transaction as the user.
+
+    Every user has a row from the moment they exist, so bump_user_stats
+    always has one to update. Users who predate the counters get theirs
+    from the backfill in app.migrations.
+    """
+    db.execute(insert(UserStats).values(user_id=user_id).on_conflict_do_nothing(index_elements=[UserStats.user_id]))
+
+
+def bump_user_stats(db: Session, user_id, **deltas: int):
+    """Apply counter deltas for a user inside the caller's transaction"""
+    values = {
+        field: func.greatest(getattr(UserStats, field) + delta, 0)
+        for field, delta in deltas.items()
+        if delta
+    }
+    if values:
+        db.execute(
+            update(UserStats).where(UserStats.user_id == user_id).values(**values),
+            execution_options={"synchronize_session": False}
+        )
+
+
+def _computed_stats(user_ids: Optional[Iterable] = None):
+    """SELECT the true counter values for a set of users, or for all of them"""
+    completed = (
+        select(func.count())
+        .where(
+            UserCourseProgress.user_id == User.id,
+            UserCourseProgress.progress_percentage >= COMPLETED_PERCENTAGE
+        )
+        .scalar_subquery()
+    )
+    favorites = select(func.count()).where(UserFavorite.user_id == User.id).scalar_subquery()
+    notes = select(func.count()).where(UserNote.user_id == User.id).scalar_subquery()
+    unread = (
+        select(func.count())
+        .select_from(ChatMessage)
+        .join(ChatThread, ChatThread.id == ChatMessage.thread_id)
+        .outerjoin(
+            ChatThreadParticipant,
+            and_(
+                ChatThreadParticipant.thread_id == ChatThread.id,
+                ChatThreadParticipant.user_id == User.id
+            )
+        )
+        .where(
+            or_(ChatThread.user_id == User.id, ChatThread.assigned_teacher_id == User.id),
+            ChatMessage.sender_id != User.id,
+            ChatMessage.read_status == False,
+            ChatMessage.id > func.coalesce(ChatThreadParticipant.last_read_message_id, 0)
+        )
+        .scalar_subquery()
+    )
+    query = select(
+        User.id.label("user_id"),
+        completed.label("completed_courses"),
+        favorites.label("favorites"),
+        notes.label("notes"),
+        unread.label("unread_messages")
+    )
+    if user_ids is not None:
+        query = query.where(User.id.in_(list(user_ids)))
+    return query
+
+
+def _upsert_computed_stats(db: Session, user_ids: List) -> int:
+    """Write recomputed counters for the given users where missing or drifted; returns rows written"""
+    stmt = insert(UserStats).from_select(
+        ["user_id", *STAT_FIELDS], _computed_stats(user_ids)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={field: getattr(stmt.excluded, field) for field in STAT_FIELDS} | {"updated_at": func.now()},
+        where=or_(*[
+            getattr(UserStats, field) != getattr(stmt.excluded, field)
+            for field in STAT_FIELDS
+        ])
+    )
+    return len(db.execute(stmt.returning(literal_column("1"))).all())
+
+
+def backfill_user_stats(conn: Connection) -> int:
+    """Create computed counters for users that have no row yet and return how many"""
+    missing = _computed_stats().where(
+        ~select(UserStats.user_id).where(UserStats.user_id == User.id).exists()
+    )
+    stmt = insert(UserStats).from_select(["user_id", *STAT_FIELDS], missing).on_conflict_do_nothing(
+        index_elements=[UserStats.user_id]
+    )
+    return conn.execute(stmt).rowcount
+
+
+def get_user_stats(db: Session, user_id) -> UserStats:
+    """Read a user's counters.
+
+    Reads never write: should a user's row be missing, the counters are
+    computed for this read only and repair_user_stats creates the row.
+    """
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        row = db.execute(_computed_stats([user_id])).mappings().first()
+        stats = UserStats(**row) if row else UserStats(user_id=user_id, **{field: 0 for field in STAT_FIELDS})
+    return stats
+
+
+def repair_user_stats(db: Session, batch_size: int = 500) -> int:
+    """Recompute every user's counters in batches, fixing any that drifted.
+
+    Walks users in primary-key order and commits after each batch so the
+    job holds no long transaction. Returns the number of rows corrected
+    or created.
+    """
+    repaired = 0
+    last_id = None
+    while True:
+        query = select(User.id).order_by(User.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(User.id > last_id)
+        user_ids = db.scalars(query).all()
+        if not user_ids:
+            break
+
+        repaired += _upsert_computed_stats(db, user_ids)
+        db.commit()
+        last_id = user_ids[-1]
+
+    return repaired
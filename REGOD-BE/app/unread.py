@@ -0,0 +1,174 @@
+from sqlalchemy import select, update, func, and_, or_, case, exists, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.models import ChatThread, ChatMessage, ChatThreadParticipant
+
+
+def add_participants(db: Session, thread_id: int, user_ids: Iterable):
+    """Create zeroed counters for the participants of a new thread"""
+    rows = [{"thread_id": thread_id, "user_id": user_id} for user_id in user_ids if user_id is not None]
+    if rows:
+        db.execute(insert(ChatThreadParticipant).values(rows).on_conflict_do_nothing())
+
+
+def increment_unread(db: Session, thread_id: int, sender_id):
+    """Count a new message as unread for everyone in the thread except its sender.
+
+    Participants without a counters row are skipped; their row is computed
+    from the messages the first time it is read, so it will include this one.
+    """
+    db.execute(
+        update(ChatThreadParticipant)
+        .where(
+            ChatThreadParticipant.thread_id == thread_id,
+            ChatThreadParticipant.user_id != sender_id
+        )
+        .values(unread_count=ChatThreadParticipant.unread_count + 1),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def touch_thread(db: Session, thread_id: int):
+    """Move the thread's last activity to now, the timestamp of a message inserted in this transaction"""
+    db.execute(
+        update(ChatThread)
+        .where(ChatThread.id == thread_id)
+        .values(last_message_at=func.now()),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def advance_watermark(db: Session, thread_id: int, user_id, message_id: int) -> Optional[Tuple[int, datetime]]:
+    """Mark everything up to ``message_id`` as read with a single row write.
+
+    The watermark only moves forward. The new count comes from the stored
+    counter: zero once nothing newer is left in the thread, otherwise the
+    counter less the other side's messages between the old and new
+    watermark. Both are range scans on (thread_id, id) over the newly read
+    messages only. Returns how many messages became read and when, or None
+    if the watermark was already at or past the message. The caller must
+    have checked that the message belongs to the thread.
+    """
+    # The row is locked as it is read, so the counter cannot move under us
+    before = (
+        select(
+            ChatThreadParticipant.thread_id,
+            ChatThreadParticipant.user_id,
+            ChatThreadParticipant.unread_count,
+            ChatThreadParticipant.last_read_message_id
+        )
+        .where(
+            ChatThreadParticipant.thread_id == thread_id,
+            ChatThreadParticipant.user_id == user_id
+        )
+        .with_for_update()
+        .subquery("before")
+    )
+    newly_read = (
+        select(func.count())
+        .where(
+            ChatMessage.thread_id == thread_id,
+            ChatMessage.sender_id != user_id,
+            ChatMessage.read_status == False,
+            ChatMessage.id > func.coalesce(before.c.last_read_message_id, 0),
+            ChatMessage.id <= message_id
+        )
+        .scalar_subquery()
+    )
+    caught_up = ~exists().where(ChatMessage.thread_id == thread_id, ChatMessage.id > message_id)
+    advance = (
+        update(ChatThreadParticipant)
+        .where(
+            ChatThreadParticipant.thread_id == before.c.thread_id,
+            ChatThreadParticipant.user_id == before.c.user_id,
+            or_(before.c.last_read_message_id.is_(None), before.c.last_read_message_id < message_id)
+        )
+        .values(
+            last_read_message_id=message_id,
+            last_read_at=func.now(),
+            unread_count=case((caught_up, 0), else_=func.greatest(before.c.unread_count - newly_read, 0))
+        )
+        .returning(before.c.unread_count, ChatThreadParticipant.unread_count, ChatThreadParticipant.last_read_at)
+    )
+
+    advanced = db.execute(advance, execution_options={"synchronize_session": False}).first()
+    if advanced is None and db.scalar(
+        select(func.count()).where(
+            ChatThreadParticipant.thread_id == thread_id,
+            ChatThreadParticipant.user_id == user_id
+        )
+    ) == 0:
+        # First read of a thread that predates the counters
+        _initialize_counters(db, user_id, [thread_id])
+        advanced = db.execute(advance, execution_options={"synchronize_session": False}).first()
+    if advanced is None:
+        return None
+
+    unread_before, unread_after, read_at = advanced
+    return max(unread_before - unread_after, 0), read_at
+
+
+def read_watermarks(db: Session, thread_id: int) -> Dict:
+    """Each participant's last read message id in a thread"""
+    return dict(db.execute(
+        select(ChatThreadParticipant.user_id, ChatThreadParticipant.last_read_message_id)
+        .where(ChatThreadParticipant.thread_id == thread_id)
+    ).all())
+
+
+def _initialize_counters(db: Session, user_id, thread_ids: List[int]):
+    """Compute counters from the messages for threads that have no row yet"""
+    unread = (
+        select(func.count())
+        .where(
+            ChatMessage.thread_id == ChatThread.id,
+            ChatMessage.sender_id != user_id,
+            ChatMessage.read_status == False
+        )
+        .scalar_subquery()
+    )
+    db.execute(
+        insert(ChatThreadParticipant)
+        .from_select(
+            ["thread_id", "user_id", "unread_count"],
+            select(ChatThread.id, literal(user_id, ChatThreadParticipant.user_id.type), unread)
+            .where(ChatThread.id.in_(thread_ids))
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+def get_unread_counts(db: Session, user_id, thread_ids: Optional[List[int]] = None) -> Dict[int, int]:
+    """Unread messages per thread for a user, across all of their threads by default.
+
+    Threads that predate the counters are initialized on first read.
+    """
+    query = (
+        select(ChatThread.id, ChatThreadParticipant.unread_count)
+        .outerjoin(
+            ChatThreadParticipant,
+            and_(
+                ChatThreadParticipant.thread_id == ChatThread.id,
+                ChatThreadParticipant.user_id == user_id
+            )
+        )
+        .where(or_(ChatThread.user_id == user_id, ChatThread.assigned_teacher_id == user_id))
+    )
+    if thread_ids is not None:
+        query = query.where(ChatThread.id.in_(thread_ids))
+
+    counts = {row.id: row.unread_count for row in db.execute(query)}
+    missing = [thread_id for thread_id, count in counts.items() if count is None]
+    if missing:
+        _initialize_counters(db, user_id, missing)
+        db.commit()
+        counts.update(db.execute(
+            select(ChatThreadParticipant.thread_id, ChatThreadParticipant.unread_count).where(
+                ChatThreadParticipant.thread_id.in_(missing),
+                ChatThreadParticipant.user_id == user_id
+            )
+        ).all())
+    return counts
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 import json
+import base64
 
 def format_timestamp(dt: datetime) -> str:
     """Format datetime to ISO string"""
@@ -51,4 +52,18 @@ def validate_email(email: str) -> bool:
     """Simple email validation"""
     import re
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email))
\ No newline at end of file
+    return bool(re.match(pattern, email))
+
+def encode_cursor(*values) -> str:
+    """Encode keyset pagination values as an opaque URL-safe cursor"""
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Optional[list]:
+    """Decode a cursor produced by encode_cursor, or None if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
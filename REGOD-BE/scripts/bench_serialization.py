@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark CPU per list response: validated Pydantic + json vs trusted rows + orjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.schemas import FavoriteResponse, NoteResponse, MessageResponse, TeacherCodeResponse
+from app.responses import trusted_response
+
+def make_rows(count):
+    """Synthetic rows shaped like what each list endpoint reads from the database"""
+    now = datetime.utcnow()
+    user_id, other_id = uuid.uuid4(), uuid.uuid4()
+    return {
+        FavoriteResponse: [
+            {
+                "id": i, "user_id": user_id, "lesson_id": i, "created_at": now - timedelta(minutes=i),
+                "lesson_title": f"Lesson {i}", "course_title": "Course title",
+                "thumbnail_url": "https://cdn.example.com/thumb.png"
+            }
+            for i in range(count)
+        ],
+        NoteResponse: [
+            {
+                "id": i, "user_id": user_id, "course_id": 1, "lesson_id": i,
+                "note_content": "A reasonably sized note about the lesson content. " * 4,
+                "created_at": now, "updated_at": now,
+                "course_title": "Course title", "lesson_title": f"Lesson {i}"
+            }
+            for i in range(count)
+        ],
+        MessageResponse: [
+            {
+                "id": i, "thread_id": 1, "sender_id": (user_id, other_id)[i % 2], "sender_name": "Sender",
+                "sender_type": "user", "content": "Hello, this is a chat message.",
+                "message_type": "text", "timestamp": now, "read_status": True
+            }
+            for i in range(count)
+        ],
+        TeacherCodeResponse: [
+            {
+                "id": i, "code": f"CODE{i:04d}", "teacher_id": user_id, "teacher_name": "Teacher",
+                "created_at": now, "max_uses": 10, "expires_at": None,
+                "use_count": 3, "is_active": True
+            }
+            for i in range(count)
+        ],
+    }
+
+def validated_response(loop, field, model, rows):
+    """What the endpoints did before: build models per row, then let FastAPI validate and encode"""
+    content = [model(**row) for row in rows]
+    serialized = loop.run_until_complete(serialize_response(field=field, response_content=content))
+    return JSONResponse(content=serialized)
+
+def cpu_per_call(func, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=500, help="rows per response")
+    parser.add_argument("--iterations", type=int, default=200, help="responses per measurement")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    print(f"{'schema':<22}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for model, rows in make_rows(args.items).items():
+        field = create_response_field(name=f"Response_{model.__name__}", type_=List[model])
+
+        # Both paths must produce the same document
+        before_body = validated_response(loop, field, model, rows).body
+        after_body = trusted_response(model, rows).body
+        assert json.loads(before_body) == json.loads(after_body), model.__name__
+
+        before = cpu_per_call(lambda: validated_response(loop, field, model, rows), args.iterations)
+        after = cpu_per_call(lambda: trusted_response(model, rows), args.iterations)
+        print(f"{model.__name__:<22}{before * 1000:>14.3f}{after * 1000:>14.3f}{before / after:>9.1f}x")
+    loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark memory per WebSocket connection and registry operation costs at 100k+ simulated sockets
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.connections import Connection, ConnectionRegistry, SendMetrics
+from app.pubsub import InMemoryBroker, WebSocketFanout
+
+class FakeSocket:
+    """Stands in for an accepted WebSocket; writes complete immediately"""
+    __slots__ = ("sent",)
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, text):
+        self.sent += 1
+
+    async def close(self, code=1000):
+        pass
+
+def make_population(count, threads_per_user, second_device_share):
+    """(user id, role, threads) per socket; some users have a second device"""
+    population = []
+    user = 0
+    while len(population) < count:
+        user_id = f"{user:08x}-0000-4000-8000-000000000000"
+        role = "teacher" if user % 50 == 0 else "student"
+        threads = {str(user * threads_per_user + t): f"peer-{user}-{t}" for t in range(threads_per_user)}
+        devices = 2 if random.random() < second_device_share else 1
+        for _ in range(min(devices, count - len(population))):
+            population.append((user_id, role, threads))
+        user += 1
+    return population
+
+def measure(label, count, build):
+    """Allocated bytes per connection for whatever ``build`` keeps alive"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    kept = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{label:<42} {allocated / count:>8.0f} B/conn   {elapsed / count * 1e6:>6.2f} µs/register")
+    return kept
+
+async def bench(args):
+    random.seed(1)
+    population = make_population(args.connections, args.threads, args.second_device_share)
+    sockets = [FakeSocket() for _ in population]
+    print(f"{len(population)} sockets, {len({p[0] for p in population})} users, {args.threads} threads each\n")
+
+    # Before: a queue and a parked writer task for every socket
+    async def drain(queue):
+        while True:
+            await queue.get()
+
+    def legacy():
+        by_user, tasks = {}, []
+        for (user_id, role, threads), socket in zip(population, sockets):
+            queue = asyncio.Queue(maxsize=256)
+            tasks.append(asyncio.get_running_loop().create_task(drain(queue)))
+            by_user.setdefault(user_id, set()).add((socket, queue))
+        return by_user, tasks
+
+    by_user, tasks = measure("queue + writer task per socket", len(population), legacy)
+    await asyncio.sleep(0)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    del by_user, tasks
+
+    # After: lazy Connection records in the sharded registry
+    metrics = SendMetrics()
+
+    def compact():
+        registry = ConnectionRegistry()
+        for (user_id, role, threads), socket in zip(population, sockets):
+            registry.add(Connection(user_id, socket, metrics, role=role, threads=dict(threads)))
+        return registry
+
+    registry = measure("ConnectionRegistry (records + indexes)", len(population), compact)
+    del registry
+
+    # The same through the fanout, including the per-user broker subscription
+    fanout = WebSocketFanout(InMemoryBroker())
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    for (user_id, role, threads), socket in zip(population, sockets):
+        await fanout.connect(user_id, socket, role=role, threads=threads)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    print(f"{'WebSocketFanout.connect (with subscription)':<42} {allocated / len(population):>8.0f} B/conn   "
+          f"{elapsed / len(population) * 1e6:>6.2f} µs/register\n")
+
+    registry = fanout.registry
+    user_ids = [p[0] for p in population]
+    thread_ids = [next(iter(p[2])) for p in population]
+    lookups = min(args.lookups, len(population))
+
+    def timed(label, fn):
+        started = time.perf_counter()
+        for i in range(lookups):
+            fn(i)
+        print(f"{label:<42} {(time.perf_counter() - started) / lookups * 1e9:>8.0f} ns/op")
+
+    timed("for_user", lambda i: registry.for_user(user_ids[i]))
+    timed("for_thread", lambda i: registry.for_thread(thread_ids[i]))
+    timed("get (by socket)", lambda i: registry.get(sockets[i]))
+
+    # Writers get to run every 100 frames, as they would between incoming messages
+    started = time.perf_counter()
+    for i in range(lookups):
+        await fanout.deliver_local(user_ids[i], '{"type":"ping"}')
+        if i % 100 == 99:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    delivered = time.perf_counter() - started
+    print(f"{'deliver_local (queue and write a frame)':<42} {delivered / lookups * 1e9:>8.0f} ns/op")
+
+    started = time.perf_counter()
+    await fanout.reap()
+    print(f"{'reaper scan of every socket':<42} {(time.perf_counter() - started) * 1e3:>8.1f} ms")
+    print(f"\n{fanout.stats()['roles']}  threads indexed: {registry.thread_count}")
+
+    started = time.perf_counter()
+    for (user_id, _, _), socket in zip(population, sockets):
+        await fanout.disconnect(user_id, socket)
+    print(f"{'disconnect':<42} {(time.perf_counter() - started) / len(population) * 1e6:>8.2f} µs/op")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=100_000)
+    parser.add_argument("--threads", type=int, default=2, help="threads per user")
+    parser.add_argument("--second-device-share", type=float, default=0.1)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    asyncio.run(bench(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Load test: database pool usage of the chat WebSocket as the number of open sockets grows.
+
+Drives the real endpoint (Clerk verification included) against the database
+in DATABASE_URL, with in-process sockets. Checked-out pool connections are
+sampled throughout; they should stay flat while sockets are open and events
+flow, instead of growing by one per socket until the pool runs dry.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi import WebSocketDisconnect
+
+from app.database import engine, pool_stats
+from app.pubsub import fanout
+from app.presence import presence, typing_throttle
+from app.routes.chat import websocket_endpoint
+
+class LoadSocket:
+    """An in-process client socket; frames sent to it are counted, frames from it are queued"""
+
+    def __init__(self):
+        self.inbox = asyncio.Queue()
+        self.accepted = asyncio.Event()
+        self.closed = None
+        self.received = 0
+
+    async def accept(self):
+        self.accepted.set()
+
+    async def receive_text(self):
+        text = await self.inbox.get()
+        if text is None:
+            raise WebSocketDisconnect(1000)
+        return text
+
+    async def send_text(self, text):
+        self.received += 1
+
+    async def close(self, code=1000):
+        self.closed = code
+        self.accepted.set()
+
+    def frame(self, **message):
+        self.inbox.put_nowait(json.dumps(message))
+
+class PoolSampler:
+    """Peak checked-out connections since the last reset"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def reset(self):
+        self.peak = engine.pool.checkedout()
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, engine.pool.checkedout())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+async def settle(sockets):
+    # Let every socket work through its queued frames
+    while any(not socket.inbox.empty() for socket in sockets):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+async def run(args):
+    await fanout.start()
+    await presence.start()
+    sampler = PoolSampler(args.sample_interval)
+    sampler.start()
+
+    sockets, handlers = [], []
+    print(f"pool: size {engine.pool.size()}, max overflow {engine.pool._max_overflow}\n")
+    print(f"{'sockets':>8} {'open':>6} {'connect s':>10} {'peak on connect':>16} {'peak on events':>15} {'at rest':>8}")
+    try:
+        for target in args.steps:
+            sampler.reset()
+            started = time.perf_counter()
+            while len(sockets) < target:
+                socket = LoadSocket()
+                sockets.append(socket)
+                handlers.append(asyncio.create_task(websocket_endpoint(socket, args.token)))
+            await asyncio.gather(*(socket.accepted.wait() for socket in sockets))
+            connected = time.perf_counter() - started
+            open_sockets = sum(1 for socket in sockets if socket.closed is None)
+            if not open_sockets:
+                print("every socket was refused; check --token")
+                return
+            peak_connect = sampler.peak
+
+            # A round of events on every open socket
+            sampler.reset()
+            for _ in range(args.rounds):
+                for socket in sockets:
+                    socket.frame(type="heartbeat")
+                    if args.thread_id is not None:
+                        socket.frame(type="typing", thread_id=args.thread_id, is_typing=True)
+                        if args.message_id is not None:
+                            socket.frame(type="read", thread_id=args.thread_id, message_id=args.message_id)
+            await settle(sockets)
+            peak_events = sampler.peak
+
+            print(f"{target:>8} {open_sockets:>6} {connected:>10.2f} {peak_connect:>16} {peak_events:>15} "
+                  f"{pool_stats()['checked_out']:>8}")
+    finally:
+        for socket in sockets:
+            socket.inbox.put_nowait(None)
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await sampler.stop()
+        await typing_throttle.stop()
+        await presence.stop()
+        await fanout.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--token", required=True, help="Clerk session token; every socket signs in as this user")
+    parser.add_argument("--steps", type=lambda value: [int(n) for n in value.split(",")], default=[50, 100, 200, 400],
+                        help="open sockets at each step, comma separated")
+    parser.add_argument("--rounds", type=int, default=3, help="event rounds per step")
+    parser.add_argument("--thread-id", type=int, help="one of the user's threads, to send typing events to")
+    parser.add_argument("--message-id", type=int, help="a message in that thread, to send read events for")
+    parser.add_argument("--sample-interval", type=float, default=0.005)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
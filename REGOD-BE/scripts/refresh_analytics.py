@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Recompute teacher analytics rollups; run from cron to correct drift
+"""
+import argparse
+import os
+import sys
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import SessionLocal
+from app.analytics import refresh_analytics
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("ANALYTICS_REFRESH_BATCH_SIZE", "100")),
+        help="courses recomputed per transaction"
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        refreshed = refresh_analytics(db, batch_size=args.batch_size)
+        print(f"✓ Refreshed {refreshed} analytics rows")
+    except Exception as e:
+        print(f"❌ Error refreshing analytics: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Recompute denormalized user stats counters and fix any that drifted
+"""
+import argparse
+import os
+import sys
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import SessionLocal
+from app.stats import repair_user_stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("USER_STATS_REPAIR_BATCH_SIZE", "500")),
+        help="users recomputed per transaction"
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        repaired = repair_user_stats(db, batch_size=args.batch_size)
+        print(f"✓ Repaired {repaired} user stats rows")
+    except Exception as e:
+        print(f"❌ Error repairing user stats: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+# app.database builds its engine on import; nothing connects until a query runs,
+# and these tests never let one reach it
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/regod_test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def user():
+    """The signed-in user, with every permission"""
+    return SimpleNamespace(id=uuid.uuid4(), role="teacher", has_permission=lambda permission: True)
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+
+from app.auth import get_current_user
+from app.database import get_db
+
+
+class FakeResult:
+    def __init__(self, rows: list):
+        self._rows = rows
+
+    def mappings(self):
+        return self
+
+    def all(self) -> list:
+        return list(self._rows)
+
+    def first(self):
+        return self._rows[0] if self._rows else None
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeQuery:
+    def __init__(self, first):
+        self._first = first
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self._first
+
+
+class FakeSession:
+    """Stands in for a Session: every execute() gets the same canned rows.
+
+    Statements are kept so a test can check the query a route built.
+    ``get`` looks objects up by primary key in ``objects``.
+    """
+
+    def __init__(self, rows: Iterable[dict] = (), first=None, objects: Optional[dict] = None):
+        self.rows = list(rows)
+        self.first = first
+        self.objects = objects or {}
+        self.statements = []
+        self.commits = 0
+        self.closed = False
+
+    def execute(self, statement, *args, **kwargs) -> FakeResult:
+        self.statements.append(statement)
+        return FakeResult(self.rows)
+
+    def get(self, model, ident):
+        return self.objects.get(ident)
+
+    def query(self, *entities) -> FakeQuery:
+        return FakeQuery(self.first)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+
+def compile_statement(statement) -> tuple:
+    """(SQL, bound values) of a statement as Postgres would get it"""
+    compiled = statement.compile(dialect=postgresql.dialect())
+    return str(compiled), compiled.params
+
+
+def api_client(router: APIRouter, prefix: str, user, db: Optional[FakeSession] = None) -> TestClient:
+    """A client for one router, signed in as ``user`` and reading from ``db``"""
+    app = FastAPI()
+    app.include_router(router, prefix=prefix)
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[get_db] = lambda: db if db is not None else FakeSession()
+    return TestClient(app)
+
+
+class FakeWebSocket:
+    """Records sent frames and the close code.
+
+    ``send_text`` waits while ``gate`` is clear, to play a slow client, and
+    raises once ``broken`` is set.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.broken = False
+
+    async def send_text(self, text: str):
+        await self.gate.wait()
+        if self.broken:
+            raise RuntimeError("socket is gone")
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def settle(rounds: int = 10):
+    """Let queued writer tasks run"""
+    for _ in range(rounds):
+        await asyncio.sleep(0)
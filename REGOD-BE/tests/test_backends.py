@@ -0,0 +1,26 @@
+import pytest
+
+from app import favorite_cache, presence, pubsub, ratelimit
+
+
+def test_redis_url_without_the_redis_package_fails_fast(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    for module, name in ((pubsub, "aioredis"), (presence, "aioredis"), (favorite_cache, "redis"), (ratelimit, "redis")):
+        monkeypatch.setattr(module, name, None)
+
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        pubsub.create_fanout("redis://localhost:6379/0")
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        presence.create_presence("redis://localhost:6379/0", pubsub.fanout)
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        favorite_cache._create_favorite_cache()
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        ratelimit.create_rate_limiter("export", 5, 60)
+
+
+def test_no_redis_url_keeps_the_in_process_backends(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+
+    assert isinstance(pubsub.create_fanout(None).broker, pubsub.InMemoryBroker)
+    assert isinstance(favorite_cache._create_favorite_cache(), favorite_cache.LocalFavoriteCache)
+    assert isinstance(ratelimit.create_rate_limiter("export", 5, 60), ratelimit.LocalRateLimiter)
@@ -0,0 +1,100 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from jose import JWTError
+from sqlalchemy.exc import OperationalError
+from starlette.websockets import WebSocketDisconnect
+
+from app.routes import chat
+from tests.fakes import FakeSession, api_client
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Sessions the socket checks out, in order; they look threads up in ``threads``"""
+    sessions = []
+    threads = {}
+
+    def session_local():
+        sessions.append(FakeSession(objects=threads))
+        return sessions[-1]
+
+    session_local.threads = threads
+
+    monkeypatch.setattr(chat, "SessionLocal", session_local)
+    return sessions
+
+
+@pytest.mark.parametrize("error", [
+    HTTPException(status_code=401, detail="Invalid Clerk token"),
+    JWTError("Signature has expired"),
+    ConnectionError("Clerk is unreachable"),
+])
+def test_failed_verification_closes_with_policy_violation(monkeypatch, user, sessions, error):
+    def get_user_from_token(token, db):
+        raise error
+
+    monkeypatch.setattr(chat, "get_user_from_token", get_user_from_token)
+    client = api_client(chat.router, "/api/connect", user)
+
+    # The handshake is accepted, so the client sees a 1008 close frame rather than an HTTP 403
+    with client.websocket_connect("/api/connect/socket?token=bad") as websocket:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_text()
+
+    assert closed.value.code == 1008
+    assert len(sessions) == 1 and sessions[0].closed
+
+
+def test_database_errors_are_not_reported_as_bad_tokens(monkeypatch, user, sessions):
+    def thread_counterparts(db, user_id):
+        raise OperationalError("SELECT", {}, Exception("server closed the connection"))
+
+    monkeypatch.setattr(chat, "get_user_from_token", lambda token, db: SimpleNamespace(
+        id=user.id, has_role=lambda role: False
+    ))
+    monkeypatch.setattr(chat, "_thread_counterparts", thread_counterparts)
+    client = api_client(chat.router, "/api/connect", user)
+
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/api/connect/socket?token=good"):
+            pass
+
+    assert closed.value.code != 1008
+    assert len(sessions) == 1 and sessions[0].closed
+
+
+def test_typing_reaches_a_thread_created_after_connecting(monkeypatch, user, sessions):
+    teacher_id = uuid.uuid4()
+    relayed = []
+
+    async def relay(user_id, thread_id, recipient_id, is_typing=True):
+        relayed.append((thread_id, recipient_id))
+
+    monkeypatch.setattr(chat, "get_user_from_token", lambda token, db: SimpleNamespace(
+        id=user.id, has_role=lambda role: False
+    ))
+    monkeypatch.setattr(chat, "_thread_counterparts", lambda db, user_id: [])
+    monkeypatch.setattr(chat.typing_throttle, "relay", relay)
+    watched = []
+    monkeypatch.setattr(chat.presence, "watch", lambda websocket, user_id: watched.append(user_id))
+    client = api_client(chat.router, "/api/connect", user)
+
+    # Created after the socket connected, and someone else's thread
+    chat.SessionLocal.threads[5] = SimpleNamespace(id=5, user_id=user.id, assigned_teacher_id=teacher_id)
+    chat.SessionLocal.threads[4] = SimpleNamespace(id=4, user_id=uuid.uuid4(), assigned_teacher_id=teacher_id)
+
+    with client.websocket_connect("/api/connect/socket?token=good") as websocket:
+        websocket.send_json({"type": "typing", "thread_id": 4})
+        # Looked up once, then known
+        websocket.send_json({"type": "typing", "thread_id": 5})
+        websocket.send_json({"type": "typing", "thread_id": "5"})
+        websocket.send_json({"type": "heartbeat"})
+        assert websocket.receive_json() == {"type": "heartbeat_ack"}
+
+    assert relayed == [(5, str(teacher_id)), ("5", str(teacher_id))]
+    assert watched == [teacher_id]
+    # Connect, then one lookup for each thread not known at connect
+    assert len(sessions) == 3
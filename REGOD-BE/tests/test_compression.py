@@ -0,0 +1,161 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app import compression
+from app.compression import CompressionBudget, CompressionMiddleware, negotiate_encoding, parse_accept_encoding
+
+LARGE = b'{"items":[' + b",".join(b'{"id":%d,"title":"lesson"}' % i for i in range(200)) + b"]}"
+SMALL = b'{"ok":true}'
+
+
+def large(request):
+    return Response(LARGE, media_type="application/json")
+
+
+def small(request):
+    return Response(SMALL, media_type="application/json")
+
+
+def image(request):
+    return Response(LARGE, media_type="image/png")
+
+
+def tagged(request):
+    return Response(LARGE, media_type="application/json", headers={"ETag": request.query_params["etag"]})
+
+
+def precompressed(request):
+    return Response(gzip.compress(LARGE), media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+
+def empty(request):
+    return Response(status_code=204)
+
+
+def stream(request):
+    async def chunks():
+        for i in range(3):
+            yield b'{"line":%d}\n' % i
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+
+def make_client(**options) -> TestClient:
+    app = Starlette(routes=[
+        Route("/large", large),
+        Route("/small", small),
+        Route("/image", image),
+        Route("/tagged", tagged),
+        Route("/precompressed", precompressed),
+        Route("/empty", empty),
+        Route("/stream", stream),
+    ])
+    return TestClient(CompressionMiddleware(app, **options))
+
+
+def get(client: TestClient, path: str, accept_encoding: str = "gzip"):
+    return client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+
+def test_large_json_is_gzipped():
+    response = get(make_client(cpu_budget=0), "/large")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(LARGE)
+    assert response.content == LARGE
+
+
+@pytest.mark.parametrize("path", ["/small", "/image", "/empty"])
+def test_small_binary_and_empty_responses_pass_through(path):
+    response = get(make_client(cpu_budget=0), path)
+
+    assert "content-encoding" not in response.headers
+
+
+def test_already_encoded_responses_are_left_alone():
+    response = get(make_client(cpu_budget=0), "/precompressed")
+
+    # Compressed once: a single decode gives the original body back
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == LARGE
+
+
+@pytest.mark.parametrize("etag, accept_encoding, expected", [
+    ('"catalog-v3"', "gzip", 'W/"catalog-v3"'),
+    ('W/"catalog-v3"', "gzip", 'W/"catalog-v3"'),
+    ('"catalog-v3"', "identity", '"catalog-v3"'),
+])
+def test_compressed_responses_only_carry_weak_etags(etag, accept_encoding, expected):
+    response = make_client().get("/tagged", params={"etag": etag}, headers={"Accept-Encoding": accept_encoding})
+
+    assert response.headers.get("content-encoding") == (None if accept_encoding == "identity" else "gzip")
+    assert response.headers["etag"] == expected
+    assert response.content == LARGE
+
+
+@pytest.mark.parametrize("accept_encoding", ["", "identity", "gzip;q=0", "*;q=0"])
+def test_identity_requests_are_not_compressed(accept_encoding):
+    response = get(make_client(cpu_budget=0), "/large", accept_encoding)
+
+    assert "content-encoding" not in response.headers
+    assert response.content == LARGE
+
+
+def test_streams_are_compressed_chunk_by_chunk():
+    response = get(make_client(cpu_budget=0, minimum_size=1024), "/stream")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.content == b'{"line":0}\n{"line":1}\n{"line":2}\n'
+
+
+def test_exhausted_budget_sends_uncompressed():
+    client = make_client(cpu_budget=0.5)
+    client.app.budget.charge(10)
+
+    response = get(client, "/large")
+
+    assert "content-encoding" not in response.headers
+    assert response.content == LARGE
+
+
+def test_budget_refills_up_to_its_share():
+    budget = CompressionBudget(0.5)
+    budget.charge(0.75)
+    assert not budget.available()
+
+    budget.updated -= 10
+    assert budget.available()
+    assert budget.tokens == 0.5
+
+
+def test_zero_budget_is_unlimited():
+    budget = CompressionBudget(0)
+    budget.charge(100)
+
+    assert budget.available()
+
+
+def test_accept_encoding_q_values():
+    assert parse_accept_encoding("gzip;q=0.5, br , identity;q=bad") == {"gzip": 0.5, "br": 1.0, "identity": 0.0}
+
+
+def test_negotiation():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("*") in ("br", "gzip")
+    assert negotiate_encoding("deflate") is None
+    assert negotiate_encoding("br;q=0, gzip;q=0") is None
+
+
+def test_brotli_is_preferred_when_available(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+    assert negotiate_encoding("gzip, br;q=0.5") == "gzip"
+
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate_encoding("br") is None
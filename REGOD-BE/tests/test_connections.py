@@ -0,0 +1,171 @@
+import pytest
+
+from app.connections import Connection, ConnectionRegistry, SendMetrics, SLOW_CONSUMER_CLOSE_CODE
+from app.pubsub import InMemoryBroker, WebSocketFanout
+from tests.fakes import FakeWebSocket, settle
+
+pytestmark = pytest.mark.anyio
+
+
+def make_connection(websocket, queue_size: int = 4) -> tuple:
+    closed = []
+
+    async def on_close(connection):
+        closed.append(connection)
+
+    return Connection("u1", websocket, SendMetrics(), queue_size=queue_size, on_close=on_close), closed
+
+
+async def test_frames_are_written_in_order():
+    websocket = FakeWebSocket()
+    connection, closed = make_connection(websocket)
+
+    assert all(connection.send(str(i)) for i in range(3))
+    await settle()
+
+    assert websocket.sent == ["0", "1", "2"]
+    assert connection.depth == 0
+    assert connection.metrics.snapshot() == {
+        "queued": 3, "sent": 3, "send_errors": 0, "slow_disconnects": 0, "dropped": 0, "max_queue_depth": 3
+    }
+    assert closed == []
+
+
+async def test_idle_connection_keeps_no_buffer_or_writer():
+    connection, _ = make_connection(FakeWebSocket())
+
+    connection.send("a")
+    await settle()
+
+    assert connection._pending is None and connection._writer is None
+
+
+async def test_slow_consumer_is_closed_when_its_queue_fills():
+    websocket = FakeWebSocket()
+    websocket.gate.clear()
+    connection, closed = make_connection(websocket, queue_size=2)
+
+    assert connection.send("a") and connection.send("b")
+    assert not connection.send("c")
+    await settle()
+
+    assert connection.closed
+    assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+    assert closed == [connection]
+    assert connection.metrics.slow_disconnects == 1
+    assert connection.metrics.dropped == 3
+
+    assert not connection.send("d")
+    assert connection.metrics.dropped == 4
+    assert closed == [connection]
+
+
+async def test_slow_frames_do_not_hold_up_the_caller():
+    websocket = FakeWebSocket()
+    websocket.gate.clear()
+    connection, _ = make_connection(websocket)
+
+    connection.send("a")
+    await settle()
+    connection.send("b")
+
+    assert websocket.sent == [] and connection.depth == 1
+    websocket.gate.set()
+    await settle()
+    assert websocket.sent == ["a", "b"]
+
+
+async def test_send_error_drops_the_socket_once():
+    websocket = FakeWebSocket()
+    websocket.broken = True
+    connection, closed = make_connection(websocket)
+
+    connection.send("a")
+    connection.send("b")
+    await settle()
+
+    assert connection.closed
+    assert closed == [connection]
+    assert connection.metrics.send_errors == 1
+    assert connection.metrics.dropped == 1
+    assert not connection.send("c")
+
+
+async def test_stop_discards_queued_frames():
+    websocket = FakeWebSocket()
+    websocket.gate.clear()
+    connection, closed = make_connection(websocket)
+
+    connection.send("a")
+    connection.send("b")
+    await connection.stop()
+    websocket.gate.set()
+    await settle()
+
+    assert websocket.sent == []
+    assert closed == []
+
+
+def registered(registry: ConnectionRegistry, user_id: str, role=None, threads=None) -> Connection:
+    connection = Connection(user_id, object(), SendMetrics(), role=role, threads=threads)
+    registry.add(connection)
+    return connection
+
+
+def test_registry_indexes_by_user_thread_and_role():
+    registry = ConnectionRegistry(shards=4)
+    phone = registered(registry, "s1", role="student", threads={"7": "t1"})
+    laptop = registered(registry, "s1", role="student", threads={"7": "t1"})
+    teacher = registered(registry, "t1", role="teacher", threads={"7": "s1", "8": "s2"})
+
+    assert len(registry) == 3
+    assert set(registry.for_user("s1")) == {phone, laptop}
+    assert set(registry.for_thread(7)) == {phone, laptop, teacher}
+    assert registry.for_thread("8") == (teacher,)
+    assert registry.for_role("teacher") == (teacher,)
+    assert registry.role_counts() == {"student": 2, "teacher": 1}
+    assert registry.user_count == 2 and registry.thread_count == 2
+    assert registry.get(phone.websocket) is phone
+    assert sum(len(shard) for shard in registry.shards()) == 3
+
+
+def test_registry_removal_collapses_and_clears_indexes():
+    registry = ConnectionRegistry(shards=4)
+    phone = registered(registry, "s1", role="student", threads={"7": "t1"})
+    laptop = registered(registry, "s1", role="student", threads={"7": "t1"})
+
+    assert registry.remove(phone.websocket) is phone
+    # Back to a single connection: stored directly rather than in a set
+    assert registry._by_user["s1"] is laptop
+    assert registry.for_thread(7) == (laptop,)
+
+    assert registry.remove(laptop.websocket) is laptop
+    assert registry.remove(laptop.websocket) is None
+    assert len(registry) == 0
+    assert not registry.has_user("s1")
+    assert registry.for_thread(7) == ()
+    assert registry.role_counts() == {}
+
+
+def test_joining_a_new_thread_indexes_it_once():
+    registry = ConnectionRegistry(shards=4)
+    connection = registered(registry, "s1")
+
+    registry.join_thread(connection, 9, "t1")
+    registry.join_thread(connection, "9", "t1")
+
+    assert connection.counterpart(9) == "t1"
+    assert registry.for_thread(9) == (connection,)
+    assert connection.counterpart(10) is None
+
+
+async def test_fanout_skips_threads_without_a_counterpart():
+    fanout = WebSocketFanout(InMemoryBroker())
+    await fanout.start()
+
+    connection = await fanout.connect("u1", FakeWebSocket(), role="student", threads={1: "t1", 2: None})
+
+    assert connection.threads == {"1": "t1"}
+    assert fanout.stats()["local_threads"] == 1
+    assert fanout.stats()["roles"] == {"student": 1}
+    await fanout.stop()
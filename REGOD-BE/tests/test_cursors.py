@@ -0,0 +1,40 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from app.utils.helpers import encode_cursor, decode_cursor
+
+
+def test_cursor_round_trips():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+    cursor = encode_cursor(created_at.isoformat(), 42)
+
+    assert decode_cursor(cursor) == [created_at.isoformat(), 42]
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor("a" * 7, 10 ** 12, "?&/+")
+
+    assert "=" not in cursor
+    assert all(char.isalnum() or char in "-_" for char in cursor)
+    assert decode_cursor(cursor) == ["a" * 7, 10 ** 12, "?&/+"]
+
+
+def test_non_json_values_are_encoded_as_strings():
+    assert decode_cursor(encode_cursor(datetime(2024, 1, 2))) == ["2024-01-02 00:00:00"]
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not-a-cursor",
+    "%%%",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode(json.dumps({"id": 1}).encode()).decode(),
+    base64.urlsafe_b64encode(b"7").decode(),
+    None,
+])
+def test_malformed_cursors_decode_to_none(cursor):
+    assert decode_cursor(cursor) is None
@@ -0,0 +1,142 @@
+import csv
+import io
+import zipfile
+from datetime import datetime
+
+import orjson
+import pytest
+
+from app import export
+from app.export import EXPORT_ENTITIES, export_plan
+from app.routes import export as export_routes
+from app.utils.helpers import decode_cursor
+from tests.fakes import FakeSession, api_client, compile_statement
+
+CREATED_AT = datetime(2024, 5, 1, 12, 0)
+
+
+def favorite(favorite_id: int) -> dict:
+    return {
+        "id": favorite_id, "lesson_id": 3, "lesson_title": "Lesson", "course_id": 1,
+        "course_title": None, "created_at": CREATED_AT,
+    }
+
+
+def test_plan_without_cursor_covers_requested_entities_in_export_order():
+    assert export_plan(["notes", "progress"], None) == [("progress", 0), ("notes", 0)]
+
+
+def test_plan_resumes_after_the_cursor():
+    assert export_plan(EXPORT_ENTITIES, ["favorites", 10]) == [("favorites", 10), ("notes", 0)]
+
+
+@pytest.mark.parametrize("cursor", [
+    [],
+    ["favorites"],
+    ["favorites", 10, 1],
+    ["favorites", "10"],
+    ["unknown", 10],
+    ["notes", 10],
+])
+def test_plan_rejects_bad_cursors(cursor):
+    assert export_plan(["progress", "favorites"], cursor) == []
+
+
+@pytest.fixture
+def batch_sessions(monkeypatch):
+    """Sessions handed out by SessionLocal, each answering with the next canned batch"""
+    sessions = []
+    batches = []
+
+    def session_local():
+        session = FakeSession(batches.pop(0) if batches else [])
+        sessions.append(session)
+        return session
+
+    monkeypatch.setattr(export, "SessionLocal", session_local)
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    return sessions, batches
+
+
+def test_batches_release_their_session_before_yielding(batch_sessions):
+    sessions, batches = batch_sessions
+    batches.extend([[favorite(1), favorite(2)], [favorite(3)]])
+
+    stream = export._export_batches("user", "favorites", 0)
+
+    assert [row["id"] for row in next(stream)] == [1, 2]
+    assert len(sessions) == 1 and sessions[0].closed
+    assert [row["id"] for row in next(stream)] == [3]
+    assert len(sessions) == 2 and sessions[1].closed
+    # The second batch seeks past the last id of the first
+    assert "user_favorites.id > " in compile_statement(sessions[1].statements[0])[0]
+    assert 2 in compile_statement(sessions[1].statements[0])[1].values()
+    # A short batch is the last one; no further query
+    assert next(stream, None) is None
+    assert len(sessions) == 2
+
+
+def test_full_last_batch_ends_on_an_empty_query(batch_sessions):
+    sessions, batches = batch_sessions
+    batches.append([favorite(1), favorite(2)])
+
+    assert len(list(export._export_batches("user", "favorites", 0))) == 1
+    assert len(sessions) == 2 and all(session.closed for session in sessions)
+
+
+def test_ndjson_lines_carry_a_resume_cursor():
+    lines = b"".join(export._encode_ndjson("favorites", iter([[favorite(1)], [favorite(2)]]))).splitlines()
+
+    records = [orjson.loads(line) for line in lines]
+    assert [record["id"] for record in records] == [1, 2]
+    assert records[0]["entity"] == "favorites"
+    assert records[0]["created_at"] == "2024-05-01T12:00:00"
+    assert decode_cursor(records[1]["cursor"]) == ["favorites", 2]
+
+
+def test_csv_has_a_header_and_blank_nulls():
+    body = b"".join(export._encode_csv("favorites", iter([[favorite(1)]]))).decode()
+
+    header, row = list(csv.reader(io.StringIO(body)))
+    assert header == ["cursor", "id", "lesson_id", "lesson_title", "course_id", "course_title", "created_at"]
+    assert decode_cursor(row[0]) == ["favorites", 1]
+    assert row[1:] == ["1", "3", "Lesson", "1", "", "2024-05-01T12:00:00"]
+
+
+def test_zip_has_one_member_per_entity(monkeypatch):
+    monkeypatch.setattr(export, "_export_batches", lambda user_id, entity, after_id: iter([[favorite(after_id + 1)]]))
+
+    body = b"".join(export.stream_export_zip("user", [("favorites", 4), ("notes", 0)], "ndjson"))
+
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.namelist() == ["favorites.ndjson", "notes.ndjson"]
+        assert orjson.loads(archive.read("favorites.ndjson"))["id"] == 5
+        assert orjson.loads(archive.read("notes.ndjson"))["entity"] == "notes"
+
+
+def test_request_session_is_closed_before_streaming(monkeypatch, user):
+    db = FakeSession()
+
+    def stream_export(user_id, plan, export_format):
+        assert db.closed
+        yield b"{}\n"
+
+    monkeypatch.setattr(export_routes, "stream_export", stream_export)
+
+    response = api_client(export_routes.router, "/api/user", user, db).get("/api/user/export?include=favorites")
+
+    assert response.status_code == 200
+    assert response.content == b"{}\n"
+
+
+@pytest.mark.parametrize("params", [
+    {"format": "xml"},
+    {"include": "favorites,secrets"},
+    {"format": "csv"},
+    {"cursor": "garbage"},
+    {"cursor": "W10"},
+])
+def test_bad_requests_are_rejected(user, params):
+    response = api_client(export_routes.router, "/api/user", user).get("/api/user/export", params=params)
+
+    assert response.status_code == 400
@@ -0,0 +1,167 @@
+import asyncio
+
+import orjson
+import pytest
+
+from app import connections
+from app.connections import IDLE_CLOSE_CODE
+from app.pubsub import InMemoryBroker, WebSocketFanout
+from tests.fakes import FakeWebSocket, settle
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_message_reaches_every_socket_of_the_user_on_any_worker():
+    hub = {}
+    sender, receiver = WebSocketFanout(InMemoryBroker(hub)), WebSocketFanout(InMemoryBroker(hub))
+    await sender.start()
+    await receiver.start()
+    phone, laptop = FakeWebSocket(), FakeWebSocket()
+    await receiver.connect("u1", phone)
+    await receiver.connect("u1", laptop)
+
+    await sender.send_to_user("u1", {"type": "message", "id": 1})
+    await settle()
+
+    assert [orjson.loads(frame) for frame in phone.sent] == [{"type": "message", "id": 1}]
+    assert laptop.sent == phone.sent
+    assert sender.metrics.published == 1
+    assert receiver.metrics.delivered == 2
+    await sender.stop()
+    await receiver.stop()
+
+
+async def test_local_recipients_get_each_message_once():
+    hub = {}
+    first, second = WebSocketFanout(InMemoryBroker(hub)), WebSocketFanout(InMemoryBroker(hub))
+    await first.start()
+    await second.start()
+    here, there = FakeWebSocket(), FakeWebSocket()
+    await first.connect("u1", here)
+    await second.connect("u1", there)
+
+    await first.send_to_user("u1", {"id": 1})
+    await settle()
+
+    assert len(here.sent) == 1 and len(there.sent) == 1
+    await first.stop()
+    await second.stop()
+
+
+async def test_worker_unsubscribes_with_the_users_last_socket():
+    hub = {}
+    fanout = WebSocketFanout(InMemoryBroker(hub))
+    await fanout.start()
+    phone, laptop = FakeWebSocket(), FakeWebSocket()
+    await fanout.connect("u1", phone)
+    await fanout.connect("u1", laptop)
+
+    await fanout.disconnect("u1", phone)
+    assert fanout.channel("u1") in hub
+
+    await fanout.disconnect("u1", laptop)
+    assert fanout.channel("u1") not in hub
+    assert not fanout.is_connected_locally("u1")
+
+    await fanout.send_to_user("u1", {"id": 1})
+    assert phone.sent == [] and laptop.sent == []
+    await fanout.stop()
+
+
+async def test_delivery_to_a_user_without_sockets_is_counted():
+    fanout = WebSocketFanout(InMemoryBroker())
+    await fanout.start()
+
+    assert await fanout.deliver_local("nobody", "{}") == 0
+    assert fanout.metrics.undelivered == 1
+    await fanout.stop()
+
+
+async def test_listen_routes_other_channels_to_their_handler():
+    hub = {}
+    fanout = WebSocketFanout(InMemoryBroker(hub))
+    await fanout.start()
+    received = []
+
+    async def handler(channel, payload):
+        received.append((channel, payload))
+
+    await fanout.listen("ws:presence", handler)
+    await InMemoryBroker(hub).publish("ws:presence", b"change")
+
+    assert received == [("ws:presence", b"change")]
+    assert fanout.metrics.received == 0
+    await fanout.stop()
+
+
+
+def reaping_fanout(hub=None) -> WebSocketFanout:
+    # The reaper is driven by hand; its own loop never wakes up during a test
+    return WebSocketFanout(InMemoryBroker(hub), ping_interval=10, idle_timeout=30, reap_interval=3600)
+
+
+async def test_quiet_socket_is_pinged_once():
+    fanout = reaping_fanout()
+    await fanout.start()
+    websocket = FakeWebSocket()
+    connection = await fanout.connect("u1", websocket)
+    connection.last_seen -= 15
+
+    assert await fanout.reap() == 0
+    assert await fanout.reap() == 0
+    await settle()
+
+    assert websocket.sent == [fanout.ping_frame]
+    assert fanout.metrics.pings == 1
+    await fanout.stop()
+
+
+async def test_active_socket_is_left_alone():
+    fanout = reaping_fanout()
+    await fanout.start()
+    websocket = FakeWebSocket()
+    connection = await fanout.connect("u1", websocket)
+    connection.last_seen -= 15
+    connection.touch()
+
+    assert await fanout.reap() == 0
+    await settle()
+
+    assert websocket.sent == []
+    await fanout.stop()
+
+
+async def test_idle_socket_is_closed_and_unregistered():
+    hub = {}
+    fanout = reaping_fanout(hub)
+    await fanout.start()
+    idle, active = FakeWebSocket(), FakeWebSocket()
+    (await fanout.connect("u1", idle)).last_seen -= 31
+    await fanout.connect("u2", active)
+
+    assert await fanout.reap() == 1
+
+    assert idle.close_code == IDLE_CLOSE_CODE
+    assert fanout.connection(idle) is None
+    assert fanout.channel("u1") not in hub
+    assert fanout.connection(active) is not None and active.close_code is None
+    assert fanout.metrics.reaped == 1
+    await fanout.stop()
+
+
+class HalfOpenWebSocket(FakeWebSocket):
+    async def close(self, code: int = 1000):
+        await asyncio.Event().wait()
+
+
+async def test_half_open_peers_do_not_stall_the_reaper(monkeypatch):
+    monkeypatch.setattr(connections, "CLOSE_TIMEOUT", 0.05)
+    fanout = reaping_fanout()
+    await fanout.start()
+    for i in range(10):
+        (await fanout.connect(f"u{i}", HalfOpenWebSocket())).last_seen -= 31
+
+    # Closed together, so the batch takes one close timeout rather than ten
+    assert await asyncio.wait_for(fanout.reap(), 0.3) == 10
+    assert fanout.local_connections == 0
+    await fanout.stop()
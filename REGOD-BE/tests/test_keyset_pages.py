@@ -0,0 +1,326 @@
+import re
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.routes import chat, favorites, profile
+from app.utils.helpers import encode_cursor, decode_cursor
+from tests.fakes import FakeSession, api_client, compile_statement
+
+NOW = datetime(2024, 5, 1, 12, 0)
+
+BAD_TIMESTAMP_CURSORS = [
+    "garbage",
+    encode_cursor(NOW.isoformat()),
+    encode_cursor(NOW.isoformat(), 1, 2),
+    encode_cursor("yesterday", 1),
+    encode_cursor(NOW.isoformat(), "1"),
+]
+
+
+def page_query(db: FakeSession) -> tuple:
+    """(SQL, bound values, LIMIT) of the one page query a route ran"""
+    assert len(db.statements) == 1
+    sql, params = compile_statement(db.statements[0])
+    return sql, params, params[re.search(r"LIMIT %\((\w+)\)s", sql).group(1)]
+
+
+def favorite_rows(user, count: int) -> list:
+    # Two favourites per timestamp, so pages have to break ties on id
+    return [
+        {
+            "id": 100 - i, "user_id": user.id, "lesson_id": i, "created_at": NOW - timedelta(minutes=i // 2),
+            "lesson_title": f"Lesson {i}", "course_title": "Course", "thumbnail_url": None,
+        }
+        for i in range(count)
+    ]
+
+
+def test_favorites_last_page_has_no_cursor(user):
+    db = FakeSession(favorite_rows(user, 3))
+
+    body = api_client(favorites.router, "/api/user", user, db).get("/api/user/favourites?limit=3").json()
+
+    assert [item["id"] for item in body["items"]] == [100, 99, 98]
+    assert body["next_cursor"] is None
+    assert body["has_more"] is False
+    assert page_query(db)[2] == 4
+
+
+def test_favorites_extra_row_means_another_page(user):
+    rows = favorite_rows(user, 4)
+    db = FakeSession(rows)
+
+    body = api_client(favorites.router, "/api/user", user, db).get("/api/user/favourites?limit=3").json()
+
+    assert len(body["items"]) == 3
+    assert body["has_more"] is True
+    assert decode_cursor(body["next_cursor"]) == [rows[2]["created_at"].isoformat(), rows[2]["id"]]
+
+
+def test_favorites_cursor_seeks_past_the_last_row(user):
+    db = FakeSession()
+    client = api_client(favorites.router, "/api/user", user, db)
+
+    client.get("/api/user/favourites", params={"cursor": encode_cursor(NOW.isoformat(), 98)})
+
+    sql, params, _ = page_query(db)
+    assert "(user_favorites.created_at, user_favorites.id) < (" in sql
+    assert NOW in params.values() and 98 in params.values()
+
+
+@pytest.mark.parametrize("limit, fetched", [(0, 2), (-5, 2), (10_000, favorites.MAX_FAVORITES_PAGE + 1)])
+def test_favorites_limit_is_clamped(user, limit, fetched):
+    db = FakeSession()
+
+    api_client(favorites.router, "/api/user", user, db).get("/api/user/favourites", params={"limit": limit})
+
+    assert page_query(db)[2] == fetched
+
+
+@pytest.mark.parametrize("cursor", BAD_TIMESTAMP_CURSORS)
+def test_favorites_rejects_bad_cursors(user, cursor):
+    db = FakeSession()
+
+    response = api_client(favorites.router, "/api/user", user, db).get(
+        "/api/user/favourites", params={"cursor": cursor}
+    )
+
+    assert response.status_code == 400
+    assert db.statements == []
+
+
+def note_rows(user, count: int) -> list:
+    return [
+        {
+            "id": 50 - i, "user_id": user.id, "course_id": 1, "lesson_id": 2, "note_content": f"Note {i}",
+            "version": 1, "created_at": NOW, "updated_at": NOW, "course_title": "Course", "lesson_title": "Lesson",
+        }
+        for i in range(count)
+    ]
+
+
+def test_notes_pages_by_id(user):
+    rows = note_rows(user, 3)
+    db = FakeSession(rows)
+
+    body = api_client(profile.router, "/api/user", user, db).get("/api/user/notes?limit=2").json()
+
+    assert [item["id"] for item in body["items"]] == [50, 49]
+    assert body["has_more"] is True
+    assert decode_cursor(body["next_cursor"]) == [49]
+
+
+def test_notes_last_page_has_no_cursor(user):
+    db = FakeSession(note_rows(user, 2))
+
+    body = api_client(profile.router, "/api/user", user, db).get("/api/user/notes?limit=2").json()
+
+    assert body["next_cursor"] is None
+    assert body["has_more"] is False
+
+
+def test_notes_cursor_keeps_the_filters(user):
+    db = FakeSession()
+
+    api_client(profile.router, "/api/user", user, db).get(
+        "/api/user/notes", params={"cursor": encode_cursor(49), "course_id": 1, "lesson_id": 2, "q": "grace"}
+    )
+
+    sql, params, _ = page_query(db)
+    assert "user_notes.id < " in sql
+    assert "user_notes.course_id = " in sql and "user_notes.lesson_id = " in sql
+    assert "websearch_to_tsquery" in sql
+    assert 49 in params.values() and "grace" in params.values()
+
+
+def test_notes_blank_search_is_ignored(user):
+    db = FakeSession()
+
+    api_client(profile.router, "/api/user", user, db).get("/api/user/notes", params={"q": "  "})
+
+    assert "websearch_to_tsquery" not in page_query(db)[0]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", encode_cursor(), encode_cursor(1, 2), encode_cursor("49")])
+def test_notes_rejects_bad_cursors(user, cursor):
+    db = FakeSession()
+
+    response = api_client(profile.router, "/api/user", user, db).get("/api/user/notes", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert db.statements == []
+
+
+@pytest.fixture
+def history(monkeypatch, user):
+    """The user's thread, with marking it read recorded instead of written"""
+    teacher_id = uuid.uuid4()
+    thread = SimpleNamespace(id=7, user_id=user.id, assigned_teacher_id=teacher_id)
+    state = SimpleNamespace(thread=thread, teacher_id=teacher_id, marked=[], watermarks={})
+
+    async def mark_thread_read(db, thread, current_user, message_id):
+        state.marked.append(message_id)
+        return 0
+
+    monkeypatch.setattr(chat, "_mark_thread_read", mark_thread_read)
+    monkeypatch.setattr(chat, "read_watermarks", lambda db, thread_id: state.watermarks)
+    return state
+
+
+def message_rows(sender_id, count: int) -> list:
+    # Newest first, the way the page query orders them; pairs share a timestamp
+    return [
+        {
+            "id": 100 - i, "thread_id": 7, "sender_id": sender_id, "sender_name": "Sam", "sender_type": "student",
+            "content": f"Message {i}", "message_type": "text", "timestamp": NOW - timedelta(seconds=i // 2),
+            "read_status": False,
+        }
+        for i in range(count)
+    ]
+
+
+def test_history_without_thread_is_empty(user, history):
+    db = FakeSession(first=None)
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/thread/messages").json()
+
+    assert body == {"items": [], "next_cursor": None, "has_more": False}
+    assert db.statements == []
+
+
+def test_history_pages_back_from_the_newest_message(user, history):
+    rows = message_rows(user.id, 4)
+    db = FakeSession(rows, first=history.thread)
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/thread/messages?limit=3").json()
+
+    # Shown oldest first; the cursor points at the oldest message shown
+    assert [item["id"] for item in body["items"]] == [98, 99, 100]
+    assert body["has_more"] is True
+    assert decode_cursor(body["next_cursor"]) == [rows[2]["timestamp"].isoformat(), 98]
+    assert history.marked == [100]
+
+
+def test_history_last_page_has_no_cursor(user, history):
+    db = FakeSession(message_rows(user.id, 3), first=history.thread)
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/thread/messages?limit=3").json()
+
+    assert body["next_cursor"] is None
+    assert body["has_more"] is False
+
+
+def test_history_cursor_seeks_past_the_oldest_message(user, history):
+    db = FakeSession(first=history.thread)
+
+    api_client(chat.router, "/api/connect", user, db).get(
+        "/api/connect/thread/messages", params={"cursor": encode_cursor(NOW.isoformat(), 98)}
+    )
+
+    sql, params, _ = page_query(db)
+    assert "(chat_messages.timestamp, chat_messages.id) < (" in sql
+    assert NOW in params.values() and 98 in params.values()
+    assert history.marked == []
+
+
+def test_history_own_messages_are_read_up_to_the_other_watermark(user, history):
+    history.watermarks = {user.id: 100, history.teacher_id: 99}
+    db = FakeSession(message_rows(user.id, 3), first=history.thread)
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/thread/messages").json()
+
+    assert {item["id"]: item["read_status"] for item in body["items"]} == {98: True, 99: True, 100: False}
+
+
+@pytest.mark.parametrize("cursor", BAD_TIMESTAMP_CURSORS)
+def test_history_rejects_bad_cursors(user, history, cursor):
+    db = FakeSession(first=history.thread)
+
+    response = api_client(chat.router, "/api/connect", user, db).get(
+        "/api/connect/thread/messages", params={"cursor": cursor}
+    )
+
+    assert response.status_code == 400
+    assert db.statements == []
+
+
+def inbox_rows(count: int) -> list:
+    return [
+        {
+            "thread_id": 30 - i, "student_id": uuid.uuid4(), "student_name": f"Student {i}", "student_avatar": None,
+            "last_message_id": None, "last_message": None, "last_message_sender_id": None,
+            "last_message_at": NOW - timedelta(minutes=i // 2), "unread_count": i,
+        }
+        for i in range(count)
+    ]
+
+
+def test_inbox_pages_by_last_activity(user):
+    rows = inbox_rows(3)
+    db = FakeSession(rows)
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/inbox?limit=2").json()
+
+    assert [item["thread_id"] for item in body["items"]] == [30, 29]
+    assert body["has_more"] is True
+    assert decode_cursor(body["next_cursor"]) == [rows[1]["last_message_at"].isoformat(), 29]
+
+
+def test_inbox_last_page_has_no_cursor(user):
+    db = FakeSession(inbox_rows(2))
+
+    body = api_client(chat.router, "/api/connect", user, db).get("/api/connect/inbox?limit=2").json()
+
+    assert body["next_cursor"] is None
+    assert body["has_more"] is False
+
+
+def test_inbox_cursor_seeks_past_the_last_thread(user):
+    db = FakeSession()
+
+    api_client(chat.router, "/api/connect", user, db).get(
+        "/api/connect/inbox", params={"cursor": encode_cursor(NOW.isoformat(), 29)}
+    )
+
+    sql, params, _ = page_query(db)
+    assert "(chat_threads.last_message_at, chat_threads.id) < (" in sql
+    assert NOW in params.values() and 29 in params.values()
+
+
+def test_inbox_fills_in_missing_counters_and_presence(monkeypatch, user):
+    rows = inbox_rows(2)
+    rows[1]["unread_count"] = None
+    online_student = str(rows[0]["student_id"])
+
+    async def online_users(user_ids):
+        return {user_id for user_id in map(str, user_ids) if user_id == online_student}
+
+    monkeypatch.setattr(chat, "get_unread_counts", lambda db, user_id, thread_ids: {thread_ids[0]: 4})
+    monkeypatch.setattr(chat.presence, "online_users", online_users)
+
+    body = api_client(chat.router, "/api/connect", user, FakeSession(rows)).get("/api/connect/inbox").json()
+
+    assert [(item["unread_count"], item["is_online"]) for item in body["items"]] == [(0, True), (4, False)]
+
+
+def test_inbox_requires_permission(user):
+    user.has_permission = lambda permission: False
+    db = FakeSession()
+
+    response = api_client(chat.router, "/api/connect", user, db).get("/api/connect/inbox")
+
+    assert response.status_code == 403
+    assert db.statements == []
+
+
+@pytest.mark.parametrize("cursor", BAD_TIMESTAMP_CURSORS)
+def test_inbox_rejects_bad_cursors(user, cursor):
+    db = FakeSession()
+
+    response = api_client(chat.router, "/api/connect", user, db).get("/api/connect/inbox", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert db.statements == []
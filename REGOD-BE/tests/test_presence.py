@@ -0,0 +1,31 @@
+import orjson
+import pytest
+
+from app.presence import LocalPresenceStore, PresenceService
+from app.pubsub import InMemoryBroker, WebSocketFanout
+from tests.fakes import FakeWebSocket, settle
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_watch_added_after_connecting_forwards_changes():
+    fanout = WebSocketFanout(InMemoryBroker())
+    presence = PresenceService(LocalPresenceStore(), fanout)
+    await fanout.start()
+    await presence.start()
+    student_socket, teacher_socket = FakeWebSocket(), FakeWebSocket()
+    await fanout.connect("s1", student_socket)
+    await presence.connect("s1", student_socket)
+
+    # A thread with t1 is created after the student connected
+    presence.watch(student_socket, "t1")
+    presence.watch(student_socket, "t1")
+    await fanout.connect("t1", teacher_socket)
+    await presence.connect("t1", teacher_socket)
+    await settle()
+
+    assert [orjson.loads(frame)["user_id"] for frame in student_socket.sent] == ["t1"]
+    await presence.disconnect(student_socket)
+    assert presence.stats()["watched_users"] == 0
+    await presence.stop()
+    await fanout.stop()
@@ -0,0 +1,110 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import orjson
+import pytest
+from pydantic import BaseModel, Field
+
+from app.responses import dump_trusted, trusted_response, trusted_page_response
+from app.schemas import FavoriteResponse, MessageResponse, NoteResponse, TeacherCodeResponse
+
+
+class Author(BaseModel):
+    name: str
+
+
+class Item(BaseModel):
+    id: int
+    owner: uuid.UUID
+    created_at: datetime
+    title: Optional[str] = None
+    tags: List[str] = Field(default_factory=list)
+    author: Optional[Author] = None
+
+
+OWNER = uuid.UUID("12345678-1234-5678-1234-567812345678")
+CREATED_AT = datetime(2024, 5, 1, 12, 30)
+
+
+def test_rows_are_shaped_like_the_schema():
+    rows = [{"id": 1, "owner": OWNER, "created_at": CREATED_AT, "title": "Hi", "secret": "dropped"}]
+
+    assert orjson.loads(dump_trusted(Item, rows)) == [{
+        "id": 1,
+        "owner": str(OWNER),
+        "created_at": "2024-05-01T12:30:00",
+        "title": "Hi",
+        "tags": [],
+        "author": None,
+    }]
+
+
+@pytest.mark.parametrize("created_at", [
+    CREATED_AT,
+    CREATED_AT.replace(tzinfo=timezone.utc),
+    CREATED_AT.replace(tzinfo=timezone(timedelta(hours=2))),
+])
+def test_matches_validated_serialization(created_at):
+    rows = [{"id": 2, "owner": OWNER, "created_at": created_at, "tags": ["a"], "author": Author(name="Ann")}]
+
+    assert orjson.loads(dump_trusted(Item, rows)) == [Item(**rows[0]).model_dump(mode="json")]
+
+
+def test_utc_datetimes_end_in_z():
+    rows = [{"id": 1, "owner": OWNER, "created_at": CREATED_AT.replace(tzinfo=timezone.utc)}]
+
+    assert orjson.loads(dump_trusted(Item, rows))[0]["created_at"] == "2024-05-01T12:30:00Z"
+
+
+# Rows as the trusted routes read them: timestamptz columns and UUID user ids
+AWARE = CREATED_AT.replace(tzinfo=timezone.utc)
+ROUTE_ROWS = {
+    FavoriteResponse: {
+        "id": 1, "user_id": OWNER, "lesson_id": 2, "created_at": AWARE,
+        "lesson_title": "Lesson", "course_title": "Course", "thumbnail_url": None,
+    },
+    NoteResponse: {
+        "id": 1, "user_id": OWNER, "course_id": 1, "lesson_id": 2, "note_content": "Note", "version": 3,
+        "created_at": AWARE, "updated_at": AWARE, "course_title": "Course", "lesson_title": "Lesson",
+    },
+    MessageResponse: {
+        "id": 1, "thread_id": 2, "sender_id": OWNER, "sender_name": "Sam", "sender_type": "student",
+        "content": "Hi", "message_type": "text", "timestamp": AWARE, "read_status": True,
+    },
+    TeacherCodeResponse: {
+        "id": 1, "code": "ABCD1234", "teacher_id": OWNER, "teacher_name": "Tess", "created_at": AWARE,
+        "max_uses": 5, "expires_at": None, "use_count": 0, "is_active": True,
+    },
+}
+
+
+@pytest.mark.parametrize("model", list(ROUTE_ROWS), ids=lambda model: model.__name__)
+def test_route_schemas_match_their_rows(model):
+    row = ROUTE_ROWS[model]
+
+    assert orjson.loads(dump_trusted(model, [row])) == [model.model_validate(row).model_dump(mode="json")]
+
+
+def test_missing_required_field_raises():
+    with pytest.raises(KeyError):
+        dump_trusted(Item, [{"id": 1, "owner": OWNER}])
+
+
+def test_trusted_response_is_json():
+    response = trusted_response(Item, [])
+
+    assert response.media_type == "application/json"
+    assert response.body == b"[]"
+
+
+def test_page_envelope():
+    rows = [{"id": 1, "owner": OWNER, "created_at": CREATED_AT}]
+
+    page = orjson.loads(trusted_page_response(Item, rows, "abc").body)
+    last_page = orjson.loads(trusted_page_response(Item, [], None).body)
+
+    assert page["next_cursor"] == "abc"
+    assert page["has_more"] is True
+    assert [item["id"] for item in page["items"]] == [1]
+    assert last_page == {"items": [], "next_cursor": None, "has_more": False}
@@ -0,0 +1,37 @@
+import uuid
+
+from app.stats import create_user_stats, get_user_stats
+from tests.fakes import FakeSession, compile_statement
+
+
+def test_new_users_get_a_zeroed_row():
+    db = FakeSession()
+    user_id = uuid.uuid4()
+
+    create_user_stats(db, user_id)
+
+    sql, params = compile_statement(db.statements[0])
+    assert sql.startswith("INSERT INTO user_stats")
+    assert "ON CONFLICT (user_id) DO NOTHING" in sql
+    assert params["user_id"] == user_id
+    assert db.commits == 0
+
+
+def test_reading_a_missing_row_computes_it_without_writing():
+    user_id = uuid.uuid4()
+    db = FakeSession(rows=[{
+        "user_id": user_id, "completed_courses": 1, "favorites": 2, "notes": 3, "unread_messages": 4
+    }])
+
+    stats = get_user_stats(db, user_id)
+
+    assert (stats.completed_courses, stats.favorites, stats.notes, stats.unread_messages) == (1, 2, 3, 4)
+    sql, _ = compile_statement(db.statements[0])
+    assert sql.startswith("SELECT") and "user_stats" not in sql
+    assert len(db.statements) == 1 and db.commits == 0
+
+
+def test_reading_an_unknown_user_gives_zeros():
+    stats = get_user_stats(FakeSession(), uuid.uuid4())
+
+    assert (stats.completed_courses, stats.favorites, stats.notes, stats.unread_messages) == (0, 0, 0, 0)
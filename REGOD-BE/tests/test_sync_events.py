@@ -0,0 +1,241 @@
+import re
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.routes import sync
+from app.utils.helpers import encode_cursor
+from tests.fakes import FakeResult, FakeSession, api_client, compile_statement
+
+TEACHER_ID = uuid.uuid4()
+OTHER_TEACHER_ID = uuid.uuid4()
+
+
+class SyncSession(FakeSession):
+    """A FakeSession that answers the sync route's queries from a small world.
+
+    Course 1 belongs to a teacher the student has access to, course 2 to one
+    they don't. Lessons 10 and 11 are in course 1, lesson 20 in course 2.
+    The student owns notes 7 and 8 and has lesson 11 as a favourite.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.courses = {1: TEACHER_ID, 2: OTHER_TEACHER_ID}
+        self.modules = {10: 1, 11: 1, 20: 2}
+        self.notes = {7, 8}
+        self.favorites = {11}
+        self.next_note_id = 100
+
+    def execute(self, statement, *args, **kwargs) -> FakeResult:
+        self.statements.append(statement)
+        sql, _ = compile_statement(statement)
+        if sql.startswith("SELECT modules.id, modules.course_id"):
+            return FakeResult(list(self.modules.items()))
+        if sql.startswith("SELECT courses.id, courses.created_by"):
+            return FakeResult(list(self.courses.items()))
+        return FakeResult([])
+
+    def scalars(self, statement, params=None, **kwargs) -> FakeResult:
+        self.statements.append(statement)
+        sql, values = compile_statement(statement)
+        if sql.startswith("SELECT user_notes.id"):
+            return FakeResult(sorted(self.notes))
+        if sql.startswith("SELECT student_teacher_access.teacher_id"):
+            return FakeResult([TEACHER_ID])
+        if sql.startswith("INSERT INTO user_favorites"):
+            added = [row["lesson_id"] for row in inserted_rows(statement) if row["lesson_id"] not in self.favorites]
+            self.favorites.update(added)
+            return FakeResult(added)
+        if sql.startswith("DELETE FROM user_favorites"):
+            removed = [lesson_id for lesson_id in values["lesson_id_1"] if lesson_id in self.favorites]
+            self.favorites.difference_update(removed)
+            return FakeResult(removed)
+        if sql.startswith("INSERT INTO user_notes"):
+            # Postgres hands RETURNING rows back in any order unless asked for parameter order
+            assert statement._sort_by_parameter_order
+            ids = list(range(self.next_note_id, self.next_note_id + len(params)))
+            self.next_note_id += len(params)
+            return FakeResult(ids)
+        if sql.startswith("DELETE FROM user_notes"):
+            return FakeResult(sorted(values["id_1"]))
+        if sql.startswith("SELECT user_favorites.lesson_id"):
+            return FakeResult(sorted(self.favorites))
+        return FakeResult([])
+
+    def statements_starting(self, prefix: str) -> list:
+        return [statement for statement in self.statements if compile_statement(statement)[0].startswith(prefix)]
+
+
+def inserted_rows(statement) -> list:
+    """The rows of a multi-row INSERT, as dicts; other bound values are left out"""
+    rows = {}
+    for key, value in compile_statement(statement)[1].items():
+        match = re.fullmatch(r"(.+)_m(\d+)", key)
+        if match:
+            rows.setdefault(int(match[2]), {})[match[1]] = value
+    return [rows[index] for index in sorted(rows)]
+
+
+@pytest.fixture
+def student(user):
+    return SimpleNamespace(id=user.id, has_role=lambda role: role == "student")
+
+
+def sync_events(student, db, *events):
+    client = api_client(sync.router, "/api/sync", student, db)
+    response = client.post("/api/sync/events", json={"events": [
+        {"client_event_id": str(index), **event} for index, event in enumerate(events)
+    ]})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_oversized_batch_is_rejected_before_touching_the_database(user):
+    db = FakeSession()
+    client = api_client(sync.router, "/api/sync", user, db)
+
+    events = [
+        {"client_event_id": str(i), "type": "favorite", "lesson_id": 1, "is_favorite": True}
+        for i in range(sync.MAX_SYNC_EVENTS + 1)
+    ]
+    response = client.post("/api/sync/events", json={"events": events})
+
+    assert response.status_code == 413
+    assert db.statements == []
+
+
+@pytest.mark.parametrize("since", [
+    "garbage",
+    encode_cursor(5),
+    encode_cursor(5, 6, 1, 2),
+    encode_cursor(5, "6"),
+    encode_cursor(5.5, 6),
+])
+def test_changes_rejects_bad_cursors_before_querying(user, since):
+    db = FakeSession()
+    client = api_client(sync.router, "/api/sync", user, db)
+
+    response = client.get("/api/sync/changes", params={"since": since})
+
+    assert response.status_code == 400
+    assert db.statements == []
+
+
+def test_last_event_wins_per_course_lesson_and_note(student):
+    db = SyncSession()
+
+    body = sync_events(
+        student, db,
+        {"type": "progress", "course_id": 1, "progress_percentage": 30, "last_visited_module_id": 10},
+        {"type": "progress", "course_id": 1, "progress_percentage": 80},
+        {"type": "module_progress", "module_id": 10, "status": "in_progress"},
+        {"type": "module_progress", "module_id": 10, "status": "completed"},
+        {"type": "favorite", "lesson_id": 10, "is_favorite": True},
+        {"type": "favorite", "lesson_id": 10, "is_favorite": False},
+        {"type": "note_update", "note_id": 7, "note_content": "first"},
+        {"type": "note_update", "note_id": 7, "note_content": "second"},
+    )
+
+    assert {result["status"] for result in body["results"]} == {"applied"}
+
+    # One row per key, carrying the last event's values
+    [progress] = db.statements_starting("INSERT INTO user_course_progress")
+    assert [(row["course_id"], row["progress_percentage"], row["last_visited_module_id"])
+            for row in inserted_rows(progress)] == [(1, 80, 10)]
+
+    [modules] = db.statements_starting("INSERT INTO user_module_progress")
+    assert [(row["module_id"], row["status"]) for row in inserted_rows(modules)] == [(10, "completed")]
+
+    assert db.statements_starting("INSERT INTO user_favorites") == []
+    [unfavorite] = db.statements_starting("DELETE FROM user_favorites")
+    assert compile_statement(unfavorite)[1]["lesson_id_1"] == [10]
+
+    [patch] = db.statements_starting("UPDATE user_notes")
+    assert list(compile_statement(patch)[1].values()) == [7, "second", student.id]
+
+
+def test_missing_and_forbidden_courses_are_rejected_per_event(student):
+    db = SyncSession()
+
+    body = sync_events(
+        student, db,
+        {"type": "progress", "course_id": 99, "progress_percentage": 50},
+        {"type": "progress", "course_id": 2, "progress_percentage": 50},
+        {"type": "favorite", "lesson_id": 20, "is_favorite": True},
+        {"type": "note_create", "course_id": 1, "lesson_id": 20, "note_content": "wrong course"},
+        {"type": "progress", "course_id": 1, "progress_percentage": 50},
+    )
+
+    assert [(result["status"], result["error"]) for result in body["results"]] == [
+        ("rejected", "Course not found"),
+        ("rejected", "You don't have access to this course"),
+        ("rejected", "You don't have access to this course"),
+        ("rejected", "Lesson not found"),
+        ("applied", None),
+    ]
+    # The rejected events do not stop the rest of the batch
+    [progress] = db.statements_starting("INSERT INTO user_course_progress")
+    assert [row["course_id"] for row in inserted_rows(progress)] == [1]
+    assert db.statements_starting("INSERT INTO user_favorites") == []
+    assert db.statements_starting("INSERT INTO user_notes") == []
+
+
+def test_created_note_ids_line_up_with_their_events(student):
+    db = SyncSession()
+
+    body = sync_events(
+        student, db,
+        {"type": "note_create", "course_id": 1, "lesson_id": 10, "note_content": "first"},
+        {"type": "note_create", "course_id": 2, "lesson_id": 20, "note_content": "forbidden"},
+        {"type": "note_delete", "note_id": 7},
+        {"type": "note_create", "course_id": 1, "lesson_id": 11, "note_content": "second"},
+    )
+
+    assert [result["note_id"] for result in body["results"]] == [100, None, None, 101]
+    assert body["results"][1]["status"] == "rejected"
+
+
+def test_replaying_favorites_is_idempotent(student):
+    db = SyncSession()
+    events = (
+        {"type": "favorite", "lesson_id": 10, "is_favorite": True},
+        {"type": "favorite", "lesson_id": 11, "is_favorite": True},
+    )
+
+    first = sync_events(student, db, *events)
+    db.statements.clear()
+    replay = sync_events(student, db, *events)
+
+    assert first["favorite_lesson_ids"] == replay["favorite_lesson_ids"] == [10, 11]
+    assert {result["status"] for result in first["results"] + replay["results"]} == {"applied"}
+    # Nothing was inserted the second time, so the counters stay put
+    assert db.statements_starting("UPDATE user_stats") == []
+
+
+def test_updates_to_deleted_or_unknown_notes_are_rejected(student):
+    db = SyncSession()
+
+    body = sync_events(
+        student, db,
+        {"type": "note_update", "note_id": 8, "note_content": "edited, then deleted"},
+        {"type": "note_delete", "note_id": 7},
+        {"type": "note_update", "note_id": 7, "note_content": "too late"},
+        {"type": "note_delete", "note_id": 7},
+        {"type": "note_delete", "note_id": 8},
+        {"type": "note_update", "note_id": 9, "note_content": "not mine"},
+    )
+
+    assert [(result["status"], result["error"]) for result in body["results"]] == [
+        ("applied", None),
+        ("applied", None),
+        ("rejected", "Note not found"),
+        ("rejected", "Note not found"),
+        ("applied", None),
+        ("rejected", "Note not found"),
+    ]
+    # The update to note 8 is dropped with it
+    assert db.statements_starting("UPDATE user_notes") == []
+    [deleted] = db.statements_starting("DELETE FROM user_notes")
+    assert sorted(compile_statement(deleted)[1]["id_1"]) == [7, 8]
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.presence import TypingThrottle
+
+pytestmark = pytest.mark.anyio
+
+WINDOW_MS = 50
+AFTER_WINDOW = WINDOW_MS / 1000 * 3
+
+
+class RecordingFanout:
+    def __init__(self):
+        self.sent = []
+
+    async def send_to_user(self, user_id, message: dict):
+        self.sent.append((user_id, message["thread_id"], message["is_typing"]))
+
+
+@pytest.fixture
+def fanout():
+    return RecordingFanout()
+
+
+async def test_first_event_is_sent_and_repeats_are_coalesced(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    for _ in range(4):
+        await throttle.relay("u1", 7, "t1")
+    await asyncio.sleep(AFTER_WINDOW)
+
+    # The trailing state matches what was sent, so nothing more goes out
+    assert fanout.sent == [("t1", "7", True)]
+    assert throttle.stats() == {"received": 4, "relayed": 1, "coalesced": 3, "pending": 0}
+
+
+async def test_changed_state_is_sent_when_the_window_ends(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    await throttle.relay("u1", 7, "t1", True)
+    await throttle.relay("u1", 7, "t1", False)
+    assert fanout.sent == [("t1", "7", True)]
+
+    await asyncio.sleep(AFTER_WINDOW)
+    assert fanout.sent == [("t1", "7", True), ("t1", "7", False)]
+
+
+async def test_only_the_latest_state_in_a_window_counts(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    await throttle.relay("u1", 7, "t1", True)
+    await throttle.relay("u1", 7, "t1", False)
+    await throttle.relay("u1", 7, "t1", True)
+    await asyncio.sleep(AFTER_WINDOW)
+
+    assert fanout.sent == [("t1", "7", True)]
+
+
+async def test_next_window_sends_straight_away(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    await throttle.relay("u1", 7, "t1", True)
+    await asyncio.sleep(AFTER_WINDOW)
+    await throttle.relay("u1", 7, "t1", False)
+
+    assert fanout.sent == [("t1", "7", True), ("t1", "7", False)]
+
+
+async def test_threads_are_throttled_separately(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    await throttle.relay("u1", 7, "t1")
+    await throttle.relay("u1", 8, "t2")
+    await throttle.relay("u2", 7, "u1")
+
+    assert fanout.sent == [("t1", "7", True), ("t2", "8", True), ("u1", "7", True)]
+
+
+async def test_stop_drops_pending_trailing_sends(fanout):
+    throttle = TypingThrottle(fanout, WINDOW_MS)
+
+    await throttle.relay("u1", 7, "t1", True)
+    await throttle.relay("u1", 7, "t1", False)
+    await throttle.stop()
+    await asyncio.sleep(AFTER_WINDOW)
+
+    assert fanout.sent == [("t1", "7", True)]